@@ -1,3 +1,186 @@
-from django.test import TestCase
+import random
+from typing import List
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from utils import commonutils, grouperutils
+from utils.models.combinedmodels import Rank
+from utils.models import groupermodels
+
+
+def rank_values(key_ranks: List[Rank]) -> list:
+    """
+    Gets the values of the slots of ranks, to compare them by value
+    :param key_ranks: list of ranks
+    :return: list of dictionaries of slot to value
+    """
+    return [{slot: getattr(key_rank, slot) for slot in Rank.__slots__} for key_rank in key_ranks]
+
+
+def on_domain(url: str, domain: str) -> bool:
+    """
+    Checks if a url is on a domain by searching for the domain in the whole url
+    :param url: url to check
+    :param domain: domain to search for
+    :return: true if the domain is found after a dot or a double slash
+    """
+    return f".{domain}" in url or f"//{domain}" in url
+
+
+def reference_fetcher_rank(organic_results: List, answer_box_link: str, target_domain: str,
+                           competitor_domains: List[str]) -> List[Rank]:
+    """
+    Calculates the rank of the target and competitor domains in the organic results, one domain at a time
+    :param organic_results: list of organic results
+    :param answer_box_link: answer box link
+    :param target_domain: target domain
+    :param competitor_domains: list of competitor domains
+    :return: list of ranks of the target and competitor domains
+    """
+    key_ranks = []
+    for domain in [target_domain, *competitor_domains]:
+        key_rank = Rank()
+        if answer_box_link != "" and on_domain(answer_box_link, domain):
+            key_rank.client_ranking_position = 1
+            key_rank.client_url_ranking_count = key_rank.client_url_ranking_count + 1
+            key_rank.client_ranking_url = commonutils.remove_permalink(answer_box_link)
+        for result in organic_results:
+            if "link" in result and on_domain(result["link"], domain):
+                if key_rank.client_url_ranking_count == 0:
+                    key_rank.client_ranking_position = result["position"]
+                    key_rank.client_ranking_url = commonutils.remove_permalink(result["link"])
+                key_rank.client_url_ranking_count = key_rank.client_url_ranking_count + 1
+        key_ranks.append(key_rank)
+    return key_ranks
+
+
+def reference_grouper_rank(key_link: groupermodels.Node, competitor_domains: List[str],
+                           target_domain: str) -> List[Rank]:
+    """
+    Calculates the rank of the target and competitor domains for a keyword, one domain at a time
+    :param key_link: node to calculate rank for
+    :param competitor_domains: list of competitor domains
+    :param target_domain: target domain
+    :return: rank of target and competitor domains
+    """
+    key_ranks = []
+    for domain in [target_domain, *competitor_domains]:
+        key_rank = Rank()
+        for result in key_link.links:
+            if on_domain(result.url, domain):
+                if key_rank.client_url_ranking_count == 0:
+                    key_rank.client_ranking_position = result.position
+                    key_rank.client_ranking_url = result.url
+                key_rank.client_url_ranking_count = key_rank.client_url_ranking_count + 1
+                position = key_rank.client_ranking_position
+                ctr_value = grouperutils.CTR_LOOKUP[position - 1 if 1 <= position <= 20 else 19]
+                key_rank.current_traffic = ctr_value * key_link.search_volume * key_link.cps
+                key_rank.current_value = key_rank.current_traffic * key_link.cpc
+        key_ranks.append(key_rank)
+    return key_ranks
+
+
+def get_random_urls(generator: random.Random, domains: List[str], count: int) -> List[str]:
+    """
+    Gets lowercase urls on the domains, their subdomains and other domains, with a scheme and paths free of domains
+    :param generator: random number generator
+    :param domains: domains to make urls on
+    :param count: number of urls
+    :return: list of urls
+    """
+    hosts = []
+    for domain in domains:
+        hosts.extend([domain, f"www.{domain}", f"blog.shop.{domain}"])
+    hosts.extend(["other.com", "www.other.org", "news.site.net"])
+    urls = []
+    for _ in range(count):
+        scheme = generator.choice(["https://", "http://"])
+        port = generator.choice(["", ":8080"])
+        path = "/".join(generator.choice(["shoes", "red-shoes", "blog", "p"]) for _ in range(generator.randint(0, 3)))
+        fragment = generator.choice(["", "#:~:text=shoes"])
+        urls.append(f"{scheme}{generator.choice(hosts)}{port}/{path}{fragment}")
+    return urls
+
+
+class DomainMatcherTests(SimpleTestCase):
+
+    def test_matches_the_domains_of_a_hostname_and_its_parent_domains(self):
+        domain_matcher = commonutils.DomainMatcher(["example.com", "shop.example.com", "other.org", "example.com"])
+        self.assertEqual(domain_matcher.match("https://example.com/shoes"), [0, 3])
+        self.assertEqual(sorted(domain_matcher.match("https://www.shop.example.com/shoes")), [0, 1, 3])
+        self.assertEqual(domain_matcher.match("http://user@other.org:8080/shoes?q=1#top"), [2])
+        self.assertEqual(domain_matcher.match("www.other.org/shoes"), [2])
+        self.assertEqual(domain_matcher.match("https://notexample.com/shoes"), [])
+        self.assertEqual(domain_matcher.match("https://example.com.au/shoes"), [])
+
+    def test_domains_with_a_path_or_a_port_and_empty_domains_are_searched_in_the_url(self):
+        domain_matcher = commonutils.DomainMatcher(["", "example.com/blog", "example.com:8080", "example.com"])
+        self.assertEqual(domain_matcher.match("https://example.com/blog/shoes"), [3, 0, 1])
+        self.assertEqual(domain_matcher.match("https://www.example.com:8080/shoes"), [3, 0, 2])
+        self.assertEqual(domain_matcher.match("https://other.org/shoes"), [0])
+
+    def test_matchers_are_built_once_for_the_domains_of_a_job(self):
+        domain_matcher = commonutils.get_domain_matcher(("example.com", "other.org"))
+        self.assertIs(commonutils.get_domain_matcher(("example.com", "other.org")), domain_matcher)
+        self.assertIsNot(commonutils.get_domain_matcher(("other.org", "example.com")), domain_matcher)
+
+
+class CalculateRankTests(SimpleTestCase):
+    domains = ["example.com", "shop.example.com", "other.org", "site.net", "news.site.net", "example.co.uk"]
+
+    def test_fetcher_ranks_match_searching_every_domain_in_every_url(self):
+        generator = random.Random(11)
+        for _ in range(300):
+            domains = generator.sample(self.domains, generator.randint(1, len(self.domains)))
+            urls = get_random_urls(generator, self.domains, generator.randint(0, 20))
+            organic_results = [{"position": position, "link": url} for position, url in enumerate(urls, 1)]
+            if organic_results and generator.random() < 0.2:
+                del organic_results[0]["link"]
+            answer_box_link = generator.choice(["", *get_random_urls(generator, self.domains, 1)])
+            target_domain = generator.choice([domains[0], ""])
+            self.assertEqual(
+                rank_values(commonutils.calculate_rank(organic_results, answer_box_link, target_domain, domains[1:])),
+                rank_values(reference_fetcher_rank(organic_results, answer_box_link, target_domain, domains[1:])))
+
+    def test_grouper_ranks_match_searching_every_domain_in_every_url(self):
+        generator = random.Random(13)
+        for _ in range(300):
+            domains = generator.sample(self.domains, generator.randint(1, len(self.domains)))
+            key_link = groupermodels.Node()
+            key_link.search_volume = generator.randint(0, 5000)
+            key_link.cpc = generator.random() * 5
+            key_link.cps = generator.random()
+            for url in get_random_urls(generator, self.domains, generator.randint(0, 30)):
+                link = groupermodels.Link()
+                link.url = url
+                link.position = len(key_link.links) + 1
+                key_link.links.append(link)
+            self.assertEqual(
+                rank_values(grouperutils.calculate_rank(key_link, domains[1:], domains[0])),
+                rank_values(reference_grouper_rank(key_link, domains[1:], domains[0])))
+
+    def test_only_the_hostname_of_a_url_is_matched(self):
+        organic_results = [{"position": 1, "link": "https://other.org/reviews/www.example.com"},
+                           {"position": 2, "link": "https://other.org/?ref=//example.com"},
+                           {"position": 3, "link": "https://www.example.com/shoes"}]
+        key_rank, = commonutils.calculate_rank(organic_results, "", "example.com", [])
+        self.assertEqual((key_rank.client_ranking_position, key_rank.client_url_ranking_count), (3, 1))
+        # searching the whole url found the domain in the paths of other domains
+        reference_rank, = reference_fetcher_rank(organic_results, "", "example.com", [])
+        self.assertEqual((reference_rank.client_ranking_position, reference_rank.client_url_ranking_count), (1, 3))
+
+    def test_domains_do_not_match_hostnames_they_only_prefix(self):
+        organic_results = [{"position": 1, "link": "https://example.com/shoes"},
+                           {"position": 2, "link": "https://example.co/shoes"}]
+        key_rank, = commonutils.calculate_rank(organic_results, "", "example.co", [])
+        self.assertEqual((key_rank.client_ranking_position, key_rank.client_url_ranking_count), (2, 1))
+        reference_rank, = reference_fetcher_rank(organic_results, "", "example.co", [])
+        self.assertEqual((reference_rank.client_ranking_position, reference_rank.client_url_ranking_count), (1, 2))
+
+    def test_domains_match_hostnames_in_any_case(self):
+        organic_results = [{"position": 1, "link": "https://WWW.Example.COM/Shoes"}]
+        key_ranks = commonutils.calculate_rank(organic_results, "", "example.com", ["EXAMPLE.com"])
+        self.assertEqual([x.client_ranking_url for x in key_ranks], ["https://WWW.Example.COM/Shoes"] * 2)
+        self.assertEqual([x.client_url_ranking_count for x in reference_fetcher_rank(organic_results, "",
+                                                                                     "example.com", ["EXAMPLE.com"])],
+                         [0, 0])
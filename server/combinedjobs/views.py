@@ -6,9 +6,10 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from utils.celery import run_combined_job
+from utils.serputils import get_fetch_options
 from utils.logutils import *
 from utils.constants.fileconstants import *
-from utils.fetcherutils import write_output_file
+from utils.fetcherutils import get_completed_keywords
 
 
 class CombinedJobList(APIView):
@@ -29,10 +30,13 @@ class CombinedJobList(APIView):
             competitor_domains = request.data['competitor_domains']
             organic_results_count = 10
             no_of_clusters = 5
+            grouping_processes = 1
             if request.data["grouping_method"] == "Main + Variants":
                 hard_threshold = int(request.data["variant_keyword_grouping_accuracy"])
             if "no_of_clusters" in request.data:
                 no_of_clusters = int(request.data["no_of_clusters"])
+            if "grouping_processes" in request.data:
+                grouping_processes = int(request.data["grouping_processes"])
             ignore_special_characters = True
             if "ignore_special_characters" in request.data and request.data["ignore_special_characters"] == "false":
                 ignore_special_characters = False
@@ -51,7 +55,9 @@ class CombinedJobList(APIView):
                                           competitor_domains,
                                           ignore_special_characters,
                                           organic_results_count,
-                                          no_of_clusters)
+                                          no_of_clusters,
+                                          grouping_processes=grouping_processes,
+                                          **get_fetch_options(request.data))
         except Exception as inst:
             job_logger.error(inst)
             return Response({"status": "failed"}, status=status.HTTP_406_NOT_ACCEPTABLE)
@@ -92,8 +98,8 @@ class CombinedJobDetail(APIView):
         :return: response
         """
         try:
-            # To get the single DataFrame having all the snapshot files data merged in it
-            count, current_output_df = write_output_file(job_id, keep_snapshots=True, failure=True, job_type="combined")
+            # To get the number of snapshot segments and the keywords already in them from the manifest
+            count, completed_keywords = get_completed_keywords(job_id)
             if not count:
                 count = 0
                 already_searched_keywords_list = []
@@ -108,12 +114,16 @@ class CombinedJobDetail(APIView):
 
                 organic_results_count = 10
                 no_of_clusters = 5
+                grouping_processes = 1
                 if request.data["grouping_method"] == "Main + Variants":
                     hard_threshold = int(request.data["variant_keyword_grouping_accuracy"])
 
                 if "no_of_clusters" in request.data:
                     no_of_clusters = int(request.data["no_of_clusters"])
 
+                if "grouping_processes" in request.data:
+                    grouping_processes = int(request.data["grouping_processes"])
+
                 ignore_special_characters = True
                 if "ignore_special_characters" in request.data and request.data["ignore_special_characters"] == "false":
                     ignore_special_characters = False
@@ -135,20 +145,12 @@ class CombinedJobDetail(APIView):
                                               organic_results_count,
                                               no_of_clusters,
                                               count,
-                                              already_searched_keywords_list
+                                              already_searched_keywords_list,
+                                              grouping_processes,
+                                              **get_fetch_options(request.data)
                                               )
             else:
-                # Getting keywords coloumn from the DataFrame
-                output_keywords_series = current_output_df.iloc[:, 0]
-                # bulk_output_keywords_series = current_bulk_output_df.iloc[:,0]
-
-                # Converting the output from series type to list
-                output_keywords_list = output_keywords_series.tolist()
-                # bulk_output_keywords_list = bulk_output_keywords_series.tolist()
-
-                # Removing duplicate keywords from the lists
-                already_searched_keywords_list = list(dict.fromkeys(output_keywords_list))
-                # already_searched_bulk_keywords_list=list(dict.fromkeys(bulk_output_keywords_list))
+                already_searched_keywords_list = completed_keywords
 
                 # Input file on what job needs to be resumed
                 full_path = request.data["input_file_path"]
@@ -161,12 +163,16 @@ class CombinedJobDetail(APIView):
 
                 organic_results_count = 10
                 no_of_clusters = 5
+                grouping_processes = 1
                 if request.data["grouping_method"] == "Main + Variants":
                     hard_threshold = int(request.data["variant_keyword_grouping_accuracy"])
 
                 if "no_of_clusters" in request.data:
                     no_of_clusters = int(request.data["no_of_clusters"])
 
+                if "grouping_processes" in request.data:
+                    grouping_processes = int(request.data["grouping_processes"])
+
                 ignore_special_characters = True
                 if "ignore_special_characters" in request.data and request.data["ignore_special_characters"] == "false":
                     ignore_special_characters = False
@@ -188,7 +194,9 @@ class CombinedJobDetail(APIView):
                                               organic_results_count,
                                               no_of_clusters,
                                               count,
-                                              already_searched_keywords_list
+                                              already_searched_keywords_list,
+                                              grouping_processes,
+                                              **get_fetch_options(request.data)
                                               )
         except Exception as inst:
             print(inst)
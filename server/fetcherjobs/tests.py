@@ -1,3 +1,1292 @@
-from django.test import TestCase
+import asyncio
+import collections
+import csv
+import io
+import itertools
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from statistics import median
+from unittest import mock, skipIf
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+import requests
+from aiohttp import web
+from django.test import SimpleTestCase
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from utils import commonutils, fetcherutils, serputils, serpcacheutils, archiveutils
+from utils import celery as celery_tasks
+from utils.ratelimitutils import TokenBucket, AdaptiveConcurrency, InProcessRateLimitStore, RedisRateLimitStore, \
+    SerpRateLimiter, release_rate_limiter
+from utils.models.combinedmodels import Rank
+from utils.constants.fetcherconstants import CTR_LOOKUP_MATRIX, FEATURE_MASK_COUNT
+from utils.models.fetchermodels import Node, Feature, Arguments, Link
+
+
+def reference_input_queries(input_keywords_df: pd.DataFrame, already_searched_keywords_list: list) -> list:
+    """
+    Gets the input queries row by row, filling the missing CPC and CPS values with their medians
+    :param input_keywords_df: The input DataFrame
+    :param already_searched_keywords_list: list of keywords that are not needed to be searched again
+    :return: list of keyword, volume, CPC, CPS and difficulty of every query
+    """
+    input_keywords_df = input_keywords_df[input_keywords_df['Keyword'].notnull()]
+    input_keywords_df = input_keywords_df[~input_keywords_df['Keyword'].isin(already_searched_keywords_list)]
+    input_keywords_df = input_keywords_df.reset_index()
+    for column in ('CPC', 'CPS', 'Difficulty'):
+        input_keywords_df[column] = pd.to_numeric(input_keywords_df[column], errors='coerce')
+    query_queue = []
+    for i in range(len(input_keywords_df)):
+        row = input_keywords_df.iloc[i]
+        query = Node()
+        query.keyword = row["Keyword"]
+        if not pd.isna(row["Volume"]):
+            if isinstance(row["Volume"], str):
+                if "-" in row["Volume"] and row["Volume"].split("-")[1].isnumeric():
+                    query.volume = float(row["Volume"].split("-")[1])
+                if row["Volume"].isnumeric():
+                    query.volume = float(row["Volume"])
+            else:
+                query.volume = row["Volume"]
+        for column, attribute in (("CPC", "cpc"), ("CPS", "cps"), ("Difficulty", "difficulty")):
+            if not pd.isna(row[column]):
+                setattr(query, attribute, row[column])
+        query_queue.append(query)
+    cpc_values = [x.cpc for x in query_queue if x.cpc != -1]
+    cps_values = [x.cps for x in query_queue if x.cps != -1]
+    cpc_median = median(cpc_values) if cpc_values else fetcherutils.cpc_median
+    cps_median = median(cps_values) if cps_values else fetcherutils.cps_median
+    return [(x.keyword, x.volume, x.cpc if x.cpc != -1 else cpc_median, x.cps if x.cps != -1 else cps_median,
+             x.difficulty) for x in query_queue]
+
+
+def slot_values(value):
+    """
+    Gets the values of the slots of a model, recursively, to compare models by value
+    :param value: model, list of models or value
+    :return: dictionary of slot to value, list of them or the value
+    """
+    if isinstance(value, list):
+        return [slot_values(x) for x in value]
+    if hasattr(value, "__slots__"):
+        return {slot: slot_values(getattr(value, slot)) for slot in value.__slots__}
+    return value
+
+
+def get_fake_search_results(keyword: str) -> dict:
+    """
+    Gets canned SERP API results of a keyword
+    :param keyword: keyword searched
+    :return: SERP API results
+    """
+    organic_results = [{"position": position, "link": f"https://site{position}.com/{keyword.replace(' ', '-')}",
+                        "title": f"Title {position}", "snippet": f"Snippet {position}"} for position in range(1, 4)]
+    return {"search_information": {}, "organic_results": organic_results}
+
+
+class FakeSerpServer:
+    """
+    Local SERP API answering on a thread of its own, the prefix of a keyword picks the response
+    """
+
+    def __init__(self):
+        self.requests = collections.Counter()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.runner = None
+        self.url = ""
+
+    async def search(self, request: web.Request) -> web.Response:
+        keyword = request.query["q"]
+        self.requests[keyword] = self.requests[keyword] + 1
+        if keyword.startswith("throttled") or (keyword.startswith("flaky") and self.requests[keyword] == 1):
+            return web.json_response({"error": "Too many requests"}, status=503)
+        if keyword.startswith("invalid"):
+            return web.json_response({"error": "Invalid API key"}, status=401)
+        if keyword.startswith("slow"):
+            await asyncio.sleep(2)
+        if keyword.startswith("broken"):
+            return web.Response(text="<html>Bad gateway</html>")
+        if keyword.startswith("malformed"):
+            return web.json_response({"organic_results": 5})
+        if keyword.startswith("misspelled"):
+            return web.json_response({"search_information": {"spelling_fix": keyword}})
+        return web.json_response(get_fake_search_results(keyword))
+
+    async def start_site(self):
+        app = web.Application()
+        app.router.add_get("/search", self.search)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{self.runner.addresses[0][1]}"
+
+    def start(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.start_site(), self.loop).result()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class FetcherTestCase(SimpleTestCase):
+
+    def setUp(self):
+        socket_patcher = mock.patch("utils.socketutils.sio")
+        socket_patcher.start()
+        self.addCleanup(socket_patcher.stop)
+        for name in ("cpc_median", "cps_median"):
+            median_patcher = mock.patch(f"utils.fetcherutils.{name}", getattr(fetcherutils, name))
+            median_patcher.start()
+            self.addCleanup(median_patcher.stop)
+
+
+class InputQueriesTests(FetcherTestCase):
+    input_csv = ("Keyword,Volume,CPC,CPS,Difficulty\n"
+                 "running shoes,1000-5000,1.5,0.4,30\n"
+                 "trail shoes,500,,0.2,abc\n"
+                 "red shoes,100-abc,2.5,,12.5\n"
+                 ",100,1,1,1\n"
+                 "cheap shoes,,n/a,0.9,\n"
+                 "blue shoes,  50,0.5,0.1,40\n"
+                 "nike shoes,250.5,3,0.3,55\n"
+                 "shoes sale,abc,,,\n")
+
+    def get_queries(self, input_csv: str, already_searched_keywords_list: list):
+        input_keywords_df = pd.read_csv(io.StringIO(input_csv))
+        arguments = Arguments()
+        arguments.input_file_path = "input.csv"
+        with mock.patch("utils.fetcherutils.read_csv_from_google_cloud", return_value=input_keywords_df.copy()):
+            query_queue = fetcherutils.get_input_queries(arguments=arguments,
+                                                         already_searched_keywords_list=already_searched_keywords_list)
+        return [(x.keyword, x.volume, x.cpc, x.cps, x.difficulty) for x in query_queue], \
+            reference_input_queries(input_keywords_df, already_searched_keywords_list)
+
+    def test_input_queries_match_reading_row_by_row(self):
+        for already_searched_keywords_list in ([], ["trail shoes", "nike shoes", "unknown"]):
+            queries, expected = self.get_queries(self.input_csv, already_searched_keywords_list)
+            self.assertEqual(queries, expected)
+        self.assertEqual(queries[0], ("running shoes", 5000.0, 1.5, 0.4, 30.0))
+        self.assertEqual(len(queries), 5)
+
+    def test_missing_values_are_filled_with_the_medians_of_the_job(self):
+        queries, expected = self.get_queries(self.input_csv, [])
+        self.assertEqual(queries, expected)
+        self.assertEqual(queries[1][2], median([1.5, 2.5, 0.5, 3]))
+        self.assertEqual(queries[2][3], median([0.4, 0.2, 0.9, 0.1, 0.3]))
+
+    def test_inputs_without_values_use_the_default_medians(self):
+        queries, _ = self.get_queries("Keyword,Volume,CPC,CPS,Difficulty\nrunning shoes,,,,\n", [])
+        self.assertEqual(queries, [("running shoes", Node().volume, fetcherutils.cpc_median, fetcherutils.cps_median,
+                                    Node().difficulty)])
+
+
+class ModelTests(SimpleTestCase):
+
+    def test_models_initialise_every_slot_without_an_instance_dictionary(self):
+        for model in (Node, Link, Feature):
+            instance = model()
+            self.assertFalse(hasattr(instance, "__dict__"))
+            for slot in model.__slots__:
+                getattr(instance, slot)
+
+    def test_mutable_defaults_are_not_shared_between_instances(self):
+        query_1, query_2 = Node(), Node()
+        query_1.links.append(Link())
+        query_1.primary_search_intents.append("informational")
+        query_1.secondary_search_intents.append("local")
+        query_1.competitor_ranks.append(Rank())
+        query_1.rank.client_ranking_position = 1
+        self.assertEqual((query_2.links, query_2.primary_search_intents, query_2.secondary_search_intents,
+                          query_2.competitor_ranks, query_2.rank.client_ranking_position), ([], [], [], [], 101))
+        self.assertIsNot(query_1.rank, query_2.rank)
+
+
+class FakeSerpTestCase(FetcherTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeSerpServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.job_id = str(uuid.uuid4())
+        self.arguments = Arguments()
+        self.arguments.api_key = "test"
+        self.arguments.cache_max_age = 0
+        self.addCleanup(release_rate_limiter, self.arguments.api_key, self.job_id)
+        cache_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_directory.cleanup)
+        self.cache = serpcacheutils.SqliteSerpCache(os.path.join(cache_directory.name, "serp_cache.sqlite3"),
+                                                    max_size=1024 ** 2)
+        for target, value in (("utils.serputils.serp_api_url", f"{self.server.url}/search"),
+                              ("utils.serputils.serp_request_timeout", 1),
+                              ("utils.serputils.serp_max_retries", 1),
+                              ("utils.fetcherutils.serp_max_retries", 1),
+                              ("serpapi.GoogleSearch.BACKEND", self.server.url),
+                              ("utils.serputils.serp_archive_enabled", False),
+                              ("utils.ratelimitutils.serp_retry_delay", 0),
+                              ("utils.serpcacheutils.serp_cache", self.cache)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_queries(self, *keywords: str) -> list:
+        queries = []
+        for keyword in keywords:
+            query = Node()
+            query.keyword = keyword
+            queries.append(query)
+        return queries
+
+
+class AsyncFetchTests(FakeSerpTestCase):
+
+    def fetch(self, queries: list):
+        key_link_dict = []
+        failed_count = serputils.fetch_keywords_async(queries=queries, arguments=self.arguments,
+                                                      store=key_link_dict.append, concurrency=3, job_id=self.job_id,
+                                                      target_domain="site2.com", competitor_domains=["site3.com"])
+        return failed_count, key_link_dict
+
+    def test_fetches_every_keyword_and_searches_duplicates_once(self):
+        queries = self.get_queries("red shoes", "blue shoes", "Red  Shoes", "misspelled shoes", "flaky shoes",
+                                   "invalid shoes")
+        failed_count, key_link_dict = self.fetch(queries)
+        self.assertEqual(failed_count, 0)
+        self.assertEqual(self.server.requests, {"red shoes": 1, "blue shoes": 1, "misspelled shoes": 1,
+                                                "flaky shoes": 2, "invalid shoes": 1})
+        fetched = {x.keyword: [link.url for link in x.links] for x in key_link_dict if x is not None}
+        expected = {keyword: [x["link"] for x in get_fake_search_results(search)["organic_results"]]
+                    for keyword, search in (("red shoes", "red shoes"), ("Red  Shoes", "red shoes"),
+                                            ("blue shoes", "blue shoes"), ("flaky shoes", "flaky shoes"))}
+        # errors which are not worth retrying parse to no results, as SERP API answered them
+        expected["invalid shoes"] = []
+        self.assertEqual(fetched, expected)
+        self.assertEqual(key_link_dict.count(None), 1)
+
+    def test_counts_the_keywords_which_fail_and_fetches_the_others(self):
+        queries = self.get_queries("throttled shoes", "slow shoes", "broken shoes", "malformed shoes",
+                                   "Broken Shoes", "red shoes")
+        failed_count, key_link_dict = self.fetch(queries)
+        self.assertEqual(failed_count, 5)
+        self.assertEqual([x.keyword for x in key_link_dict], ["red shoes"])
+        # throttled searches are retried before giving up
+        self.assertEqual(self.server.requests["throttled shoes"], 2)
+        self.assertEqual(self.server.requests["broken shoes"], 1)
+
+    def test_hands_the_nodes_over_to_the_store_off_the_event_loop(self):
+        store_threads = set()
+        key_link_dict = []
+
+        def store(key_link):
+            store_threads.add(threading.get_ident())
+            key_link_dict.append(key_link)
+
+        failed_count = serputils.fetch_keywords_async(queries=self.get_queries("red shoes", "Red Shoes", "blue shoes"),
+                                                      arguments=self.arguments, store=store, concurrency=2,
+                                                      job_id=self.job_id, target_domain="site2.com",
+                                                      competitor_domains=["site3.com"])
+        self.assertEqual(failed_count, 0)
+        self.assertEqual(sorted(x.keyword for x in key_link_dict), ["Red Shoes", "blue shoes", "red shoes"])
+        self.assertTrue(store_threads)
+        self.assertNotIn(threading.get_ident(), store_threads)
+
+
+class SnapshotWriterTests(FetcherTestCase):
+
+    def test_writes_a_snapshot_every_snapshot_record_count_keywords(self):
+        written = []
+        with mock.patch("utils.fetcherutils.write_snapshot_file",
+                        lambda key_link_dict, count, job_id, job_type: written.append(list(key_link_dict))):
+            snapshot_writer = fetcherutils.SnapshotWriter(1, 3, "test", "fetcher", total_queries=8)
+            queries = []
+            for k in range(8):
+                query = Node()
+                query.keyword = f"shoes {k}"
+                queries.append(query)
+                snapshot_writer.put(query)
+                # misspelled keywords are counted but not written
+                snapshot_writer.put(None)
+            snapshot_writer.close()
+        self.assertEqual(written, [queries[:3], queries[3:6], queries[6:]])
+
+    def test_keeps_draining_the_keywords_after_a_failed_snapshot(self):
+        def write_snapshot_file(key_link_dict, count, job_id, job_type):
+            raise OSError("No space left on device")
+
+        with mock.patch("utils.fetcherutils.write_snapshot_file", write_snapshot_file), \
+                mock.patch("utils.fetcherutils.snapshot_queue_size", 1):
+            snapshot_writer = fetcherutils.SnapshotWriter(1, 1, "test", "fetcher", total_queries=50)
+            thread = threading.Thread(target=lambda: [snapshot_writer.put(Node()) for _ in range(50)])
+            thread.start()
+            # the fetch workers are not blocked by a writer which failed
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+            with self.assertRaises(OSError):
+                snapshot_writer.close()
+
+
+def reference_output_files(file_names: list, header: list) -> tuple:
+    """
+    Gets the outputs of snapshots by concatenating them and sorting the rows by keyword in memory
+    :param file_names: paths of the snapshots
+    :param header: header of the snapshots
+    :return: top results output and bulk output as DataFrames
+    """
+    snapshots_df = pd.concat([pd.read_csv(file_name, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+                              for file_name in file_names], ignore_index=True)
+    snapshots_df.sort_values(by=header[0], ignore_index=True, inplace=True, kind="stable")
+    views = snapshots_df.pop(fetcherutils.snapshot_views_column).astype(int)
+    output_df = snapshots_df[(views & fetcherutils.snapshot_top_view) > 0].reset_index(drop=True)
+    bulk_output_df = snapshots_df[(views & fetcherutils.snapshot_bulk_view) > 0].reset_index(drop=True)
+    bulk_output_df["Related Results Count"] = "0"
+    return output_df, bulk_output_df
+
+
+class SnapshotMergeTests(SimpleTestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.header = fetcherutils.get_header_array(competitor_count=1) + [fetcherutils.snapshot_views_column]
+        generator = random.Random(7)
+        keywords = [f"shoes {k}" for k in range(40)]
+        self.file_names = []
+        for segment in range(9):
+            rows = []
+            for keyword in generator.sample(keywords, 12):
+                for rank in range(generator.randint(1, 4)):
+                    row = [f"{segment}-{rank}-{k}" for k in range(len(self.header))]
+                    row[0] = keyword
+                    row[-1] = str(generator.choice([1, 2, 3]))
+                    rows.append(row)
+            rows.sort(key=lambda row: row[0])
+            file_name = os.path.join(self.temp_dir.name, f"segment_{segment + 1}.csv")
+            with open(file_name, "w", newline="", encoding="utf-8-sig") as snapshot_file:
+                writer = csv.writer(snapshot_file)
+                writer.writerow(self.header)
+                writer.writerows(rows)
+            self.file_names.append(file_name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def merge(self):
+        output_file_name = os.path.join(self.temp_dir.name, "output.csv")
+        bulk_output_file_name = os.path.join(self.temp_dir.name, "bulk_output.csv")
+        fetcherutils.merge_snapshot_files(self.file_names, output_file_name, bulk_output_file_name)
+        return tuple(pd.read_csv(file_name, dtype=str, keep_default_na=False)
+                     for file_name in (output_file_name, bulk_output_file_name))
+
+    def test_merge_matches_sorting_the_snapshots_in_memory(self):
+        output_df, bulk_output_df = self.merge()
+        expected_output_df, expected_bulk_output_df = reference_output_files(self.file_names, self.header)
+        pd.testing.assert_frame_equal(output_df, expected_output_df)
+        pd.testing.assert_frame_equal(bulk_output_df, expected_bulk_output_df)
+        self.assertEqual(list(output_df.columns), self.header[:-1])
+
+    def test_merges_in_passes_of_at_most_the_fan_in_files(self):
+        expected = self.merge()
+        opened = []
+
+        def merge_sorted_files(file_names, output_file_name, header):
+            opened.append(len(file_names))
+            merge_sorted_files.original(file_names, output_file_name, header)
+
+        merge_sorted_files.original = fetcherutils.merge_sorted_files
+        with mock.patch("utils.fetcherutils.snapshot_merge_fan_in", 2), \
+                mock.patch("utils.fetcherutils.merge_sorted_files", merge_sorted_files):
+            merged = self.merge()
+        # 9 snapshots are merged into 5, 3 and then 2 runs, which the last pass splits into the outputs
+        self.assertEqual(opened, [2, 2, 2, 2, 1, 2, 2, 1, 2, 1])
+        for merged_df, expected_df in zip(merged, expected):
+            pd.testing.assert_frame_equal(merged_df, expected_df)
+        # the runs of the passes are removed once the outputs are written
+        self.assertEqual(sorted(os.listdir(self.temp_dir.name)),
+                         sorted(["output.csv", "bulk_output.csv"] + [os.path.basename(x) for x in self.file_names]))
+
+
+class SnapshotManifestTests(FetcherTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        base_dir_patcher = mock.patch("utils.fetcherutils.project_base_dir", self.temp_dir.name)
+        base_dir_patcher.start()
+        self.addCleanup(base_dir_patcher.stop)
+        self.job_id = "test"
+        self.count = [0]
+
+    def write_segment(self, *keywords):
+        key_link_dict = []
+        for keyword in keywords:
+            query = Node()
+            query.keyword = keyword
+            key_link_dict.append(fetcherutils.process_search_results(
+                query=query, search_results=get_fake_search_results(keyword), target_domain="site2.com",
+                competitor_domains=["site3.com"]))
+        fetcherutils.write_snapshot_file(key_link_dict, self.count, self.job_id)
+
+    def test_manifest_lists_the_segments_with_their_rows_and_keywords(self):
+        self.write_segment("red shoes", "blue shoes")
+        self.write_segment("green shoes")
+        segments = fetcherutils.read_snapshot_manifest(self.job_id)
+        self.assertEqual([(x["segment"], x["file"], x["keywords"]) for x in segments],
+                         [(1, "segment_1.csv", ["blue shoes", "red shoes"]), (2, "segment_2.csv", ["green shoes"])])
+        snapshot_dir = fetcherutils.get_snapshot_dir(self.job_id)
+        for segment in segments:
+            segment_df = pd.read_csv(os.path.join(snapshot_dir, segment["file"]), encoding="utf-8-sig")
+            views = segment_df[fetcherutils.snapshot_views_column]
+            self.assertEqual(segment["rows"], ((views & fetcherutils.snapshot_top_view) > 0).sum())
+            self.assertEqual(segment["bulk_rows"], ((views & fetcherutils.snapshot_bulk_view) > 0).sum())
+        # resuming used to read the keywords of every snapshot
+        snapshots_df = pd.concat([pd.read_csv(os.path.join(snapshot_dir, x["file"]), encoding="utf-8-sig")
+                                  for x in segments])
+        count, completed_keywords = fetcherutils.get_completed_keywords(self.job_id)
+        self.assertEqual(count, 2)
+        self.assertEqual(sorted(completed_keywords), sorted(snapshots_df["Keyword"].unique()))
+
+    def test_resume_skips_the_segment_cut_short_by_a_killed_job(self):
+        self.write_segment("red shoes")
+        manifest_file_name = os.path.join(fetcherutils.get_snapshot_dir(self.job_id),
+                                          fetcherutils.snapshot_manifest_name)
+        with open(manifest_file_name, "ab") as manifest_file:
+            manifest_file.write(b'{"segment": 2, "file": "segment_2.csv", "keywords": ["blue')
+        count, completed_keywords = fetcherutils.get_completed_keywords(self.job_id)
+        self.assertEqual((count, completed_keywords), (1, ["red shoes"]))
+        # the resumed job numbers its segments on from the last complete one
+        self.count = [count]
+        self.write_segment("blue shoes")
+        self.assertEqual(fetcherutils.get_completed_keywords(self.job_id), (2, ["red shoes", "blue shoes"]))
+
+    def test_output_merges_the_segments_of_the_manifest_only(self):
+        self.assertEqual(fetcherutils.write_output_file(self.job_id), (None, None, None))
+        self.write_segment("red shoes", "blue shoes")
+        self.write_segment("green shoes")
+        snapshot_dir = fetcherutils.get_snapshot_dir(self.job_id)
+        # a segment whose job was killed before it was added to the manifest
+        with open(os.path.join(snapshot_dir, "segment_3.csv"), "w", encoding="utf-8-sig") as segment_file:
+            segment_file.write("Keyword\nbrown shoes\n")
+        snapshots_path, output_file_name, bulk_output_file_name = fetcherutils.write_output_file(self.job_id)
+        self.assertEqual(snapshots_path, snapshot_dir)
+        segments = fetcherutils.read_snapshot_manifest(self.job_id)
+        for file_name, rows in ((output_file_name, "rows"), (bulk_output_file_name, "bulk_rows")):
+            output_df = pd.read_csv(file_name)
+            self.assertEqual(sorted(output_df["Keyword"].unique()), ["blue shoes", "green shoes", "red shoes"])
+            self.assertEqual(len(output_df), sum(x[rows] for x in segments))
+        fetcherutils.delete_snapshots(snapshots_path, self.job_id)
+        self.assertFalse(os.path.exists(snapshot_dir))
+        self.assertEqual(fetcherutils.get_completed_keywords(self.job_id), (0, []))
+
+
+def get_rich_search_results(keyword: str) -> dict:
+    """
+    Gets canned SERP API results of a keyword with an answer box and more than 10 organic results
+    :param keyword: keyword searched
+    :return: SERP API results
+    """
+    slug = keyword.replace(" ", "-")
+    organic_results = []
+    for position in range(1, 15):
+        result = {"position": position, "link": f"https://site{position}.com/{slug}#:~:text=shoes",
+                  "title": f"Title {position}", "snippet": f"Snippet; {position}"}
+        if position % 4 == 0:
+            del result["snippet"]
+        if position % 3 == 0:
+            result["related_results"] = [{"link": f"https://site{position}.com/related/{k}"} for k in range(position)]
+        organic_results.append(result)
+    answer_box = {"type": "organic_result", "link": f"https://answers.com/{slug}", "title": "Answer",
+                  "snippet": "Answer; snippet"}
+    return {"search_information": {}, "answer_box": answer_box, "organic_results": organic_results}
+
+
+def reference_links(search_results: dict) -> tuple:
+    """
+    Gets the links of the top results node and the bulk node which used to be kept for every keyword
+    :param search_results: SERP API results
+    :return: links of the top results node and links of the bulk node
+    """
+    links = []
+    bulk_links = []
+    answer_box = search_results.get("answer_box", {})
+    if answer_box.get("type") == "organic_result":
+        cur_link = Link()
+        cur_link.url = fetcherutils.remove_permalink(answer_box["link"])
+        cur_link.title = answer_box["title"]
+        cur_link.snippet = answer_box.get("snippet", "").replace(";", "\";\"")
+        cur_link.position = 1
+        links.append(cur_link)
+    organic_results = search_results.get("organic_results", [])
+    for result in organic_results:
+        cur_link = Link()
+        cur_link.url = fetcherutils.remove_permalink(result["link"])
+        cur_link.position = result["position"]
+        cur_link.title = result["title"]
+        cur_link.snippet = result.get("snippet", "").replace(";", "\";\"")
+        bulk_links.append(cur_link)
+    for result in organic_results[:10]:
+        cur_link = Link()
+        if "related_results" in result:
+            cur_link.related_results_count = len(result["related_results"])
+        cur_link.url = fetcherutils.remove_permalink(result["link"])
+        cur_link.position = result["position"]
+        cur_link.title = result["title"]
+        cur_link.snippet = result.get("snippet", "").replace(";", "\";\"")
+        links.append(cur_link)
+    return links, bulk_links
+
+
+def reference_out_row(key_link: Node, link: Link) -> list:
+    """
+    Generates the row of a link for the output file, computing the keyword columns for every link
+    :param key_link: Node object containing the keyword and it's respective fields
+    :param link: Link object containing the link and it's respective fields
+    :return: A list containing the row data
+    """
+    comp_score, comp_count = fetcherutils.calc_competitor_score(key_link=key_link)
+    out_row = [
+        key_link.keyword, key_link.volume, link.url, link.position, link.title, link.snippet,
+        "/".join(key_link.primary_search_intents), "/".join(key_link.secondary_search_intents),
+        key_link.rank.client_ranking_url, key_link.rank.client_ranking_position,
+        key_link.rank.client_url_ranking_count, key_link.cpc, key_link.cps, key_link.difficulty,
+        key_link.current_traffic, key_link.potential_traffic, key_link.current_value, key_link.potential_value,
+        key_link.fibonacci_helper, key_link.potential_value - key_link.current_value,
+        key_link.volume - key_link.current_traffic, comp_score, comp_count, link.related_results_count
+    ]
+    for comp_rank in key_link.competitor_ranks:
+        out_row.extend([comp_rank.client_ranking_url, comp_rank.client_ranking_position, comp_rank.current_traffic,
+                        comp_rank.current_value])
+    return out_row
+
+
+def csv_rows(rows: list) -> list:
+    """
+    Gets rows as they read back from a CSV file
+    :param rows: rows of values
+    :return: rows of strings
+    """
+    csv_file = io.StringIO()
+    csv.writer(csv_file).writerows(rows)
+    csv_file.seek(0)
+    return list(csv.reader(csv_file))
+
+
+class SnapshotViewTests(FetcherTestCase):
+
+    def get_key_link(self, keyword: str, search_results: dict) -> Node:
+        query = Node()
+        query.keyword = keyword
+        query.volume = 1000
+        return fetcherutils.process_search_results(query=query, search_results=search_results,
+                                                   target_domain="site2.com", competitor_domains=["site3.com"])
+
+    def test_views_hold_the_links_of_the_top_results_and_bulk_nodes(self):
+        for search_results in (get_rich_search_results("red shoes"), get_fake_search_results("red shoes"),
+                               {"search_information": {}}):
+            key_link = self.get_key_link("red shoes", search_results)
+            snapshot_links = list(fetcherutils.get_snapshot_links(key_link))
+            links, bulk_links = reference_links(search_results)
+            self.assertEqual(slot_values([link for link, views in snapshot_links
+                                          if views & fetcherutils.snapshot_top_view]), slot_values(links))
+            # the bulk output drops the related results counts of the top results
+            bulk_values = slot_values([link for link, views in snapshot_links
+                                       if views & fetcherutils.snapshot_bulk_view])
+            for values in bulk_values:
+                values["related_results_count"] = 0
+            self.assertEqual(bulk_values, slot_values(bulk_links))
+
+    def test_outputs_match_the_old_top_results_and_bulk_snapshots(self):
+        search_results = {"red shoes": get_rich_search_results("red shoes"),
+                          "blue shoes": get_fake_search_results("blue shoes"),
+                          "green shoes": get_rich_search_results("green shoes")}
+        key_link_dict = [self.get_key_link(keyword, x) for keyword, x in search_results.items()]
+        rows = []
+        bulk_rows = []
+        for key_link in sorted(key_link_dict, key=lambda x: x.keyword):
+            links, bulk_links = reference_links(search_results[key_link.keyword])
+            rows.extend(reference_out_row(key_link, link) for link in links)
+            bulk_rows.extend(reference_out_row(key_link, link) for link in bulk_links)
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch("utils.fetcherutils.project_base_dir", temp_dir):
+            fetcherutils.write_snapshot_file(key_link_dict[:2], [0], "test")
+            fetcherutils.write_snapshot_file(key_link_dict[2:], [1], "test")
+            snapshots_path, output_file_name, bulk_output_file_name = fetcherutils.write_output_file("test")
+            outputs = []
+            for file_name in (output_file_name, bulk_output_file_name):
+                with open(file_name, newline="", encoding="utf-8") as output_file:
+                    outputs.append(list(csv.reader(output_file)))
+        header = fetcherutils.get_header_array(competitor_count=1)
+        self.assertEqual(outputs, [[header] + csv_rows(rows), [header] + csv_rows(bulk_rows)])
+
+
+class OutRowTests(FetcherTestCase):
+
+    def test_out_rows_match_the_row_of_every_link(self):
+        for competitor_domains in ([], ["site3.com"], ["site3.com", "site5.com", "answers.com"]):
+            query = Node()
+            query.keyword = "red shoes"
+            query.volume = 1000
+            key_link = fetcherutils.process_search_results(
+                query=query, search_results=get_rich_search_results("red shoes"), target_domain="site2.com",
+                competitor_domains=competitor_domains)
+            snapshot_links = list(fetcherutils.get_snapshot_links(key_link))
+            expected = [reference_out_row(key_link, link) + [views] for link, views in snapshot_links]
+            self.assertEqual(len(key_link.competitor_ranks), len(competitor_domains))
+            self.assertEqual(len(expected), 15)
+            self.assertEqual(fetcherutils.get_out_rows(key_link, snapshot_links), expected)
+
+    def test_keyword_columns_are_computed_once_per_keyword(self):
+        query = Node()
+        query.keyword = "red shoes"
+        key_link = fetcherutils.process_search_results(query=query, search_results=get_rich_search_results("red shoes"),
+                                                       target_domain="site2.com", competitor_domains=["site3.com"])
+        with mock.patch("utils.fetcherutils.calc_competitor_score",
+                        wraps=fetcherutils.calc_competitor_score) as calc_competitor_score:
+            rows = fetcherutils.get_out_rows(key_link, fetcherutils.get_snapshot_links(key_link))
+        self.assertEqual(len(rows), 15)
+        self.assertEqual(calc_competitor_score.call_count, 1)
+
+
+# SERP features of every CTR curve, the last curve whose features are all in the SERP is taken
+reference_ctr_conditions = [
+    (2, ('local_results',)),
+    (3, ('inline_people_also_search_for',)),
+    (4, ('knowledge_graph',)),
+    (5, ('video_flag',)),
+    (6, ('answer_box',)),
+    (7, ('featured_snippet',)),
+    (8, ('sitelink_flag',)),
+    (9, ('top_stories',)),
+    (10, ('featured_snippet', 'inline_people_also_search_for')),
+    (11, ('video_flag', 'inline_people_also_search_for')),
+    (12, ('inline_people_also_search_for', 'local_results')),
+    (13, ('knowledge_graph', 'inline_people_also_search_for')),
+    (14, ('knowledge_graph', 'sitelink_flag')),
+    (15, ('knowledge_graph', 'video_flag')),
+    (16, ('featured_snippet', 'video_flag')),
+    (17, ('video_flag', 'local_results')),
+    (18, ('inline_people_also_search_for', 'answer_box')),
+    (19, ('sitelink_flag', 'inline_people_also_search_for')),
+    (20, ('sitelink_flag', 'video_flag')),
+    (21, ('sitelink_flag', 'local_results')),
+    (22, ('video_flag', 'answer_box')),
+    (23, ('top_stories', 'inline_people_also_search_for')),
+    (24, ('inline_people_also_search_for', 'recipes_results')),
+    (25, ('video_flag', 'recipes_results')),
+    (26, ('knowledge_graph', 'answer_box')),
+    (27, ('featured_snippet', 'local_results')),
+    (28, ('knowledge_graph', 'local_results')),
+    (29, ('featured_snippet', 'video_flag', 'inline_people_also_search_for')),
+    (30, ('video_flag', 'inline_people_also_search_for', 'local_results')),
+    (31, ('sitelink_flag', 'video_flag', 'inline_people_also_search_for')),
+    (32, ('video_flag', 'inline_people_also_search_for', 'local_results')),
+    (33, ('knowledge_graph', 'inline_people_also_search_for', 'answer_box')),
+    (34, ('top_stories', 'video_flag', 'inline_people_also_search_for')),
+    (35, ('featured_snippet', 'knowledge_graph', 'inline_people_also_search_for')),
+    (36, ('knowledge_graph', 'sitelink_flag', 'inline_people_also_search_for')),
+    (37, ('featured_snippet', 'inline_people_also_search_for', 'local_results')),
+    (38, ('video_flag', 'inline_people_also_search_for', 'recipes_results')),
+    (39, ('knowledge_graph', 'inline_people_also_search_for', 'local_results')),
+    (40, ('sitelink_flag', 'inline_people_also_search_for', 'local_results')),
+    (41, ('knowledge_graph', 'top_stories', 'inline_people_also_search_for')),
+    (42, ('top_stories', 'inline_people_also_search_for', 'local_results')),
+    (43, ('knowledge_graph', 'video_flag', 'inline_people_also_search_for')),
+    (44, ('knowledge_graph', 'sitelink_flag', 'video_flag')),
+    (45, ('knowledge_graph', 'video_flag', 'inline_people_also_search_for', 'answer_box')),
+    (46, ('featured_snippet', 'knowledge_graph', 'video_flag', 'inline_people_also_search_for')),
+    (47, ('knowledge_graph', 'sitelink_flag', 'video_flag', 'inline_people_also_search_for')),
+    (48, ('knowledge_graph', 'top_stories', 'video_flag', 'inline_people_also_search_for')),
+    (49, ('knowledge_graph', 'sitelink_flag', 'twitter_results', 'inline_people_also_search_for')),
+    (50, ('knowledge_graph', 'video_flag', 'inline_people_also_search_for', 'local_results')),
+    (51, ('featured_snippet', 'video_flag', 'inline_people_also_search_for', 'local_results')),
+    (52, ('knowledge_graph', 'sitelink_flag', 'inline_people_also_search_for', 'local_results')),
+    (53, ('knowledge_graph', 'video_flag', 'twitter_results', 'inline_people_also_search_for')),
+    (54, ('knowledge_graph', 'video_flag', 'inline_people_also_search_for', 'recipes_results')),
+    (55, ('top_stories', 'video_flag', 'inline_people_also_search_for', 'local_results')),
+    (56, ('sitelink_flag', 'top_stories', 'video_flag', 'inline_people_also_search_for')),
+    (57, ('knowledge_graph', 'sitelink_flag', 'video_flag', 'twitter_results', 'inline_people_also_search_for')),
+    (58, ('knowledge_graph', 'sitelink_flag', 'top_stories', 'twitter_results', 'inline_people_also_search_for')),
+    (59, ('knowledge_graph', 'sitelink_flag', 'top_stories', 'video_flag', 'inline_people_also_search_for')),
+    (60, ('knowledge_graph', 'sitelink_flag', 'top_stories', 'twitter_results',
+          'inline_people_also_search_for', 'local_results')),
+    (61, ('knowledge_graph', 'sitelink_flag', 'top_stories', 'video_flag',
+          'twitter_results', 'inline_people_also_search_for')),
+    (62, ('knowledge_graph', 'top_stories', 'video_flag', 'twitter_results',
+          'inline_people_also_search_for', 'local_results')),
+]
+
+
+def reference_ctr_values(serp_features: Feature, ranking_position: int = 19) -> tuple:
+    """
+    Gets the ctr values of the SERP features by checking the features of every CTR curve in turn
+    :param serp_features: Feature object containing all the SERP result features
+    :param ranking_position: ranking position of the domain
+    :return: current and potential ctr values for the given serp features
+    """
+    flags = {slot: getattr(serp_features, slot) for slot in Feature.__slots__}
+    flags["video_flag"] = serp_features.inline_videos or serp_features.inline_video_carousels
+    flags["sitelink_flag"] = serp_features.sitelinks_search_box or serp_features.sitelinks_expanded
+    ctr_index = 0
+    if serp_features.organic_result_count > 0:
+        ctr_index = 1
+        for index, features in reference_ctr_conditions:
+            if all(flags[feature] for feature in features):
+                ctr_index = index
+    ranking_position_final = ranking_position - 1
+    if ranking_position_final < 0 or ranking_position_final > 19:
+        ranking_position_final = 19
+    return CTR_LOOKUP_MATRIX[ctr_index][ranking_position_final] / 100, CTR_LOOKUP_MATRIX[ctr_index][0] / 100
+
+
+class CtrValuesTests(SimpleTestCase):
+
+    def test_feature_mask_lookup_matches_checking_every_ctr_curve(self):
+        features = ["local_results", "inline_people_also_search_for", "knowledge_graph", "inline_videos",
+                    "inline_video_carousels", "answer_box", "featured_snippet", "sitelinks_search_box",
+                    "sitelinks_expanded", "top_stories", "recipes_results", "twitter_results"]
+        ctr_indexes = set()
+        for organic_result_count in (0, 7):
+            for values in itertools.product((False, True), repeat=len(features)):
+                serp_features = Feature()
+                serp_features.organic_result_count = organic_result_count
+                for feature, value in zip(features, values):
+                    setattr(serp_features, feature, value)
+                ctr_indexes.add(commonutils.get_ctr_index(commonutils.get_feature_mask(serp_features)))
+                for ranking_position in (-1, 0, 1, 2, 10, 20, 21, 100):
+                    self.assertEqual(commonutils.get_ctr_values(serp_features, ranking_position),
+                                     reference_ctr_values(serp_features, ranking_position))
+        # curve 32 has the features of curve 30, which it always overrides
+        self.assertEqual(ctr_indexes, set(range(63)) - {30})
+
+    def test_batch_lookup_matches_the_ctr_curve_of_every_feature_mask(self):
+        ranking_positions = [-1, 0, 1, 2, 10, 20, 21, 100]
+        feature_masks, positions = np.meshgrid(np.arange(FEATURE_MASK_COUNT), ranking_positions, indexing="ij")
+        ctr_values, potential_ctr_values = commonutils.lookup_ctr_values_batch(feature_masks.ravel(), positions.ravel())
+        expected_ctr_values = []
+        expected_potential_ctr_values = []
+        for feature_mask in range(FEATURE_MASK_COUNT):
+            ctr_curve = CTR_LOOKUP_MATRIX[commonutils.get_ctr_index(feature_mask)]
+            for ranking_position in ranking_positions:
+                expected_ctr_values.append(ctr_curve[ranking_position - 1 if 1 <= ranking_position <= 20 else 19] / 100)
+                expected_potential_ctr_values.append(ctr_curve[0] / 100)
+        self.assertEqual(ctr_values.tolist(), expected_ctr_values)
+        self.assertEqual(potential_ctr_values.tolist(), expected_potential_ctr_values)
+        # a single feature mask is shared by the whole batch, as for the domains of a keyword
+        ctr_values, potential_ctr_values = commonutils.lookup_ctr_values_batch(5, ranking_positions)
+        self.assertEqual(ctr_values.tolist(), [commonutils.lookup_ctr_values(5, x)[0] for x in ranking_positions])
+        self.assertEqual(potential_ctr_values.item(), commonutils.lookup_ctr_values(5)[1])
+
+
+class RunFetcherTests(FetcherTestCase):
+
+    def test_releases_the_resources_of_a_job_whose_fetch_fails(self):
+        queries = []
+        for keyword in ("red shoes", "blue shoes", "green shoes"):
+            query = Node()
+            query.keyword = keyword
+            queries.append(query)
+
+        def fetch_keywords_in_threads(queries, arguments, snapshot_writer, job_id, **kwargs):
+            snapshot_writer.put(queries[0])
+            snapshot_writer.put(queries[1])
+            raise RuntimeError("Fetch workers stopped")
+
+        release_rate_limiter = mock.Mock()
+        close_archive = mock.Mock()
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch("utils.fetcherutils.project_base_dir", temp_dir), \
+                mock.patch("utils.celery.get_input_queries", lambda *args: queries), \
+                mock.patch("utils.celery.fetch_keywords_in_threads", fetch_keywords_in_threads), \
+                mock.patch("utils.celery.release_rate_limiter", release_rate_limiter), \
+                mock.patch("utils.celery.close_archive", close_archive), \
+                mock.patch("utils.celery.send_signal") as send_signal:
+            self.assertEqual(celery_tasks.run_fetcher("input.csv", "key", "test"), ("", ""))
+            # the keywords fetched before the failure are in a snapshot for resuming the job
+            self.assertEqual(fetcherutils.get_completed_keywords("test"), (1, ["blue shoes", "red shoes"]))
+        release_rate_limiter.assert_called_once_with("key", "test")
+        close_archive.assert_called_once_with("test")
+        self.assertEqual(send_signal.call_args[0][1]["status"], "failed")
+
+
+class ThreadFetchTests(FetcherTestCase):
+
+    def test_keeps_a_window_of_keywords_in_flight_and_counts_the_failed_ones(self):
+        started = []
+        release = threading.Event()
+        fetched = []
+
+        def get_keyword_links(queries, arguments, snapshot_writer, *args):
+            started.append(queries[0].keyword)
+            release.wait(10)
+            if queries[0].keyword.startswith("failed"):
+                raise ValueError("Could not parse the results")
+            for query in queries:
+                snapshot_writer.put(query)
+
+        queries = []
+        for k in range(20):
+            query = Node()
+            query.keyword = f"failed shoes {k}" if k % 5 == 0 else f"shoes {k}"
+            queries.append(query)
+        duplicate_query = Node()
+        duplicate_query.keyword = "Shoes 1"
+        queries.append(duplicate_query)
+        snapshot_writer = mock.Mock(put=fetched.append)
+        result = []
+        with mock.patch("utils.serputils.get_keyword_links", get_keyword_links):
+            thread = threading.Thread(target=lambda: result.append(serputils.fetch_keywords_in_threads(
+                queries, Arguments(), snapshot_writer, "test", workers=10, window=4)))
+            thread.start()
+            for _ in range(100):
+                if len(started) >= 4:
+                    break
+                time.sleep(0.01)
+            # every worker is free, only the window holds the other keywords back
+            time.sleep(0.1)
+            self.assertEqual(len(started), 4)
+            release.set()
+            thread.join(10)
+        self.assertEqual(result, [4])
+        self.assertEqual(sorted(started), sorted(x.keyword for x in queries[:20]))
+        self.assertEqual(len(fetched), 17)
+        self.assertIn(duplicate_query, fetched)
+
+
+class SearchRetryTests(FakeSerpTestCase):
+
+    def search(self, keyword: str) -> dict:
+        params = fetcherutils.get_search_params(query=self.get_queries(keyword)[0], arguments=self.arguments)
+        return fetcherutils.get_search_results(params, SerpRateLimiter("test", self.job_id,
+                                                                       InProcessRateLimitStore()))
+
+    def test_retries_throttled_searches(self):
+        self.assertEqual(self.search("flaky shoes"), get_fake_search_results("flaky shoes"))
+        self.assertEqual(self.server.requests["flaky shoes"], 2)
+
+    def test_raises_once_the_retries_of_a_throttled_search_run_out(self):
+        with self.assertRaises(requests.HTTPError):
+            self.search("throttled shoes")
+        self.assertEqual(self.server.requests["throttled shoes"], 2)
+
+    def test_returns_errors_which_are_not_worth_retrying(self):
+        self.assertEqual(self.search("invalid shoes"), {"error": "Invalid API key"})
+        self.assertEqual(self.server.requests["invalid shoes"], 1)
+        self.assertEqual(fetcherutils.process_search_results(query=self.get_queries("invalid shoes")[0],
+                                                             search_results={"error": "Invalid API key"},
+                                                             competitor_domains=[]).links, [])
+
+
+class FakeClock:
+    """
+    Clock moving only when told to
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class RateLimitTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        for target in ("utils.ratelimitutils.time.monotonic", "utils.ratelimitutils.time.time"):
+            clock_patcher = mock.patch(target, self.clock)
+            clock_patcher.start()
+            self.addCleanup(clock_patcher.stop)
+
+    def test_token_bucket_allows_bursts_and_then_the_rate(self):
+        bucket = TokenBucket(rate=2, capacity=3)
+        self.assertEqual([bucket.take() for _ in range(3)], [0, 0, 0])
+        self.assertEqual(bucket.take(), 0.5)
+        self.clock.now = self.clock.now + 0.5
+        self.assertEqual(bucket.take(), 0)
+        self.clock.now = self.clock.now + 60
+        self.assertEqual([bucket.take() for _ in range(4)], [0, 0, 0, 0.5])
+        self.assertEqual(TokenBucket(rate=0, capacity=0).take(), 0)
+
+    def test_adaptive_concurrency_halves_on_throttling_and_grows_back_slowly(self):
+        concurrency = AdaptiveConcurrency(min_concurrency=2, max_concurrency=8, latency_target=1)
+        self.assertEqual([concurrency.take() for _ in range(9)], [True] * 8 + [False])
+        concurrency.release(latency=0.1, throttled=True)
+        self.assertEqual(concurrency.limit, 4)
+        # requests sent before the decrease don't decrease the limit again
+        concurrency.release(latency=0.1, throttled=True)
+        concurrency.release(latency=5, throttled=False)
+        self.assertEqual(concurrency.limit, 4)
+        self.clock.now = self.clock.now + 2
+        concurrency.release(latency=5, throttled=False)
+        self.assertEqual(concurrency.limit, 2)
+        self.clock.now = self.clock.now + 2
+        concurrency.release(latency=0.1, throttled=True)
+        self.assertEqual(concurrency.limit, 2)
+        self.assertEqual(concurrency.in_flight, 3)
+        self.assertFalse(concurrency.take())
+        for _ in range(3):
+            concurrency.release(latency=0.1, throttled=False)
+        self.assertAlmostEqual(concurrency.limit, 2 + 1 / 2 + 1 / 2.5 + 1 / 2.9)
+        self.assertEqual([concurrency.take() for _ in range(4)], [True, True, True, False])
+
+    def test_in_process_store_drops_the_jobs_which_stop_registering(self):
+        store = InProcessRateLimitStore()
+        self.assertEqual(store.register_job("jobs", "job 1", ttl=15), 1)
+        self.clock.now = self.clock.now + 10
+        self.assertEqual(store.register_job("jobs", "job 2", ttl=15), 2)
+        self.clock.now = self.clock.now + 10
+        self.assertEqual(store.register_job("jobs", "job 2", ttl=15), 1)
+        store.unregister_job("jobs", "job 2")
+        self.assertEqual(store.register_job("jobs", "job 3", ttl=15), 1)
+
+    def test_jobs_of_an_api_key_share_its_requests_per_second_evenly(self):
+        store = InProcessRateLimitStore()
+        rate_limiter_1 = SerpRateLimiter("key", "job 1", store, requests_per_second=10, burst=4)
+        self.assertEqual([rate_limiter_1.take_token() for _ in range(5)], [0, 0, 0, 0, 0.1])
+        rate_limiter_2 = SerpRateLimiter("key", "job 2", store, requests_per_second=10, burst=4)
+        self.assertEqual([rate_limiter_2.take_token() for _ in range(3)], [0, 0, 0.2])
+        # the first job sees the second one at its next heartbeat
+        self.clock.now = self.clock.now + serputils.serp_job_heartbeat_interval + 1
+        self.assertEqual([rate_limiter_1.take_token() for _ in range(3)], [0, 0, 0.2])
+        rate_limiter_2.close()
+        self.clock.now = self.clock.now + serputils.serp_job_heartbeat_interval + 1
+        self.assertEqual([rate_limiter_1.take_token() for _ in range(5)], [0, 0, 0, 0, 0.1])
+        # other API keys keep their own budget
+        rate_limiter_3 = SerpRateLimiter("other key", "job 3", store, requests_per_second=10, burst=4)
+        self.assertEqual([rate_limiter_3.take_token() for _ in range(4)], [0, 0, 0, 0])
+
+    def test_rate_limiter_waits_for_a_slot_and_a_token(self):
+        rate_limiter = SerpRateLimiter("key", "job", InProcessRateLimitStore(), requests_per_second=10, burst=1,
+                                       min_concurrency=1, max_concurrency=2)
+        self.assertEqual(rate_limiter.try_acquire(), 0)
+        self.assertEqual(rate_limiter.try_acquire(), 0.1)
+        self.clock.now = self.clock.now + 0.1
+        self.assertEqual(rate_limiter.try_acquire(), 0)
+        self.clock.now = self.clock.now + 0.1
+        self.assertEqual(rate_limiter.try_acquire(), serputils.serp_rate_limit_poll_interval)
+        rate_limiter.release(latency=0.1, throttled=False)
+        self.assertEqual(rate_limiter.try_acquire(), 0)
+
+
+@skipIf(fakeredis is None, "fakeredis is not installed")
+class RedisRateLimitStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        redis_patcher = mock.patch("redis.Redis.from_url", return_value=fakeredis.FakeRedis())
+        redis_patcher.start()
+        self.addCleanup(redis_patcher.stop)
+        self.store = RedisRateLimitStore("redis://localhost:6379/0")
+
+    def test_takes_tokens_from_the_bucket_on_the_server(self):
+        self.assertEqual([self.store.take_token("bucket", rate=1, capacity=3) for _ in range(3)], [0, 0, 0])
+        wait = self.store.take_token("bucket", rate=1, capacity=3)
+        self.assertGreater(wait, 0.9)
+        self.assertLessEqual(wait, 1)
+        self.assertEqual(self.store.take_token("other bucket", rate=1, capacity=3), 0)
+        self.store.delete("bucket")
+        self.assertEqual(self.store.take_token("bucket", rate=1, capacity=3), 0)
+
+    def test_registers_the_jobs_of_an_api_key(self):
+        self.assertEqual(self.store.register_job("jobs", "job 1", ttl=15), 1)
+        self.assertEqual(self.store.register_job("jobs", "job 2", ttl=15), 2)
+        self.assertEqual(self.store.register_job("jobs", "job 2", ttl=15), 2)
+        self.store.unregister_job("jobs", "job 1")
+        self.assertEqual(self.store.register_job("jobs", "job 2", ttl=15), 1)
+
+
+class SerpCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        clock_patcher = mock.patch("utils.serpcacheutils.time.time", self.clock)
+        clock_patcher.start()
+        self.addCleanup(clock_patcher.stop)
+        cache_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_directory.cleanup)
+        self.cache = serpcacheutils.SqliteSerpCache(os.path.join(cache_directory.name, "serp_cache.sqlite3"),
+                                                    max_size=1000)
+
+    def test_serves_results_younger_than_the_max_age(self):
+        self.cache.put("red shoes", b"results")
+        self.clock.now = self.clock.now + 100
+        self.assertEqual(self.cache.get("red shoes", max_age=100), b"results")
+        self.assertIsNone(self.cache.get("red shoes", max_age=99))
+        self.assertIsNone(self.cache.get("blue shoes", max_age=100))
+        self.cache.put("red shoes", b"new results")
+        self.assertEqual(self.cache.get("red shoes", max_age=1), b"new results")
+
+    def test_evicts_the_least_recently_used_results_beyond_the_size_limit(self):
+        for k in range(6):
+            self.clock.now = self.clock.now + 1
+            self.cache.put(f"keyword {k}", bytes(200))
+        self.clock.now = self.clock.now + 1
+        self.assertIsNotNone(self.cache.get("keyword 0", max_age=100))
+        self.cache.evict()
+        # 1200 bytes are brought back to 900 by dropping the two results used last the longest ago
+        cached = [k for k in range(6) if self.cache.get(f"keyword {k}", max_age=100) is not None]
+        self.assertEqual(cached, [0, 3, 4, 5])
+
+    def test_evicts_every_eviction_interval_puts(self):
+        with mock.patch("utils.serpcacheutils.serp_cache_eviction_interval", 3):
+            for k in range(3):
+                self.cache.put(f"keyword {k}", bytes(600))
+        self.assertEqual([k for k in range(3) if self.cache.get(f"keyword {k}", max_age=100) is not None], [2])
+
+    def test_claims_a_search_for_one_job_until_released_or_expired(self):
+        self.assertTrue(self.cache.claim("red shoes", ttl=10))
+        self.assertFalse(self.cache.claim("red shoes", ttl=10))
+        self.assertTrue(self.cache.is_claimed("red shoes"))
+        self.assertFalse(self.cache.is_claimed("blue shoes"))
+        self.cache.release("red shoes")
+        self.assertFalse(self.cache.is_claimed("red shoes"))
+        self.assertTrue(self.cache.claim("red shoes", ttl=10))
+        self.clock.now = self.clock.now + 11
+        self.assertFalse(self.cache.is_claimed("red shoes"))
+        self.assertTrue(self.cache.claim("red shoes", ttl=10))
+
+    def test_cache_key_ignores_case_whitespace_and_the_api_key(self):
+        params = fetcherutils.get_search_params(query=Node(), arguments=Arguments())
+        key = serpcacheutils.get_cache_key(dict(params, q="Red  shoes ", api_key="key 1"))
+        self.assertEqual(serpcacheutils.get_cache_key(dict(params, q="red shoes", api_key="key 2")), key)
+        self.assertNotEqual(serpcacheutils.get_cache_key(dict(params, q="red shoe")), key)
+        self.assertNotEqual(serpcacheutils.get_cache_key(dict(params, q="red shoes", gl="uk")), key)
+
+    def test_jobs_search_every_keyword_unless_they_opt_in(self):
+        self.assertEqual(serputils.serp_cache_max_age, 0)
+        self.assertEqual(Arguments().cache_max_age, 0)
+        self.assertEqual(serputils.get_fetch_options({})["cache_max_age"], 0)
+        self.assertEqual(serputils.get_fetch_options({"cache_max_age": "3600"})["cache_max_age"], 3600)
+        self.assertEqual(serputils.get_fetch_options({"cache_max_age": 10 ** 9})["cache_max_age"],
+                         serputils.serp_cache_max_ttl)
+
+
+class CachedAsyncFetchTests(FakeSerpTestCase):
+
+    def fetch(self, *keywords: str):
+        key_link_dict = []
+        failed_count = serputils.fetch_keywords_async(queries=self.get_queries(*keywords), arguments=self.arguments,
+                                                      store=key_link_dict.append, concurrency=2, job_id=self.job_id,
+                                                      competitor_domains=[])
+        return failed_count, {x.keyword: [link.url for link in x.links] for x in key_link_dict}
+
+    def test_serves_the_cached_results_of_jobs_opting_in_off_the_event_loop(self):
+        cache_threads = set()
+
+        def get_cached_results(*args):
+            cache_threads.add(threading.current_thread())
+            return serpcacheutils.get_cached_results(*args)
+
+        failed_count, links = self.fetch("red shoes", "blue shoes", "invalid shoes")
+        self.assertEqual(failed_count, 0)
+        self.arguments.cache_max_age = 3600
+        with mock.patch("utils.serputils.get_cached_results", get_cached_results):
+            failed_count, cached_links = self.fetch("blue shoes", "Red Shoes", "invalid shoes", "green shoes")
+        self.assertEqual(failed_count, 0)
+        green_links = [x["link"] for x in get_fake_search_results("green shoes")["organic_results"]]
+        self.assertEqual(cached_links, {"blue shoes": links["blue shoes"], "Red Shoes": links["red shoes"],
+                                        "invalid shoes": [], "green shoes": green_links})
+        # error answers are not cached
+        self.assertEqual(self.server.requests, {"red shoes": 1, "blue shoes": 1, "invalid shoes": 2,
+                                                "green shoes": 1})
+        self.assertEqual(serpcacheutils.pop_cache_stats(self.job_id), (2, 2, 0))
+        self.assertTrue(cache_threads)
+        self.assertNotIn(threading.main_thread(), cache_threads)
+
+
+class SharedSearchTests(SimpleTestCase):
+
+    def setUp(self):
+        cache_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_directory.cleanup)
+        cache = serpcacheutils.SqliteSerpCache(os.path.join(cache_directory.name, "serp_cache.sqlite3"),
+                                               max_size=1024 ** 2)
+        for target, value in (("utils.serpcacheutils.serp_cache", cache),
+                              ("utils.serpcacheutils.serp_claim_poll_interval", 0.01)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.job_id = str(uuid.uuid4())
+        self.addCleanup(serpcacheutils.pop_cache_stats, self.job_id)
+        self.arguments = Arguments()
+        self.addCleanup(release_rate_limiter, self.arguments.api_key, self.job_id)
+        self.arguments.cache_max_age = 3600
+        query = Node()
+        query.keyword = "red shoes"
+        self.params = fetcherutils.get_search_params(query=query, arguments=self.arguments)
+
+    def start_waiting(self, wait):
+        """
+        Waits for the claimed search on a thread of its own
+        :param wait: function waiting for the claimed search
+        :return: waiting thread and the list receiving the results once the wait is over
+        """
+        results = []
+        thread = threading.Thread(target=lambda: results.append(wait()))
+        thread.start()
+        self.addCleanup(thread.join, 10)
+        time.sleep(0.05)
+        self.assertEqual(results, [])
+        return thread, results
+
+    def test_jobs_wait_for_the_results_of_the_job_searching(self):
+        self.assertTrue(serpcacheutils.claim_search(self.params))
+        self.assertFalse(serpcacheutils.claim_search(dict(self.params, q="Red Shoes")))
+        thread, results = self.start_waiting(lambda: serpcacheutils.wait_for_claimed_search(self.params, 3600,
+                                                                                           self.job_id))
+        serpcacheutils.cache_results(self.params, get_fake_search_results("red shoes"))
+        serpcacheutils.release_search(self.params)
+        thread.join(10)
+        self.assertEqual(results, [get_fake_search_results("red shoes")])
+        self.assertEqual(serpcacheutils.pop_cache_stats(self.job_id), (0, 0, 1))
+
+    def test_jobs_search_themselves_when_the_job_searching_fails(self):
+        self.assertTrue(serpcacheutils.claim_search(self.params))
+        with mock.patch("utils.fetcherutils.get_search_results",
+                        return_value=get_fake_search_results("red shoes")) as get_search_results:
+            thread, results = self.start_waiting(lambda: fetcherutils.get_keyword_search_results(
+                self.params, self.arguments, self.job_id))
+            serpcacheutils.release_search(self.params)
+            thread.join(10)
+        self.assertEqual(results, [get_fake_search_results("red shoes")])
+        get_search_results.assert_called_once()
+        # the job searching caches the results and releases its own claim
+        self.assertTrue(serpcacheutils.claim_search(self.params))
+        self.assertEqual(serpcacheutils.get_cached_results(self.params, 3600, self.job_id),
+                         get_fake_search_results("red shoes"))
+
+    def test_jobs_skipping_the_cache_search_claimed_searches(self):
+        self.assertTrue(serpcacheutils.claim_search(self.params))
+        self.arguments.cache_max_age = 0
+        with mock.patch("utils.fetcherutils.get_search_results",
+                        return_value=get_fake_search_results("red shoes")) as get_search_results:
+            self.assertEqual(fetcherutils.get_keyword_search_results(self.params, self.arguments, self.job_id),
+                             get_fake_search_results("red shoes"))
+        get_search_results.assert_called_once()
+
+    def test_duplicate_keywords_are_grouped_in_the_order_of_their_first_keyword(self):
+        queries = []
+        for keyword in ("red shoes", "Blue shoes", " Red  Shoes", "blue shoes", "red shoe", "RED SHOES"):
+            query = Node()
+            query.keyword = keyword
+            queries.append(query)
+        self.assertEqual([[x.keyword for x in query_group] for query_group in
+                          fetcherutils.group_duplicate_queries(queries)],
+                         [["red shoes", " Red  Shoes", "RED SHOES"], ["Blue shoes", "blue shoes"], ["red shoe"]])
+
+
+class BrokenPoolExecutor:
+    """
+    Process pool whose worker processes die after running the first tasks, failing every later task
+    """
+    working_tasks = 0
+
+    def __init__(self, *args, **kwargs):
+        self.submitted_tasks = 0
+
+    def submit(self, fn, *args, **kwargs):
+        future = serputils.concurrent.futures.Future()
+        if self.submitted_tasks < self.working_tasks:
+            future.set_result(fn(*args, **kwargs))
+        else:
+            future.set_exception(serputils.BrokenProcessPool("A process in the process pool was terminated"))
+        self.submitted_tasks = self.submitted_tasks + 1
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class ArchiveTests(FakeSerpTestCase):
+
+    def setUp(self):
+        super().setUp()
+        archive_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_directory.cleanup)
+        archive_patcher = mock.patch("utils.archiveutils.project_base_dir", archive_directory.name)
+        archive_patcher.start()
+        self.addCleanup(archive_patcher.stop)
+        self.addCleanup(archiveutils.close_archive, self.job_id)
+        self.archive_path, self.index_path = archiveutils.get_archive_paths(self.job_id)
+
+    def read_archive(self) -> dict:
+        archive_index = archiveutils.read_archive_index(self.job_id)
+        with open(self.archive_path, "rb") as archive_file:
+            return {key: archiveutils.read_archived_results(archive_file, offset, length)
+                    for key, (offset, length) in archive_index.items()}
+
+    def test_archive_keeps_the_latest_results_of_every_search(self):
+        self.assertEqual(archiveutils.read_archive_index(self.job_id), {})
+        for key in ("red shoes", "blue shoes", "red shoes"):
+            archiveutils.archive_search_results(self.job_id, key, get_fake_search_results(key + str(len(key))))
+        archiveutils.close_archive(self.job_id)
+        self.assertEqual(self.read_archive(), {"red shoes": get_fake_search_results("red shoes9"),
+                                               "blue shoes": get_fake_search_results("blue shoes10")})
+
+    def test_archive_index_skips_the_entries_cut_short_by_a_killed_job(self):
+        archiveutils.archive_search_results(self.job_id, "red shoes", get_fake_search_results("red shoes"))
+        archiveutils.archive_search_results(self.job_id, "blue shoes", get_fake_search_results("blue shoes"))
+        archiveutils.close_archive(self.job_id)
+        # the frame of the last search and the index line of a next one were cut short
+        with open(self.archive_path, "r+b") as archive_file:
+            archive_file.truncate(os.path.getsize(self.archive_path) - 1)
+        with open(self.index_path, "a", encoding="utf-8") as index_file:
+            index_file.write('["green sh')
+        self.assertEqual(self.read_archive(), {"red shoes": get_fake_search_results("red shoes")})
+        # a job appending to the archive starts on a line of its own
+        archiveutils.archive_search_results(self.job_id, "green shoes", get_fake_search_results("green shoes"))
+        archiveutils.close_archive(self.job_id)
+        self.assertEqual(self.read_archive(), {"red shoes": get_fake_search_results("red shoes"),
+                                               "green shoes": get_fake_search_results("green shoes")})
+
+    def fetch_from_archive(self, queries: list, processes: int):
+        key_link_dict = []
+        failed_count = serputils.fetch_keywords_from_archive(queries, self.job_id, key_link_dict.append,
+                                                             processes=processes, target_domain="site2.com",
+                                                             competitor_domains=["site3.com"])
+        return failed_count, sorted([slot_values(x) for x in key_link_dict if x is not None], key=str)
+
+    def test_rebuilds_the_fetched_keywords_from_the_archive(self):
+        keywords = [f"shoes {k}" for k in range(9)] + ["misspelled shoes", "Shoes 1", "throttled shoes"]
+        archive_threads = set()
+
+        def archive_search_results(*args):
+            archive_threads.add(threading.current_thread())
+            archiveutils.archive_search_results(*args)
+
+        fetched = []
+        with mock.patch("utils.serputils.serp_archive_enabled", True), \
+                mock.patch("utils.serputils.archive_search_results", archive_search_results):
+            failed_count = serputils.fetch_keywords_async(queries=self.get_queries(*keywords),
+                                                          arguments=self.arguments, store=fetched.append,
+                                                          concurrency=3, job_id=self.job_id,
+                                                          target_domain="site2.com",
+                                                          competitor_domains=["site3.com"])
+        self.assertEqual(failed_count, 1)
+        self.assertNotIn(threading.main_thread(), archive_threads)
+        archiveutils.close_archive(self.job_id)
+        expected = sorted([slot_values(x) for x in fetched if x is not None], key=str)
+        self.assertEqual(len(expected), 10)
+        queries = self.get_queries(*keywords, "unknown shoes")
+        with mock.patch("utils.serputils.archive_batch_size", 2):
+            self.assertEqual(self.fetch_from_archive(queries, processes=1), (2, expected))
+            self.assertEqual(self.fetch_from_archive(queries, processes=2), (2, expected))
+            for working_tasks in (0, 3):
+                with mock.patch("utils.serputils.concurrent.futures.ProcessPoolExecutor", BrokenPoolExecutor), \
+                        mock.patch.object(BrokenPoolExecutor, "working_tasks", working_tasks):
+                    self.assertEqual(self.fetch_from_archive(queries, processes=2), (2, expected))
+
+    def test_archiving_is_off_unless_enabled(self):
+        self.assertFalse(serputils.serp_archive_enabled)
@@ -6,10 +6,11 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, parsers
 from utils.celery import run_fetcher
+from utils.serputils import get_fetch_options
 from utils.constants.cloudconstants import *
 
 from utils.logutils import *
-from utils.fetcherutils import write_current_output_file, write_output_file
+from utils.fetcherutils import write_current_output_file, get_completed_keywords
 
 
 class FetcherJobList(APIView):
@@ -33,7 +34,7 @@ class FetcherJobList(APIView):
             task = run_fetcher.delay(full_path, serp_api_key, job_id, region, request.data['gl'],
                                      request.data["search_engine"], "fetcher",
                                      request.data["target_domain"], competitor_domains,
-                                     ignore_special_characters)
+                                     ignore_special_characters, **get_fetch_options(request.data))
         except Exception as inst:
             print(inst)
             return Response({"status": "failed"}, status=status.HTTP_406_NOT_ACCEPTABLE)
@@ -86,8 +87,8 @@ class FetcherJobDetail(APIView):
         """
         try:
 
-            # To get the single DataFrame having all the snapshot files data merged in it
-            count, current_output_df = write_output_file(job_id, keep_snapshots=True, failure=True, job_type="fetcher")
+            # To get the number of snapshot segments and the keywords already in them from the manifest
+            count, completed_keywords = get_completed_keywords(job_id)
             if not count:
                 count = 0
                 already_searched_keywords_list = []
@@ -101,20 +102,11 @@ class FetcherJobDetail(APIView):
                 task = run_fetcher.delay(full_path, serp_api_key, job_id, region, request.data['gl'],
                                          request.data["search_engine"], "fetcher",
                                          request.data["target_domain"], competitor_domains,
-                                         ignore_special_characters, count, already_searched_keywords_list)
+                                         ignore_special_characters, count, already_searched_keywords_list,
+                                         **get_fetch_options(request.data))
             else:
-                # Getting the keywords coloumn from the DataFrame
-                output_keywords_series = current_output_df.iloc[:, 0]
-                # bulk_output_keywords_series = current_bulk_output_df.iloc[:,0]
-
-                # Converting the series above into lists
-                output_keywords_list = output_keywords_series.tolist()
-                # bulk_output_keywords_list = bulk_output_keywords_series.tolist()
-
-                # Removing duplicate keywords from the lists
-                already_searched_keywords_list = list(dict.fromkeys(output_keywords_list))
-                # already_searched_bulk_keywords_list=list(dict.fromkeys(bulk_output_keywords_list))
                 # This unique list will be passed to run_fetcher
+                already_searched_keywords_list = completed_keywords
 
                 full_path = request.data["input_file_path"]
                 region = f"{request.data['location']}"
@@ -125,7 +117,8 @@ class FetcherJobDetail(APIView):
                 task = run_fetcher.delay(full_path, serp_api_key, job_id, region, request.data['gl'],
                                          request.data["search_engine"], "fetcher",
                                          request.data["target_domain"], competitor_domains,
-                                         ignore_special_characters, count, already_searched_keywords_list)
+                                         ignore_special_characters, count, already_searched_keywords_list,
+                                         **get_fetch_options(request.data))
         except Exception as inst:
             print(inst)
             return Response({"status": inst}, status=status.HTTP_406_NOT_ACCEPTABLE)
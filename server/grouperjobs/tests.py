@@ -1,3 +1,606 @@
-from django.test import TestCase
+import csv
+import os
+import pickle
+import random
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+from fuzzywuzzy import fuzz
+
+from utils import grouperutils
+from utils.constants.fetcherconstants import CLIENT_RANKING_URL, CLIENT_RANKING_POSITION, CLIENT_URL_RANKING_COUNT
+from utils.constants.grouperconstants import input_node_columns
+from utils.models.combinedmodels import Rank
+from utils.models.groupermodels import Node, Group, Link
+
+
+def make_nodes(total_keywords: int, seed: int = 0, topics: int = 20, urls_per_topic: int = 15):
+    """
+    Makes nodes whose results are drawn from a few topics, so that they overlap like real SERPs do
+    :param total_keywords: number of nodes to make
+    :param seed: seed of the random generator
+    :param topics: number of topics
+    :param urls_per_topic: number of urls of every topic
+    :return: list of nodes with interned urls
+    """
+    rnd = random.Random(seed)
+    topic_urls = [[f"https://site{rnd.randrange(50)}.com/topic{t}/page{k}" for k in range(urls_per_topic)]
+                  for t in range(topics)]
+    key_link_dict = []
+    for k in range(total_keywords):
+        key_link = Node()
+        key_link.keyword = f"keyword {k}"
+        key_link.search_volume = rnd.choice([10, 50, 100, 500, 1000])
+        urls = rnd.sample(topic_urls[rnd.randrange(topics)], 7) + rnd.sample(topic_urls[rnd.randrange(topics)], 3)
+        if rnd.random() < 0.1:
+            # the same url may show up twice in the results of a keyword
+            urls[9] = urls[0]
+        for position, url in enumerate(urls, start=1):
+            link = Link()
+            link.url = url
+            link.position = position
+            key_link.links.append(link)
+        key_link.rank.client_ranking_position = rnd.choice([1, 3, 8, 15, 25, 101])
+        if key_link.rank.client_ranking_position <= 100:
+            key_link.rank.client_ranking_url = f"https://client.com/{rnd.choice(['a', 'b', 'c', 'd'])}"
+            key_link.rank.client_url_ranking_count = 1
+        key_link.difficulty = float(rnd.randrange(100))
+        key_link.current_value = rnd.random() * 100
+        key_link.value_opportunity = rnd.random() * 100
+        key_link.volume_opportunity = rnd.random() * 1000
+        key_link.fibonacci_helper = rnd.choice([0, 1, 3, 5, 8, 13])
+        key_link.competitor_score = rnd.choice([1, 2, 3, 5])
+        key_link_dict.append(key_link)
+    grouperutils.intern_urls(key_link_dict=key_link_dict)
+    return key_link_dict
+
+
+def reference_group_nodes(key_link_dict, threshold: int) -> dict:
+    """
+    Groups the nodes by comparing the results of every keyword with the results of every other keyword
+    :param key_link_dict: list of nodes to group
+    :param threshold: similarity threshold for intersecting links
+    :return: dictionary of keyword to group number, links in common and common links
+    """
+    groups = dict()
+    group_number = 1
+    for node_1 in key_link_dict:
+        if node_1.keyword in groups:
+            continue
+        groups[node_1.keyword] = (group_number, len(node_1.links), [x.url for x in node_1.links])
+        for node_2 in key_link_dict:
+            node_2_urls = [x.url for x in node_2.links]
+            common_links = [x.url for x in node_1.links if x.url in node_2_urls]
+            if len(common_links) >= threshold and (node_2.keyword not in groups or
+                                                   len(common_links) > groups[node_2.keyword][1]):
+                groups[node_2.keyword] = (group_number, len(common_links), common_links)
+        group_number = group_number + 1
+    return groups
+
+
+def get_groups(key_link_dict) -> dict:
+    """
+    Gets the groups of the grouped nodes in the format of reference_group_nodes
+    :param key_link_dict: list of grouped nodes
+    :return: dictionary of keyword to group number, links in common and common links
+    """
+    return {x.keyword: (x.group.number, x.group.links_in_common, x.group.common_links) for x in key_link_dict}
+
+
+class GrouperTestCase(SimpleTestCase):
+
+    def setUp(self):
+        socket_patcher = mock.patch("utils.socketutils.sio")
+        socket_patcher.start()
+        self.addCleanup(socket_patcher.stop)
+
+
+class UrlIndexTests(GrouperTestCase):
+
+    def test_url_index_lists_the_nodes_of_every_url(self):
+        key_link_dict = make_nodes(200)
+        keyword_index = grouperutils.build_keyword_index(key_link_dict=key_link_dict)
+        indptr, postings = grouperutils.build_url_index(keyword_index=keyword_index)
+        url_nodes = dict()
+        for k, key_link in enumerate(key_link_dict):
+            for url_id in key_link.url_ids.tolist():
+                url_nodes.setdefault(url_id, set()).add(k)
+        self.assertEqual(len(indptr) - 1, len(url_nodes))
+        for url_id, nodes in url_nodes.items():
+            self.assertEqual(postings[indptr[url_id]:indptr[url_id + 1]].tolist(), sorted(nodes))
+
+    def test_group_nodes_matches_comparing_every_pair_of_keywords(self):
+        for threshold in (0, 1, 3, 6):
+            key_link_dict = make_nodes(300, seed=threshold)
+            expected = reference_group_nodes(key_link_dict, threshold)
+            grouped = grouperutils.group_nodes(key_link_dict=key_link_dict, job_id="test", threshold=threshold)
+            self.assertEqual(get_groups(grouped), expected)
+
+    def test_group_nodes_without_nodes(self):
+        self.assertEqual(grouperutils.group_nodes(key_link_dict=[], job_id="test", threshold=3), [])
+
+
+class InternedUrlTests(GrouperTestCase):
+
+    def test_intern_urls_shares_one_copy_of_every_url(self):
+        key_link_dict = make_nodes(100)
+        # interning again keeps the ids and counts the distinct urls
+        url_count = grouperutils.intern_urls(key_link_dict=key_link_dict)
+        urls = dict()
+        for key_link in key_link_dict:
+            self.assertEqual(len(key_link.url_ids), len(key_link.links))
+            for link, url_id in zip(key_link.links, key_link.url_ids.tolist()):
+                self.assertIs(urls.setdefault(url_id, link.url), link.url)
+        self.assertEqual(url_count, len(urls))
+        self.assertEqual(len(set(urls.values())), len(urls))
+
+    def test_group_nodes_interns_the_urls_of_nodes_not_read_by_read_input(self):
+        key_link_dict = make_nodes(300, seed=5)
+        for key_link in key_link_dict[::7]:
+            key_link.url_ids = Node().url_ids
+        key_link = Node()
+        key_link.keyword = "keyword without results"
+        key_link_dict.append(key_link)
+        expected = reference_group_nodes(key_link_dict, 3)
+        grouped = grouperutils.group_nodes(key_link_dict=key_link_dict, job_id="test", threshold=3)
+        self.assertEqual(get_groups(grouped), expected)
+        for key_link in key_link_dict:
+            self.assertEqual(len(key_link.url_ids), len(key_link.links))
+
+    def test_count_links_in_common_matches_intersecting_the_links(self):
+        key_link_dict = make_nodes(150, seed=1)
+        keyword_index = grouperutils.build_keyword_index(key_link_dict=key_link_dict)
+        url_index = grouperutils.build_url_index(keyword_index=keyword_index)
+        rows, nodes, links_in_common = grouperutils.count_links_in_common(start=20, stop=90,
+                                                                         keyword_index=keyword_index,
+                                                                         url_index=url_index)
+        counted = dict(zip(zip(rows.tolist(), nodes.tolist()), links_in_common.tolist()))
+        expected = dict()
+        for i in range(20, 90):
+            for j, node_2 in enumerate(key_link_dict):
+                node_2_urls = [x.url for x in node_2.links]
+                intersect_len = len([x.url for x in key_link_dict[i].links if x.url in node_2_urls])
+                if intersect_len > 0:
+                    expected[(i, j)] = intersect_len
+        self.assertEqual(counted, expected)
+        self.assertEqual(list(counted), sorted(counted))
+
+
+class BrokenPoolExecutor:
+    """
+    Process pool whose worker processes die after running the first tasks, failing every later task
+    """
+    working_tasks = 0
+
+    def __init__(self, *args, **kwargs):
+        self.submitted_tasks = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def submit(self, fn, *args, **kwargs):
+        future = grouperutils.concurrent.futures.Future()
+        if self.submitted_tasks < self.working_tasks:
+            future.set_result(fn(*args, **kwargs))
+        else:
+            future.set_exception(grouperutils.BrokenProcessPool("A process in the process pool was terminated"))
+        self.submitted_tasks = self.submitted_tasks + 1
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class ParallelGroupingTests(GrouperTestCase):
+
+    def setUp(self):
+        super().setUp()
+        batch_size_patcher = mock.patch("utils.grouperutils.grouping_batch_size", 16)
+        batch_size_patcher.start()
+        self.addCleanup(batch_size_patcher.stop)
+
+    def group(self, processes: int):
+        key_link_dict = make_nodes(200, seed=2)
+        return get_groups(grouperutils.group_nodes(key_link_dict=key_link_dict, job_id="test", threshold=3,
+                                                   processes=processes))
+
+    def test_parallel_grouping_matches_serial_grouping(self):
+        self.assertEqual(self.group(processes=3), self.group(processes=1))
+
+    def test_falls_back_to_serial_grouping_without_shared_memory(self):
+        expected = self.group(processes=1)
+        with mock.patch("utils.grouperutils.shared_memory.SharedMemory", side_effect=OSError("no /dev/shm")):
+            self.assertEqual(self.group(processes=3), expected)
+
+    def test_falls_back_to_serial_grouping_when_the_pool_breaks(self):
+        expected = self.group(processes=1)
+        with mock.patch("utils.grouperutils.concurrent.futures.ProcessPoolExecutor", BrokenPoolExecutor):
+            self.assertEqual(self.group(processes=3), expected)
+
+
+def get_sub_groups(key_link_dict) -> dict:
+    """
+    Gets the sub groups of the sub-grouped nodes
+    :param key_link_dict: list of sub-grouped nodes
+    :return: dictionary of keyword to group number and sub group fields
+    """
+    return {x.keyword: (x.group.number, x.sub_group.number, x.sub_group.main_keyword, x.sub_group.links_in_common,
+                        x.sub_group.common_links, x.sub_group.highest_volume_keyword, x.sub_group.topic_volume)
+            for x in key_link_dict}
+
+
+class ParallelSubGroupingTests(GrouperTestCase):
+
+    def setUp(self):
+        super().setUp()
+        batch_size_patcher = mock.patch("utils.grouperutils.sub_grouping_batch_size", 20)
+        batch_size_patcher.start()
+        self.addCleanup(batch_size_patcher.stop)
+
+    def sub_group(self, processes: int):
+        key_link_dict = make_nodes(200, seed=3, topics=8)
+        grouperutils.group_nodes(key_link_dict=key_link_dict, job_id="test", threshold=3)
+        return get_sub_groups(grouperutils.calc_sub_groups(key_link_dict=key_link_dict, job_id="test", threshold=2,
+                                                           processes=processes))
+
+    def test_parallel_sub_grouping_matches_serial_sub_grouping(self):
+        self.assertEqual(self.sub_group(processes=3), self.sub_group(processes=1))
+
+    def test_falls_back_to_serial_sub_grouping_when_the_pool_breaks(self):
+        expected = self.sub_group(processes=1)
+        for working_tasks in (0, 2):
+            with mock.patch("utils.grouperutils.concurrent.futures.ProcessPoolExecutor", BrokenPoolExecutor), \
+                    mock.patch.object(BrokenPoolExecutor, "working_tasks", working_tasks):
+                self.assertEqual(self.sub_group(processes=3), expected)
+
+
+def reference_sub_group_nodes(key_link_dict, threshold: int, organic_results_count: int) -> dict:
+    """
+    Sub-groups the nodes by filtering and intersecting the links of every pair of keywords
+    :param key_link_dict: list of nodes to sub-group
+    :param threshold: similarity threshold for intersecting links
+    :param organic_results_count: max position of results to consider
+    :return: dictionary of keyword to sub group number, main keyword, links in common, common links and
+             highest volume keyword
+    """
+    sub_groups = dict()
+    sub_group_number = 1
+    for node_1 in key_link_dict:
+        if node_1.keyword in sub_groups:
+            continue
+        main_links = [x for x in node_1.links if x.position <= organic_results_count]
+        highest_volume, highest_volume_keyword = node_1.search_volume, node_1.keyword
+        sub_groups[node_1.keyword] = [sub_group_number, node_1.keyword, len(main_links), [x.url for x in main_links],
+                                      highest_volume_keyword]
+        main_sub_group = sub_groups[node_1.keyword]
+        for node_2 in key_link_dict:
+            variant_urls = [x.url for x in node_2.links if x.position <= organic_results_count]
+            common_links = [x.url for x in main_links if x.url in variant_urls]
+            if len(common_links) >= threshold and (node_2.keyword not in sub_groups or
+                                                   len(common_links) > sub_groups[node_2.keyword][2]):
+                if node_2.search_volume > highest_volume:
+                    highest_volume, highest_volume_keyword = node_2.search_volume, node_2.keyword
+                    main_sub_group[4] = highest_volume_keyword
+                sub_groups[node_2.keyword] = [sub_group_number, node_1.keyword, len(common_links), common_links,
+                                              highest_volume_keyword]
+        sub_group_number = sub_group_number + 1
+    return {keyword: tuple(sub_group) for keyword, sub_group in sub_groups.items()}
+
+
+class SubGroupNodesTests(GrouperTestCase):
+
+    def test_sub_group_nodes_matches_intersecting_the_filtered_links(self):
+        for threshold, organic_results_count in ((2, 10), (3, 7), (1, 4)):
+            key_link_dict = make_nodes(120, seed=threshold, topics=6)
+            expected = reference_sub_group_nodes(key_link_dict, threshold, organic_results_count)
+            grouperutils.sub_group_nodes(key_link_dict=key_link_dict, job_id="test", threshold=threshold,
+                                         organic_results_count=organic_results_count)
+            self.assertEqual({x.keyword: (x.sub_group.number, x.sub_group.main_keyword, x.sub_group.links_in_common,
+                                          x.sub_group.common_links, x.sub_group.highest_volume_keyword)
+                              for x in key_link_dict}, expected)
+
+
+def reference_group_metrics(filtered_list) -> dict:
+    """
+    Calculates the metrics of a group one metric at a time over its nodes
+    :param filtered_list: list of nodes having the same group
+    :return: dictionary of metric name to value
+    """
+    count = len(filtered_list)
+    topic_volume = 0
+    for key_link in filtered_list:
+        topic_volume = topic_volume + key_link.search_volume
+    volume_percents = [x.search_volume / topic_volume if topic_volume > 0 else x.volume_percent
+                       for x in filtered_list]
+    quartile_volume = np.quantile(volume_percents, 0.75)
+    above_quartile = [x for x, percent in zip(filtered_list, volume_percents) if percent >= quartile_volume]
+    metrics = {"topic_volume": topic_volume, "quartile_volume": quartile_volume, "variant_count": count,
+               "volume_percents": volume_percents}
+    for name, attribute, divisor in (("average_kw_difficulty", "difficulty", count),
+                                     ("sum_of_current_values", "current_value", None),
+                                     ("sum_value_opportunity", "value_opportunity", None),
+                                     ("sum_volume_opportunity", "volume_opportunity", None),
+                                     ("relevancy", "competitor_score", count)):
+        total = 0.0 if name == "relevancy" else 0
+        for key_link in filtered_list:
+            total = total + getattr(key_link, attribute)
+        metrics[name] = total / divisor if divisor else total
+    for name, key_links in (("average_rank", filtered_list), ("average_rank_quartile", above_quartile)):
+        total = 0
+        for key_link in key_links:
+            total = total + key_link.rank.client_ranking_position
+        metrics[name] = total / len(key_links)
+    total = 0
+    for key_link in filtered_list:
+        total = total + key_link.fibonacci_helper
+    metrics["rank_percentage"] = (total / (count * 13)) * 100
+    metrics["priority_score"] = metrics["rank_percentage"] * metrics["sum_value_opportunity"] / \
+        metrics["average_rank_quartile"]
+    metrics["total_content_gap"] = all(x.rank.client_url_ranking_count == 0 for x in filtered_list)
+    metrics["keyword_gap"] = any(x.rank.client_url_ranking_count == 0 and x.search_volume >= quartile_volume
+                                 for x in filtered_list)
+    top_urls = [x.rank.client_ranking_url for x in filtered_list if x.rank.client_ranking_position <= 20]
+    metrics["potential_cannibalization"] = len(top_urls) > len(set(top_urls))
+    return metrics
+
+
+class GroupMetricsTests(GrouperTestCase):
+    maxDiff = None
+
+    def test_group_metrics_match_calculating_every_metric_per_group(self):
+        key_link_dict = make_nodes(300, seed=4)
+        for key_link in key_link_dict[::23]:
+            # groups without volume keep the volume percent of their nodes
+            key_link.search_volume = 0
+        nodes = list(key_link_dict)
+        grouperutils.group_nodes(key_link_dict=key_link_dict, job_id="test", threshold=4)
+        groups = dict()
+        for key_link in sorted(nodes, key=lambda x: x.group.number):
+            groups.setdefault(key_link.group.number, []).append(key_link)
+        self.assertGreater(len(groups), 10)
+        for filtered_list in groups.values():
+            expected = reference_group_metrics(filtered_list)
+            self.assertEqual([x.volume_percent for x in filtered_list], expected.pop("volume_percents"))
+            self.assertEqual({x.priority_score for x in filtered_list}, {expected.pop("priority_score")})
+            for key_link in filtered_list:
+                self.assertEqual({name: getattr(key_link.group, name) for name in expected}, expected)
+
+
+def reference_potential_content_gap(key_link_dict, filtered_list) -> bool:
+    """
+    Identifies the potential content gap of a group by scanning the nodes of all the other groups
+    :param key_link_dict: list of all nodes
+    :param filtered_list: list of nodes having the same group
+    :return: whether the most frequent client url of the group ranks in the top 10 for another group
+    """
+    url_count_dict = dict()
+    for key_link in filtered_list:
+        if key_link.rank.client_ranking_url != "":
+            url_count_dict[key_link.rank.client_ranking_url] = url_count_dict.get(key_link.rank.client_ranking_url,
+                                                                                  0) + 1
+    most_frequent_url = ""
+    most_frequent_url_count = 0
+    for url in url_count_dict:
+        if url_count_dict[url] > most_frequent_url_count:
+            most_frequent_url = url
+            most_frequent_url_count = url_count_dict[url]
+    return any(x.group.number != filtered_list[0].group.number and x.rank.client_ranking_position <= 10 and
+               x.rank.client_ranking_url == most_frequent_url for x in key_link_dict)
+
+
+class PotentialContentGapTests(GrouperTestCase):
+
+    def test_potential_content_gap_matches_scanning_the_other_groups(self):
+        for seed in range(5):
+            key_link_dict = make_nodes(300, seed=seed)
+            for key_link in key_link_dict[::17]:
+                # a client ranking without a url must match groups without a most frequent url
+                key_link.rank.client_ranking_url = ""
+            nodes = list(key_link_dict)
+            grouperutils.group_nodes(key_link_dict=key_link_dict, job_id="test", threshold=4)
+            groups = dict()
+            for key_link in sorted(nodes, key=lambda x: x.group.number):
+                groups.setdefault(key_link.group.number, []).append(key_link)
+            checked_groups = [x for x in groups.values() if x[0].group.average_rank_quartile >= 10]
+            self.assertTrue(any(reference_potential_content_gap(nodes, x) for x in checked_groups))
+            for filtered_list in groups.values():
+                expected = filtered_list in checked_groups and reference_potential_content_gap(nodes, filtered_list)
+                self.assertEqual({x.group.potential_content_gap for x in filtered_list}, {expected})
+
+
+def reference_auto_mapped_urls(key_link_dict, slug_url_dict: dict) -> dict:
+    """
+    Maps every slug to the group of the keyword scoring the highest fuzzy match, comparing it with every keyword
+    :param key_link_dict: list of grouped nodes
+    :param slug_url_dict: slug url dictionary
+    :return: dictionary of group number to auto mapped url
+    """
+    auto_map_dict = dict()
+    for slug, url in slug_url_dict.items():
+        max_score = grouperutils.fuzzy_match_threshold
+        max_score_group = 0
+        for key_link in key_link_dict:
+            if key_link.keyword == slug and max_score < 101:
+                max_score_group = key_link.group.number
+                max_score = 101
+            else:
+                score = fuzz.token_sort_ratio(key_link.keyword, slug)
+                if score > max_score:
+                    max_score = score
+                    max_score_group = key_link.group.number
+        if max_score_group != 0:
+            auto_map_dict[max_score_group] = url
+    return auto_map_dict
+
+
+class AutoMappedUrlTests(SimpleTestCase):
+
+    def test_auto_mapped_urls_match_scoring_every_keyword(self):
+        rnd = random.Random(5)
+        words = ["best", "running", "shoes", "for", "women", "men", "trail", "cheap", "red", "nike", "sale",
+                 "2024", "Shoe's", "run-ning"]
+        key_link_dict = []
+        for k in range(400):
+            key_link = Node()
+            key_link.keyword = " ".join(rnd.sample(words, rnd.randint(1, 5)))
+            key_link.group = Group()
+            key_link.group.number = k // 3 + 1
+            key_link_dict.append(key_link)
+        slug_url_dict = dict()
+        for k in range(150):
+            slug = rnd.choice(key_link_dict).keyword.split()
+            rnd.shuffle(slug)
+            if rnd.random() < 0.5:
+                slug[rnd.randrange(len(slug))] = rnd.choice(words)
+            if rnd.random() < 0.3:
+                slug.append("x")
+            slug_url_dict[" ".join(slug)] = f"https://client.com/page{k}"
+        slug_url_dict[key_link_dict[7].keyword] = "https://client.com/exact"
+        slug_url_dict["nothing alike"] = "https://client.com/unmatched"
+        expected = reference_auto_mapped_urls(key_link_dict, slug_url_dict)
+        self.assertGreater(len(expected), 20)
+        self.assertEqual(grouperutils.calc_auto_mapped_url_fuzzy(key_link_dict=key_link_dict,
+                                                                 slug_url_dict=slug_url_dict), expected)
+        self.assertEqual(grouperutils.calc_auto_mapped_url_fuzzy(key_link_dict=[], slug_url_dict=slug_url_dict), {})
+
+
+def slot_values(value):
+    """
+    Gets the values of the slots of a model, recursively, to compare models by value
+    :param value: model, list of models or value
+    :return: dictionary of slot to value, list of them or the value
+    """
+    if isinstance(value, list):
+        return [slot_values(x) for x in value]
+    if hasattr(value, "__slots__"):
+        return {slot: slot_values(getattr(value, slot)) for slot in value.__slots__ if slot != "url_ids"}
+    return value
+
+
+def reference_read_input(input_file_path: str, organic_results_count: int):
+    """
+    Reads the input file row by row
+    :param input_file_path: path to input file
+    :param organic_results_count: max position of result to consider
+    :return: list of nodes
+    """
+    key_link_dict = []
+    df = pd.read_csv(filepath_or_buffer=input_file_path, encoding='utf-8-sig')
+    df = df[df["Keyword"].notnull() & df["Link"].notnull() & df["Volume"].notnull()]
+    df.sort_values(by=["Volume", "Keyword"], inplace=True, ascending=False)
+    comp_rank_headers = [x for x in df.columns.to_list() if 'Competitor' in x and 'Score' not in x and 'count' not in x]
+    i = 0
+    while i < len(df):
+        row = df.iloc[i]
+        key_link = Node()
+        key_link.keyword = row["Keyword"]
+        key_link.search_volume = row["Volume"]
+        key_link.rank = Rank()
+        for column, attribute in [(CLIENT_RANKING_URL, "client_ranking_url"),
+                                  (CLIENT_RANKING_POSITION, "client_ranking_position"),
+                                  (CLIENT_URL_RANKING_COUNT, "client_url_ranking_count")]:
+            if column in row and not pd.isna(row[column]):
+                setattr(key_link.rank, attribute, row[column])
+        for column, attribute, _ in input_node_columns:
+            if column in row and not pd.isna(row[column]) and isinstance(row[column], (np.float64, np.int64)):
+                setattr(key_link, attribute, row[column])
+        for column, attribute in [("Primary Intents", "primary_search_intents"),
+                                  ("Secondary Intents", "secondary_search_intents")]:
+            if column in row and not pd.isna(row[column]) and isinstance(row[column], str):
+                setattr(key_link, attribute, row[column])
+        j = i
+        while j < len(df) and df.iloc[j]["Keyword"] == key_link.keyword:
+            link = Link()
+            if isinstance(df.iloc[j]["Link"], str):
+                link.url = df.iloc[j]["Link"].split("#")[0]
+            if isinstance(df.iloc[j]["Position"], np.int64):
+                link.position = df.iloc[j]["Position"]
+            if "Related Results Count" in df.iloc[j] and isinstance(df.iloc[j]["Related Results Count"], np.int64):
+                link.related_results_count = df.iloc[j]["Related Results Count"]
+            key_link.links.append(link)
+            j = j + 1
+        for k in range(0, len(comp_rank_headers), 4):
+            comp_rank = Rank()
+            for offset, attribute in enumerate(["client_ranking_url", "client_ranking_position", "current_traffic",
+                                                "current_value"]):
+                if k + offset < len(comp_rank_headers) and not pd.isna(row[comp_rank_headers[k + offset]]):
+                    setattr(comp_rank, attribute, row[comp_rank_headers[k + offset]])
+            key_link.competitor_ranks.append(comp_rank)
+        if 'Competitor Score' in row:
+            key_link.competitor_score = row['Competitor Score']
+        if 'Competitor ranking count' in row:
+            key_link.competitor_ranking_count = row['Competitor ranking count']
+        key_link.links = [x for x in key_link.links if x.position <= organic_results_count]
+        key_link_dict.append(key_link)
+        i = j
+    return key_link_dict
+
+
+class ReadInputTests(GrouperTestCase):
+
+    def test_read_input_matches_reading_row_by_row(self):
+        rnd = random.Random(6)
+        header = ["Keyword", "Link", "Position", "Volume", "Title", "Related Results Count", CLIENT_RANKING_URL,
+                  CLIENT_RANKING_POSITION, CLIENT_URL_RANKING_COUNT, "Difficulty", "CPC", "CPS", "Current Value",
+                  "Primary Intents", "Secondary Intents", "Competitor Score", "Competitor ranking count",
+                  "Competitor 1 ranking URL", "Competitor 1 rank", "Competitor 1 current traffic",
+                  "Competitor 1 current value", "Competitor 2 ranking URL", "Competitor 2 rank"]
+        rows = []
+        for k in range(40):
+            keyword = f"keyword {k % 37}" if k != 5 else ""
+            volume = rnd.choice([10, 50, 100, 100]) if k != 9 else ""
+            values = [rnd.choice(["", f"https://client.com/{k}"]), rnd.choice(["", 3, 12]), rnd.choice(["", 0, 1]),
+                      rnd.choice(["", 12.5, 40]), rnd.choice(["", 1.2]), rnd.choice(["", 0.8]), rnd.choice(["", 3.5]),
+                      rnd.choice(["", "informational"]), rnd.choice(["", "commercial, local"]), 0.5 * (k % 4),
+                      k % 3, rnd.choice(["", "https://rival.com/a"]), rnd.choice(["", 4]), rnd.choice(["", 1.5]),
+                      rnd.choice(["", 2.5]), rnd.choice(["", "https://other.com/b"]), rnd.choice(["", 7])]
+            for position in range(1, rnd.randint(2, 13)):
+                link = f"https://site{rnd.randrange(8)}.com/page{rnd.randrange(5)}"
+                if rnd.random() < 0.2:
+                    link = link + "#section"
+                if rnd.random() < 0.05:
+                    link = ""
+                rows.append([keyword, link, position, volume, f"Title {position}", rnd.randrange(4)] + values)
+        with tempfile.TemporaryDirectory() as directory:
+            input_file_path = os.path.join(directory, "input.csv")
+            with open(input_file_path, "w", newline="", encoding="utf-8-sig") as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(rows)
+            expected = reference_read_input(input_file_path, organic_results_count=10)
+            key_link_dict = grouperutils.read_input(input_file_path=input_file_path, job_type="combined",
+                                                    organic_results_count=10)
+        self.assertGreater(len(key_link_dict), 30)
+        self.assertEqual(slot_values(key_link_dict), slot_values(expected))
+
+
+class ModelTests(SimpleTestCase):
+
+    def test_models_initialise_every_slot_without_an_instance_dictionary(self):
+        for model in (Node, Group, Link, Rank):
+            instance = model()
+            self.assertFalse(hasattr(instance, "__dict__"))
+            for slot in model.__slots__:
+                getattr(instance, slot)
+
+    def test_mutable_defaults_are_not_shared_between_instances(self):
+        node_1, node_2 = Node(), Node()
+        node_1.links.append(Link())
+        node_1.competitor_ranks.append(Rank())
+        node_1.rank.client_ranking_position = 1
+        self.assertEqual((node_2.links, node_2.competitor_ranks, node_2.rank.client_ranking_position), ([], [], 101))
+        group = Group()
+        group.common_links.append("https://site.com")
+        self.assertEqual(Group().common_links, [])
+
+    def test_models_survive_pickling_for_worker_processes(self):
+        key_link = make_nodes(1)[0]
+        key_link.group = Group()
+        key_link.group.number = 3
+        self.assertEqual(slot_values(pickle.loads(pickle.dumps(key_link))), slot_values(key_link))
@@ -26,6 +26,7 @@ class GrouperJobList(APIView):
         organic_results_count = 10
         competitor_domains = []
         no_of_clusters = 5
+        grouping_processes = 1
         if "target_domain" in request.data:
             target_domain = request.data["target_domain"]
         if "organic_results_count" in request.data:
@@ -34,6 +35,8 @@ class GrouperJobList(APIView):
             competitor_domains = request.data["competitor_domains"]
         if "no_of_clusters" in request.data:
             no_of_clusters = int(request.data["no_of_clusters"])
+        if "grouping_processes" in request.data:
+            grouping_processes = int(request.data["grouping_processes"])
 
         task = run_grouper.delay(input_file=full_path,
                                  threshold=int(request.data["main_keyword_grouping_accuracy"]),
@@ -43,7 +46,8 @@ class GrouperJobList(APIView):
                                  target_domain=target_domain,
                                  organic_results_count=organic_results_count,
                                  competitor_domains=competitor_domains,
-                                 no_of_clusters=no_of_clusters)
+                                 no_of_clusters=no_of_clusters,
+                                 grouping_processes=grouping_processes)
         return Response({"status": "running"}, status=status.HTTP_201_CREATED)
 
     def get(self, request, format=None):
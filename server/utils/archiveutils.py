@@ -0,0 +1,153 @@
+import json
+import os
+import struct
+import threading
+import zlib
+
+from utils.constants.fileconstants import *
+
+archive_frame_header = struct.Struct("<I")
+
+
+def get_archive_paths(job_id: str) -> tuple:
+    """
+    Gets the paths of the raw SERP archive of a job
+    :param job_id: id of the job
+    :return: path of the archive and path of its index
+    """
+    archive_dir = f"{project_base_dir}/processed/fetcher/archives/"
+    return archive_dir + job_id + ".serp", archive_dir + job_id + ".idx"
+
+
+def repair_archive_index(archive_path: str, index_path: str):
+    """
+    Drops the index entries of an archive which a killed job cut short or which point past the end of the
+    archive, so that the frames appended next neither end up in a cut line nor make a cut frame look complete
+    :param archive_path: path of the archive
+    :param index_path: path of the index of the archive
+    """
+    if not os.path.exists(index_path):
+        return
+    archive_size = os.path.getsize(archive_path)
+    lines = []
+    repaired = False
+    with open(index_path, encoding="utf-8") as index_file:
+        for line in index_file:
+            try:
+                key, offset, length = json.loads(line)
+            except ValueError:
+                repaired = True
+                continue
+            if offset + length > archive_size:
+                repaired = True
+                continue
+            if not line.endswith("\n"):
+                line = line + "\n"
+                repaired = True
+            lines.append(line)
+    if repaired:
+        with open(index_path + ".tmp", "w", encoding="utf-8") as index_file:
+            index_file.writelines(lines)
+        os.replace(index_path + ".tmp", index_path)
+
+
+class SerpArchiveWriter:
+    """
+    Appends the raw SERP API results of a job to its archive, one zlib compressed JSON frame per search. Every
+    frame is prefixed with its length and is only added to the index once it is on disk
+    """
+
+    def __init__(self, job_id: str):
+        archive_path, index_path = get_archive_paths(job_id)
+        os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.archive_file = open(archive_path, "ab")
+        repair_archive_index(archive_path, index_path)
+        self.index_file = open(index_path, "a", encoding="utf-8")
+
+    def write(self, key: str, search_results: dict):
+        """
+        Archives the results of a search
+        :param key: normalized keyword of the search
+        :param search_results: SERP API results
+        """
+        frame = zlib.compress(json.dumps(search_results).encode())
+        with self.lock:
+            offset = self.archive_file.tell()
+            self.archive_file.write(archive_frame_header.pack(len(frame)))
+            self.archive_file.write(frame)
+            self.archive_file.flush()
+            self.index_file.write(json.dumps([key, offset + archive_frame_header.size, len(frame)]) + "\n")
+            self.index_file.flush()
+
+    def close(self):
+        """
+        Closes the files of the archive
+        """
+        with self.lock:
+            self.archive_file.close()
+            self.index_file.close()
+
+
+archive_writers = {}
+archive_writers_lock = threading.Lock()
+
+
+def archive_search_results(job_id: str, key: str, search_results: dict):
+    """
+    Archives the results of a search of a job
+    :param job_id: id of the job
+    :param key: normalized keyword of the search
+    :param search_results: SERP API results
+    """
+    with archive_writers_lock:
+        if job_id not in archive_writers:
+            archive_writers[job_id] = SerpArchiveWriter(job_id)
+        archive_writer = archive_writers[job_id]
+    archive_writer.write(key, search_results)
+
+
+def close_archive(job_id: str):
+    """
+    Closes the archive of a job once it is done searching
+    :param job_id: id of the job
+    """
+    with archive_writers_lock:
+        archive_writer = archive_writers.pop(job_id, None)
+    if archive_writer is not None:
+        archive_writer.close()
+
+
+def read_archive_index(job_id: str) -> dict:
+    """
+    Reads the index of the archive of a job, the latest frame of a keyword searched more than once wins
+    :param job_id: id of the job
+    :return: dictionary of the normalized keywords to the offsets and lengths of their frames
+    """
+    archive_path, index_path = get_archive_paths(job_id)
+    if not os.path.exists(index_path):
+        return dict()
+    archive_size = os.path.getsize(archive_path)
+    archive_index = dict()
+    with open(index_path, encoding="utf-8") as index_file:
+        for line in index_file:
+            try:
+                key, offset, length = json.loads(line)
+            except ValueError:
+                # the last line is cut short if the job was killed while writing it
+                continue
+            if offset + length <= archive_size:
+                archive_index[key] = (offset, length)
+    return archive_index
+
+
+def read_archived_results(archive_file, offset: int, length: int) -> dict:
+    """
+    Reads the results of a search from an archive
+    :param archive_file: archive opened in binary mode
+    :param offset: offset of the frame of the search
+    :param length: length of the frame of the search
+    :return: SERP API results
+    """
+    archive_file.seek(offset)
+    return json.loads(zlib.decompress(archive_file.read(length)))
@@ -1,8 +1,8 @@
 import concurrent.futures
-from threading import Lock
 from utils.constants.celeryconstants import celery_broker_url,snapshots_count
 from utils.fetcherutils import *
 from utils.grouperutils import *
+from utils.serputils import *
 from utils.constants.fetcherconstants import *
 from utils.snowflakeutils import save_to_snowflake
 from utils.socketutils import *
@@ -22,7 +22,9 @@ app.autodiscover_tasks()
 def run_fetcher(input_file: str, api_key: str, job_id: str, region: str = REGION, gl: str = GL,
                 search_engine: str = SEARCH_ENGINE, job_type: str = "fetcher", target_domain: str = "",
                 competitor_domains: List[str] = [], ignore_special_characters: bool = True,
-                snap_shot_number:int = 0, already_searched_keywords_list: List[str] = []):
+                snap_shot_number:int = 0, already_searched_keywords_list: List[str] = [],
+                fetch_engine: str = thread_fetch_engine, fetch_concurrency: int = serp_concurrency,
+                cache_max_age: float = serp_cache_max_age, archive_job_id: str = ""):
     """
     This function is used to run the fetcher job.
     :param input_file: The input file for the fetcher job.
@@ -36,6 +38,11 @@ def run_fetcher(input_file: str, api_key: str, job_id: str, region: str = REGION
     :param ignore_special_characters: Flag to determine if special characters are to be omitted.
     :param snap_shot_number: counter to avoid overwritiing of snapshots while resuming the job
     :param already_searched_keywords_list: list containing keywords that are already searched from the given input file
+    :param fetch_engine: threads to search every keyword on its own thread, async to search them on an event loop,
+                         archive to rebuild the outputs from the raw SERP archive of a job without searching
+    :param fetch_concurrency: The maximum number of searches in flight with the async engine
+    :param cache_max_age: The maximum age in seconds of the cached results to reuse, 0 to search every keyword
+    :param archive_job_id: The job whose archive the archive engine reads, the current job if empty
     :return:
     """
     out_file = ""
@@ -71,6 +78,7 @@ def run_fetcher(input_file: str, api_key: str, job_id: str, region: str = REGION
             args.gl = gl
         else:
             args.gl = GL
+        args.cache_max_age = cache_max_age
 
         query_queue = get_input_queries(args,already_searched_keywords_list)
 
@@ -81,33 +89,48 @@ def run_fetcher(input_file: str, api_key: str, job_id: str, region: str = REGION
         i = 0
         ignore_count = 0
         count = [snap_shot_number]
-        snapshot_record_count = snapshots_count
-        lock = Lock()
-        key_link_dict = []
-        bulk_key_link_dict = []
-        if len(query_queue) > 0:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=100) as exe:
-                for query in query_queue:
-                    if not ignore_special_characters or (is_string_specialcharacter_less.match(query.keyword) is not None):
-                        i = i + 1
-                        futures=[exe.submit(get_keyword_links, query, args, key_link_dict, bulk_key_link_dict,lock, count, snapshot_record_count, job_id, job_type,
-                                i, total_queries,
-                                target_domain, competitor_domains, increment)]
-                    else:
-                        ignore_count = ignore_count + 1
-
-            done, not_done = concurrent.futures.wait(futures, return_when=concurrent.futures.ALL_COMPLETED)
+        failed_count = 0
+        search_queries = [query for query in query_queue if not ignore_special_characters or (
+                is_string_specialcharacter_less.match(query.keyword) is not None)]
+        i = len(search_queries)
+        ignore_count = total_queries - i
+        snapshot_writer = SnapshotWriter(count, snapshots_count, job_id, job_type, total_queries, increment)
+        try:
+            if len(search_queries) > 0 and fetch_engine == archive_fetch_engine:
+                failed_count = fetch_keywords_from_archive(search_queries, archive_job_id or job_id,
+                                                           snapshot_writer.put, target_domain=target_domain,
+                                                           competitor_domains=competitor_domains)
+            elif len(search_queries) > 0 and fetch_engine == async_fetch_engine:
+                failed_count = fetch_keywords_async(search_queries, args, snapshot_writer.put,
+                                                    concurrency=fetch_concurrency, job_id=job_id,
+                                                    target_domain=target_domain,
+                                                    competitor_domains=competitor_domains)
+            elif len(search_queries) > 0:
+                failed_count = fetch_keywords_in_threads(search_queries, args, snapshot_writer, job_id,
+                                                         target_domain=target_domain,
+                                                         competitor_domains=competitor_domains)
+        finally:
+            # the fetched keywords are written and the job's share of the API key released even if the fetch fails
+            try:
+                snapshot_writer.close()
+            finally:
+                release_rate_limiter(args.api_key, job_id)
+                close_archive(job_id)
+        cache_hits, cache_misses, cache_shared = pop_cache_stats(job_id)
+        if cache_hits + cache_misses > 0:
+            log = f"SERP cache: {cache_hits} hit(s), {cache_misses} miss(es), {cache_shared} shared by running jobs"
+            signal_logger.info({"jobId": job_id, "type": job_type, "log": f"[{get_time_stamp()}] {log}"})
 
-        
-        if key_link_dict:
-            write_snapshot_file(key_link_dict, bulk_key_link_dict,lock, count, snapshot_record_count, job_id, job_type=job_type)
+        if failed_count > 0:
+            log = f"Could not fetch data for {failed_count} keyword(s)"
+            signal_logger.info({"jobId": job_id, "type": job_type, "log": f"[{get_time_stamp()}] {log}"})
 
         log = f"Ignored {ignore_count} keyword(s) with special characters"
         signal_logger.info({"jobId": job_id, "type": job_type, "log": f"[{get_time_stamp()}] {log}"})
         log = f"finished fetching data for {i} keyword(s)"
         signal_logger.info({"jobId": job_id, "type": "fetcher", "log": f"[{get_time_stamp()}] {log}"})
 
-        snapshots_path,out_file, bulk_file = write_output_file(job_id,keep_snapshots=False,failure=False, job_type=job_type)
+        snapshots_path,out_file, bulk_file = write_output_file(job_id, job_type=job_type)
         
         job_logger.info("Fetcher completed!")
         upload_file_path = f"processed/fetcher/" + job_id + ".csv"
@@ -162,7 +185,7 @@ def run_fetcher(input_file: str, api_key: str, job_id: str, region: str = REGION
 @app.task
 def run_grouper(input_file, threshold, job_id, hard_threshold=None, job_type: str = "grouper", calc_rank: bool = False,
                 target_domain: str = "", organic_results_count: int = 10, competitor_domains: List[str] = [],
-                no_of_clusters: int = 5):
+                no_of_clusters: int = 5, grouping_processes: int = 1):
     """
     This function is used to run the grouper job.
     :param input_file: input file path
@@ -175,6 +198,7 @@ def run_grouper(input_file, threshold, job_id, hard_threshold=None, job_type: st
     :param organic_results_count: organic results count
     :param competitor_domains: competitor domains
     :param no_of_clusters: no of clusters
+    :param grouping_processes: no of processes to group the keywords with, 1 groups them in the worker itself
     :return: None
     """
     try:
@@ -202,11 +226,13 @@ def run_grouper(input_file, threshold, job_id, hard_threshold=None, job_type: st
             progress_logger.info({"jobId": job_id, "progress": progress})
             
         key_link_dict = group_nodes(key_link_dict=key_link_dict, threshold=threshold,
-                                    job_id=job_id, job_type=job_type, calc_sub_group=(hard_threshold is not None))
+                                    job_id=job_id, job_type=job_type, calc_sub_group=(hard_threshold is not None),
+                                    processes=grouping_processes)
 
         if hard_threshold is not None:
             key_link_dict = calc_sub_groups(key_link_dict=key_link_dict, threshold=hard_threshold, job_id=job_id,
-                                            job_type=job_type, organic_results_count=organic_results_count)
+                                            job_type=job_type, organic_results_count=organic_results_count,
+                                            processes=grouping_processes)
 
         now = datetime.now()
         time_stamp = now.strftime("%Y%m%d_%H_%M_%S")
@@ -271,7 +297,9 @@ def run_combined_job(input_file, threshold, api_key: str, job_id, region: str =
                      target_domain: str = "", competitor_domains: List[str] = [],
                      ignore_special_characters: bool = True, organic_results_count: int = 10,
                      no_of_clusters: int = 5,snap_shot_number: int = 0,
-                     already_searched_keywords_list: List[str] = []):
+                     already_searched_keywords_list: List[str] = [], grouping_processes: int = 1,
+                     fetch_engine: str = thread_fetch_engine, fetch_concurrency: int = serp_concurrency,
+                cache_max_age: float = serp_cache_max_age, archive_job_id: str = ""):
     """
     This function is used to run the combined job
     :param input_file: The input file path
@@ -288,6 +316,11 @@ def run_combined_job(input_file, threshold, api_key: str, job_id, region: str =
     :param no_of_clusters: The number of clusters to be created
     :param snap_shot_number: counter to avoid overwriting of snapshots while resuming the job
     :param already_searched_keywords_list: list containing keywords that are already searched from the given input file
+    :param grouping_processes: The number of processes to group the keywords with
+    :param fetch_engine: threads to search every keyword on its own thread, async to search them on an event loop
+    :param fetch_concurrency: The maximum number of searches in flight with the async engine
+    :param cache_max_age: The maximum age in seconds of the cached SERP results to reuse
+    :param archive_job_id: The job whose raw SERP archive the archive fetch engine reads
     :return: None
     """
     grouper_out_file = ""
@@ -301,7 +334,11 @@ def run_combined_job(input_file, threshold, api_key: str, job_id, region: str =
                                                               competitor_domains = competitor_domains,
                                                               ignore_special_characters = ignore_special_characters,
                                                               snap_shot_number = snap_shot_number, 
-                                                              already_searched_keywords_list = already_searched_keywords_list)
+                                                              already_searched_keywords_list = already_searched_keywords_list,
+                                                              fetch_engine=fetch_engine,
+                                                              fetch_concurrency=fetch_concurrency,
+                                                              cache_max_age=cache_max_age,
+                                                              archive_job_id=archive_job_id)
         fetcher_upload_file_path = "processed/fetcher/" + job_id + ".csv"
         fetcher_bulk_upload_file_path = "processed/fetcher/bulk/" + job_id + ".csv"
         log = "Fetcher completed! Uploading processed file to cloud..."
@@ -318,7 +355,8 @@ def run_combined_job(input_file, threshold, api_key: str, job_id, region: str =
 
         grouper_out_file = run_grouper(input_file=fetcher_out_file, threshold=threshold,
                                        hard_threshold=hard_threshold, job_id=job_id, job_type="combined",
-                                       organic_results_count=organic_results_count, no_of_clusters=no_of_clusters)
+                                       organic_results_count=organic_results_count, no_of_clusters=no_of_clusters,
+                                       grouping_processes=grouping_processes)
         final_upload_file_path = "processed/combined/" + job_id + ".csv"
         log = "Grouper completed! Uploading processed file to cloud..."
         signal_logger.info({"jobId": job_id, "type": "combined", "log": f"[{get_time_stamp()}] {log}"})
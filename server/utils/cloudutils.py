@@ -16,13 +16,14 @@ def upload_to_google_cloud(file_path: str, upload_file_path: str):
     blob.upload_from_filename(file_path)
 
 
-def read_csv_from_google_cloud(file_path: str):
+def read_csv_from_google_cloud(file_path: str, dtype: dict = None):
     """
     Reads a CSV file from Google Cloud Storage
     :param file_path: The path to the file to be read
+    :param dtype: The types of the columns, inferred by Pandas when not given
     :return: The CSV file as a Pandas DataFrame
     """
     fs = gcsfs.GCSFileSystem(project=gcloud_project_name)
     with fs.open(f'{gcloud_bucket_name}/{file_path}') as f:
-        df = pd.read_csv(filepath_or_buffer=f, encoding='utf-8-sig')
+        df = pd.read_csv(filepath_or_buffer=f, encoding='utf-8-sig', dtype=dtype)
     return df
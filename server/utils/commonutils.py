@@ -1,9 +1,195 @@
 from typing import List
+import functools
 import re
 
+import numpy as np
+
 from utils.models.combinedmodels import Rank
 from utils.models.fetchermodels import Feature
-from utils.constants.fetcherconstants import CTR_LOOKUP_MATRIX
+from utils.constants.fetcherconstants import *
+
+
+def get_feature_mask(serp_features: Feature) -> int:
+    """
+    Encodes the SERP features deciding the CTR curve as the bits of an integer
+    :param serp_features: Feature object containing all the SERP result features
+    :return: feature mask of the SERP
+    """
+    feature_mask = 0
+    if serp_features.organic_result_count > 0:
+        feature_mask |= FEATURE_ORGANIC_RESULTS
+    if serp_features.local_results:
+        feature_mask |= FEATURE_LOCAL_RESULTS
+    if serp_features.inline_people_also_search_for:
+        feature_mask |= FEATURE_INLINE_PEOPLE_ALSO_SEARCH_FOR
+    if serp_features.knowledge_graph:
+        feature_mask |= FEATURE_KNOWLEDGE_GRAPH
+    if serp_features.inline_videos or serp_features.inline_video_carousels:
+        feature_mask |= FEATURE_VIDEOS
+    if serp_features.answer_box:
+        feature_mask |= FEATURE_ANSWER_BOX
+    if serp_features.featured_snippet:
+        feature_mask |= FEATURE_FEATURED_SNIPPET
+    if serp_features.sitelinks_search_box or serp_features.sitelinks_expanded:
+        feature_mask |= FEATURE_SITELINKS
+    if serp_features.top_stories:
+        feature_mask |= FEATURE_TOP_STORIES
+    if serp_features.recipes_results:
+        feature_mask |= FEATURE_RECIPES_RESULTS
+    if serp_features.twitter_results:
+        feature_mask |= FEATURE_TWITTER_RESULTS
+    return feature_mask
+
+
+def get_ctr_index(feature_mask: int) -> int:
+    """
+    This function is used to get the row of the CTR lookup matrix for the given serp features
+    :param feature_mask: feature mask of the SERP
+    :return: index of the CTR curve of the SERP
+    """
+    if not feature_mask & FEATURE_ORGANIC_RESULTS:
+        return 0
+    local_results = bool(feature_mask & FEATURE_LOCAL_RESULTS)
+    inline_people_also_search_for = bool(feature_mask & FEATURE_INLINE_PEOPLE_ALSO_SEARCH_FOR)
+    knowledge_graph = bool(feature_mask & FEATURE_KNOWLEDGE_GRAPH)
+    video_flag = bool(feature_mask & FEATURE_VIDEOS)
+    answer_box = bool(feature_mask & FEATURE_ANSWER_BOX)
+    featured_snippet = bool(feature_mask & FEATURE_FEATURED_SNIPPET)
+    sitelink_flag = bool(feature_mask & FEATURE_SITELINKS)
+    top_stories = bool(feature_mask & FEATURE_TOP_STORIES)
+    recipes_results = bool(feature_mask & FEATURE_RECIPES_RESULTS)
+    twitter_results = bool(feature_mask & FEATURE_TWITTER_RESULTS)
+    ctr_index = 1
+    if local_results:
+        ctr_index = 2
+    if inline_people_also_search_for:
+        ctr_index = 3
+    if knowledge_graph:
+        ctr_index = 4
+    if video_flag:
+        ctr_index = 5
+    if answer_box:
+        ctr_index = 6
+    if featured_snippet:
+        ctr_index = 7
+    if sitelink_flag:
+        ctr_index = 8
+    if top_stories:
+        ctr_index = 9
+    if featured_snippet and inline_people_also_search_for:
+        ctr_index = 10
+    if video_flag and inline_people_also_search_for:
+        ctr_index = 11
+    if inline_people_also_search_for and local_results:
+        ctr_index = 12
+    if knowledge_graph and inline_people_also_search_for:
+        ctr_index = 13
+    if knowledge_graph and sitelink_flag:
+        ctr_index = 14
+    if knowledge_graph and video_flag:
+        ctr_index = 15
+    if featured_snippet and video_flag:
+        ctr_index = 16
+    if video_flag and local_results:
+        ctr_index = 17
+    if inline_people_also_search_for and answer_box:
+        ctr_index = 18
+    if sitelink_flag and inline_people_also_search_for:
+        ctr_index = 19
+    if sitelink_flag and video_flag:
+        ctr_index = 20
+    if sitelink_flag and local_results:
+        ctr_index = 21
+    if video_flag and answer_box:
+        ctr_index = 22
+    if top_stories and inline_people_also_search_for:
+        ctr_index = 23
+    if inline_people_also_search_for and recipes_results:
+        ctr_index = 24
+    if video_flag and recipes_results:
+        ctr_index = 25
+    if knowledge_graph and answer_box:
+        ctr_index = 26
+    if featured_snippet and local_results:
+        ctr_index = 27
+    if knowledge_graph and local_results:
+        ctr_index = 28
+    if featured_snippet and video_flag and inline_people_also_search_for:
+        ctr_index = 29
+    if video_flag and inline_people_also_search_for and local_results:
+        ctr_index = 30
+    if sitelink_flag and video_flag and inline_people_also_search_for:
+        ctr_index = 31
+    if video_flag and inline_people_also_search_for and local_results:
+        ctr_index = 32
+    if knowledge_graph and inline_people_also_search_for and answer_box:
+        ctr_index = 33
+    if top_stories and video_flag and inline_people_also_search_for:
+        ctr_index = 34
+    if featured_snippet and knowledge_graph and inline_people_also_search_for:
+        ctr_index = 35
+    if knowledge_graph and sitelink_flag and inline_people_also_search_for:
+        ctr_index = 36
+    if featured_snippet and inline_people_also_search_for and local_results:
+        ctr_index = 37
+    if video_flag and inline_people_also_search_for and recipes_results:
+        ctr_index = 38
+    if knowledge_graph and inline_people_also_search_for and local_results:
+        ctr_index = 39
+    if sitelink_flag and inline_people_also_search_for and local_results:
+        ctr_index = 40
+    if knowledge_graph and top_stories and inline_people_also_search_for:
+        ctr_index = 41
+    if top_stories and inline_people_also_search_for and local_results:
+        ctr_index = 42
+    if knowledge_graph and video_flag and inline_people_also_search_for:
+        ctr_index = 43
+    if knowledge_graph and sitelink_flag and video_flag:
+        ctr_index = 44
+    if knowledge_graph and video_flag and inline_people_also_search_for and answer_box:
+        ctr_index = 45
+    if featured_snippet and knowledge_graph and video_flag and inline_people_also_search_for:
+        ctr_index = 46
+    if knowledge_graph and sitelink_flag and video_flag and inline_people_also_search_for:
+        ctr_index = 47
+    if knowledge_graph and top_stories and video_flag and inline_people_also_search_for:
+        ctr_index = 48
+    if knowledge_graph and sitelink_flag and twitter_results and inline_people_also_search_for:
+        ctr_index = 49
+    if knowledge_graph and video_flag and inline_people_also_search_for and local_results:
+        ctr_index = 50
+    if featured_snippet and video_flag and inline_people_also_search_for and local_results:
+        ctr_index = 51
+    if knowledge_graph and sitelink_flag and inline_people_also_search_for and local_results:
+        ctr_index = 52
+    if knowledge_graph and video_flag and twitter_results and inline_people_also_search_for:
+        ctr_index = 53
+    if knowledge_graph and video_flag and inline_people_also_search_for and recipes_results:
+        ctr_index = 54
+    if top_stories and video_flag and inline_people_also_search_for and local_results:
+        ctr_index = 55
+    if sitelink_flag and top_stories and video_flag and inline_people_also_search_for:
+        ctr_index = 56
+    if knowledge_graph and sitelink_flag and video_flag and twitter_results and inline_people_also_search_for:
+        ctr_index = 57
+    if knowledge_graph and sitelink_flag and top_stories and twitter_results and inline_people_also_search_for:
+        ctr_index = 58
+    if knowledge_graph and sitelink_flag and top_stories and video_flag and inline_people_also_search_for:
+        ctr_index = 59
+    if knowledge_graph and sitelink_flag and top_stories and twitter_results and inline_people_also_search_for and local_results:
+        ctr_index = 60
+    if knowledge_graph and sitelink_flag and top_stories and video_flag and twitter_results and inline_people_also_search_for:
+        ctr_index = 61
+    if knowledge_graph and top_stories and video_flag and twitter_results and inline_people_also_search_for and local_results:
+        ctr_index = 62
+    return ctr_index
+
+
+# CTR curve of every feature mask, worked out once so that a lookup is a single index
+ctr_index_table = np.array([get_ctr_index(feature_mask) for feature_mask in range(FEATURE_MASK_COUNT)])
+ctr_values_table = np.array(CTR_LOOKUP_MATRIX) / 100
+ctr_values_rows = [row.tolist() for row in ctr_values_table]
+feature_mask_ctr_values = [ctr_values_rows[ctr_index] for ctr_index in ctr_index_table.tolist()]
 
 
 def get_ctr_values(serp_features: Feature, ranking_position: int = 19):
@@ -13,137 +199,35 @@ def get_ctr_values(serp_features: Feature, ranking_position: int = 19):
     :param ranking_position:
     :return: current and potential ctr values for the given serp features
     """
-    video_flag = serp_features.inline_videos or serp_features.inline_video_carousels
-    sitelink_flag = serp_features.sitelinks_search_box or serp_features.sitelinks_expanded
-    ctr_index = 0
-    if serp_features.organic_result_count > 0:
-        ctr_index = 1
-        if serp_features.local_results:
-            ctr_index = 2
-        if serp_features.inline_people_also_search_for:
-            ctr_index = 3
-        if serp_features.knowledge_graph:
-            ctr_index = 4
-        if video_flag:
-            ctr_index = 5
-        if serp_features.answer_box:
-            ctr_index = 6
-        if serp_features.featured_snippet:
-            ctr_index = 7
-        if sitelink_flag:
-            ctr_index = 8
-        if serp_features.top_stories:
-            ctr_index = 9
-        if serp_features.featured_snippet and serp_features.inline_people_also_search_for:
-            ctr_index = 10
-        if video_flag and serp_features.inline_people_also_search_for:
-            ctr_index = 11
-        if serp_features.inline_people_also_search_for and serp_features.local_results:
-            ctr_index = 12
-        if serp_features.knowledge_graph and serp_features.inline_people_also_search_for:
-            ctr_index = 13
-        if serp_features.knowledge_graph and sitelink_flag:
-            ctr_index = 14
-        if serp_features.knowledge_graph and video_flag:
-            ctr_index = 15
-        if serp_features.featured_snippet and video_flag:
-            ctr_index = 16
-        if video_flag and serp_features.local_results:
-            ctr_index = 17
-        if serp_features.inline_people_also_search_for and serp_features.answer_box:
-            ctr_index = 18
-        if sitelink_flag and serp_features.inline_people_also_search_for:
-            ctr_index = 19
-        if sitelink_flag and video_flag:
-            ctr_index = 20
-        if sitelink_flag and serp_features.local_results:
-            ctr_index = 21
-        if video_flag and serp_features.answer_box:
-            ctr_index = 22
-        if serp_features.top_stories and serp_features.inline_people_also_search_for:
-            ctr_index = 23
-        if serp_features.inline_people_also_search_for and serp_features.recipes_results:
-            ctr_index = 24
-        if video_flag and serp_features.recipes_results:
-            ctr_index = 25
-        if serp_features.knowledge_graph and serp_features.answer_box:
-            ctr_index = 26
-        if serp_features.featured_snippet and serp_features.local_results:
-            ctr_index = 27
-        if serp_features.knowledge_graph and serp_features.local_results:
-            ctr_index = 28
-        if serp_features.featured_snippet and video_flag and serp_features.inline_people_also_search_for:
-            ctr_index = 29
-        if video_flag and serp_features.inline_people_also_search_for and serp_features.local_results:
-            ctr_index = 30
-        if sitelink_flag and video_flag and serp_features.inline_people_also_search_for:
-            ctr_index = 31
-        if video_flag and serp_features.inline_people_also_search_for and serp_features.local_results:
-            ctr_index = 32
-        if serp_features.knowledge_graph and serp_features.inline_people_also_search_for and serp_features.answer_box:
-            ctr_index = 33
-        if serp_features.top_stories and video_flag and serp_features.inline_people_also_search_for:
-            ctr_index = 34
-        if serp_features.featured_snippet and serp_features.knowledge_graph and serp_features.inline_people_also_search_for:
-            ctr_index = 35
-        if serp_features.knowledge_graph and sitelink_flag and serp_features.inline_people_also_search_for:
-            ctr_index = 36
-        if serp_features.featured_snippet and serp_features.inline_people_also_search_for and serp_features.local_results:
-            ctr_index = 37
-        if video_flag and serp_features.inline_people_also_search_for and serp_features.recipes_results:
-            ctr_index = 38
-        if serp_features.knowledge_graph and serp_features.inline_people_also_search_for and serp_features.local_results:
-            ctr_index = 39
-        if sitelink_flag and serp_features.inline_people_also_search_for and serp_features.local_results:
-            ctr_index = 40
-        if serp_features.knowledge_graph and serp_features.top_stories and serp_features.inline_people_also_search_for:
-            ctr_index = 41
-        if serp_features.top_stories and serp_features.inline_people_also_search_for and serp_features.local_results:
-            ctr_index = 42
-        if serp_features.knowledge_graph and video_flag and serp_features.inline_people_also_search_for:
-            ctr_index = 43
-        if serp_features.knowledge_graph and sitelink_flag and video_flag:
-            ctr_index = 44
-        if serp_features.knowledge_graph and video_flag and serp_features.inline_people_also_search_for and serp_features.answer_box:
-            ctr_index = 45
-        if serp_features.featured_snippet and serp_features.knowledge_graph and video_flag and serp_features.inline_people_also_search_for:
-            ctr_index = 46
-        if serp_features.knowledge_graph and sitelink_flag and video_flag and serp_features.inline_people_also_search_for:
-            ctr_index = 47
-        if serp_features.knowledge_graph and serp_features.top_stories and video_flag and serp_features.inline_people_also_search_for:
-            ctr_index = 48
-        if serp_features.knowledge_graph and sitelink_flag and serp_features.twitter_results and serp_features.inline_people_also_search_for:
-            ctr_index = 49
-        if serp_features.knowledge_graph and video_flag and serp_features.inline_people_also_search_for and serp_features.local_results:
-            ctr_index = 50
-        if serp_features.featured_snippet and video_flag and serp_features.inline_people_also_search_for and serp_features.local_results:
-            ctr_index = 51
-        if serp_features.knowledge_graph and sitelink_flag and serp_features.inline_people_also_search_for and serp_features.local_results:
-            ctr_index = 52
-        if serp_features.knowledge_graph and video_flag and serp_features.twitter_results and serp_features.inline_people_also_search_for:
-            ctr_index = 53
-        if serp_features.knowledge_graph and video_flag and serp_features.inline_people_also_search_for and serp_features.recipes_results:
-            ctr_index = 54
-        if serp_features.top_stories and video_flag and serp_features.inline_people_also_search_for and serp_features.local_results:
-            ctr_index = 55
-        if sitelink_flag and serp_features.top_stories and video_flag and serp_features.inline_people_also_search_for:
-            ctr_index = 56
-        if serp_features.knowledge_graph and sitelink_flag and video_flag and serp_features.twitter_results and serp_features.inline_people_also_search_for:
-            ctr_index = 57
-        if serp_features.knowledge_graph and sitelink_flag and serp_features.top_stories and serp_features.twitter_results and serp_features.inline_people_also_search_for:
-            ctr_index = 58
-        if serp_features.knowledge_graph and sitelink_flag and serp_features.top_stories and video_flag and serp_features.inline_people_also_search_for:
-            ctr_index = 59
-        if serp_features.knowledge_graph and sitelink_flag and serp_features.top_stories and serp_features.twitter_results and serp_features.inline_people_also_search_for and serp_features.local_results:
-            ctr_index = 60
-        if serp_features.knowledge_graph and sitelink_flag and serp_features.top_stories and video_flag and serp_features.twitter_results and serp_features.inline_people_also_search_for:
-            ctr_index = 61
-        if serp_features.knowledge_graph and serp_features.top_stories and video_flag and serp_features.twitter_results and serp_features.inline_people_also_search_for and serp_features.local_results:
-            ctr_index = 62
+    return lookup_ctr_values(feature_mask=get_feature_mask(serp_features), ranking_position=ranking_position)
+
+
+def lookup_ctr_values(feature_mask: int, ranking_position: int = 19):
+    """
+    Gets the ctr values for the given feature mask from the precomputed CTR curves
+    :param feature_mask: feature mask of the SERP
+    :param ranking_position: ranking position of the domain, outside of the top 20 is taken as 20
+    :return: current and potential ctr values for the given feature mask
+    """
+    ctr_values = feature_mask_ctr_values[feature_mask]
     ranking_position_final = ranking_position - 1
     if ranking_position_final < 0 or ranking_position_final > 19:
         ranking_position_final = 19
-    return CTR_LOOKUP_MATRIX[ctr_index][ranking_position_final] / 100, CTR_LOOKUP_MATRIX[ctr_index][0] / 100
+    return ctr_values[ranking_position_final], ctr_values[0]
+
+
+def lookup_ctr_values_batch(feature_masks, ranking_positions):
+    """
+    Gets the ctr values of a batch of keywords and domains at once
+    :param feature_masks: feature masks of the SERPs, or a single feature mask shared by the whole batch
+    :param ranking_positions: ranking positions of the domains, outside of the top 20 is taken as 20
+    :return: arrays of the current and potential ctr values
+    """
+    ctr_indexes = ctr_index_table[np.asarray(feature_masks, dtype=np.int64)]
+    ranking_positions_final = np.asarray(ranking_positions, dtype=np.int64) - 1
+    ranking_positions_final = np.where((ranking_positions_final < 0) | (ranking_positions_final > 19), 19,
+                                       ranking_positions_final)
+    return ctr_values_table[ctr_indexes, ranking_positions_final], ctr_values_table[ctr_indexes, 0]
 
 
 def remove_permalink(link: str) -> str:
@@ -158,6 +242,76 @@ def remove_permalink(link: str) -> str:
     return cleansed_link
 
 
+# scheme and user info are skipped, the hostname ends at the port, path, query or fragment
+url_hostname_pattern = re.compile(r"(?:[^/?#]*//)?(?:[^/?#@]*@)?([^/?#:]*)")
+
+
+def get_url_hostname(url: str) -> str:
+    """
+    Gets the hostname of a url, which may come without a scheme
+    :param url: url to get the hostname of
+    :return: lowercase hostname of the url
+    """
+    return url_hostname_pattern.match(url).group(1).lower().rstrip(".")
+
+
+class DomainMatcher:
+    """
+    Matches urls against a list of domains with one lookup per label of their hostname instead of a substring
+    search per domain. Empty domains and domains with a path or a port can't be matched by hostname, so they are
+    still searched for in the whole url
+    """
+
+    def __init__(self, domains: List[str]):
+        self.hostname_domains = dict()
+        self.substring_domains = []
+        for i, domain in enumerate(domains):
+            if domain and "/" not in domain and ":" not in domain:
+                self.hostname_domains.setdefault(domain.lower().rstrip("."), []).append(i)
+            else:
+                self.substring_domains.append((i, domain))
+        self.hostname_matches = dict()
+
+    def match_hostname(self, hostname: str) -> List[int]:
+        """
+        Gets the domains a hostname is on, the hostname itself or any of its parent domains
+        :param hostname: lowercase hostname
+        :return: indexes of the matching domains
+        """
+        matches = self.hostname_matches.get(hostname)
+        if matches is None:
+            matches = []
+            labels = hostname.split(".")
+            for k in range(len(labels)):
+                matches.extend(self.hostname_domains.get(".".join(labels[k:]), ()))
+            if len(self.hostname_matches) >= DOMAIN_MATCHER_CACHE_SIZE:
+                self.hostname_matches.clear()
+            self.hostname_matches[hostname] = matches
+        return matches
+
+    def match(self, url: str) -> List[int]:
+        """
+        Gets the domains a url is on
+        :param url: url to match
+        :return: indexes of the matching domains
+        """
+        matches = self.match_hostname(get_url_hostname(url)) if self.hostname_domains else []
+        if self.substring_domains:
+            matches = matches + [i for i, domain in self.substring_domains
+                                 if f".{domain}" in url or f"//{domain}" in url]
+        return matches
+
+
+@functools.lru_cache(maxsize=64)
+def get_domain_matcher(domains: tuple) -> DomainMatcher:
+    """
+    Gets the matcher of a list of domains, built once for all the keywords of a job
+    :param domains: target domain followed by the competitor domains
+    :return: matcher of the domains
+    """
+    return DomainMatcher(list(domains))
+
+
 def calculate_rank(organic_results: List, answer_box_link: str, target_domain: str, competitor_domains: List[str]):
     """
     This function calculates the rank of the given target and competitor domains in the organic results
@@ -168,25 +322,23 @@ def calculate_rank(organic_results: List, answer_box_link: str, target_domain: s
     :return: list of ranks of the target and competitor domains in the organic results
     :rtype: List[Rank]
     """
-    input_domains = competitor_domains[0:]
-    input_domains.insert(0, target_domain)
-    key_ranks = []
-    for domain in input_domains:
-        key_rank = Rank()
-        if answer_box_link != "" and (f".{domain}" in answer_box_link or f"//{domain}" in answer_box_link):
+    domain_matcher = get_domain_matcher((target_domain, *competitor_domains))
+    key_ranks = [Rank() for _ in range(len(competitor_domains) + 1)]
+    if answer_box_link != "":
+        for i in domain_matcher.match(answer_box_link):
+            key_rank = key_ranks[i]
             key_rank.client_ranking_position = 1
             key_rank.client_url_ranking_count = key_rank.client_url_ranking_count + 1
             key_rank.client_ranking_url = remove_permalink(answer_box_link)
-        for result in organic_results:
-            if "link" in result and (
-                    f".{domain}" in result["link"] or f"//{domain}" in result["link"]):
+    for result in organic_results:
+        if "link" in result:
+            for i in domain_matcher.match(result["link"]):
+                key_rank = key_ranks[i]
                 if key_rank.client_url_ranking_count == 0:
                     key_rank.client_ranking_position = result["position"]
                     key_rank.client_ranking_url = remove_permalink(result["link"])
                 key_rank.client_url_ranking_count = key_rank.client_url_ranking_count + 1
-        key_ranks.append(key_rank)
-    res = key_ranks[0:]
-    return res
+    return key_ranks
 
 
 def calc_competitor_score(key_link):
@@ -16,6 +16,8 @@ GL = "us"
 CLIENT_RANKING_URL = "Client Ranking URL"
 CLIENT_RANKING_POSITION = "Client Ranking Position"
 CLIENT_URL_RANKING_COUNT = "Client URL Ranking Count"
+# hostnames whose matching domains are remembered by a domain matcher
+DOMAIN_MATCHER_CACHE_SIZE = 100000
 
 
 class PrimarySearchIntent(enum.Enum):
@@ -171,3 +173,17 @@ CTR_LOOKUP_MATRIX = [
     [14.66, 1.34, 1.12, 1.2, 1.61, 0.85, 0.95, 1.02, 0.65, 0.78, 0.75, 1.13, 0.51, 0.6, 0.4, 1.12, 0.82, 0.81, 1.16,
      0.96]
 ]
+
+# SERP features deciding the CTR curve, as bits of a feature mask
+FEATURE_ORGANIC_RESULTS = 1 << 0
+FEATURE_LOCAL_RESULTS = 1 << 1
+FEATURE_INLINE_PEOPLE_ALSO_SEARCH_FOR = 1 << 2
+FEATURE_KNOWLEDGE_GRAPH = 1 << 3
+FEATURE_VIDEOS = 1 << 4
+FEATURE_ANSWER_BOX = 1 << 5
+FEATURE_FEATURED_SNIPPET = 1 << 6
+FEATURE_SITELINKS = 1 << 7
+FEATURE_TOP_STORIES = 1 << 8
+FEATURE_RECIPES_RESULTS = 1 << 9
+FEATURE_TWITTER_RESULTS = 1 << 10
+FEATURE_MASK_COUNT = 1 << 11
@@ -71,3 +71,22 @@ sub_group_header_array = ["ID",
 default_grouping_threshold = 3
 default_sub_grouping_threshold = 6
 fuzzy_match_threshold = 89
+grouping_batch_size = 1024
+sub_grouping_batch_size = 512
+input_column_dtypes = {"Keyword": str,
+                       "Link": str,
+                       "Title": str,
+                       "Snippet": str,
+                       "Primary Intents": str,
+                       "Secondary Intents": str,
+                       "Client Ranking URL": str}
+input_node_columns = [("Difficulty", "difficulty", "invalid type difficulty"),
+                      ("Current Traffic", "current_traffic", "invalid type current traffic"),
+                      ("Potential Traffic", "potential_traffic", "invalid type potential traffic"),
+                      ("Current Value", "current_value", "invalid type current value"),
+                      ("Potential Value", "potential_value", "invalid type potential value"),
+                      ("Fibonacci Helper", "fibonacci_helper", "invalid type fibonacci helper"),
+                      ("Value Opportunity", "value_opportunity", "invalid type value opportunity"),
+                      ("Volume Opportunity", "volume_opportunity", "invalid type volume opportunity"),
+                      ("CPC", "cpc", "invalid type CPC"),
+                      ("CPS", "cps", "invalid type CPS")]
@@ -0,0 +1,44 @@
+import json
+import os
+
+from decouple import config
+
+from utils.constants.fileconstants import project_base_dir
+serp_api_url = config('SERP_API_URL', default='https://serpapi.com/search')
+serp_concurrency = int(config('SERP_CONCURRENCY', default=100))
+serp_submission_window = int(config('SERP_SUBMISSION_WINDOW', default=200))
+serp_request_timeout = int(config('SERP_REQUEST_TIMEOUT', default=60))
+thread_fetch_engine = "threads"
+async_fetch_engine = "async"
+archive_fetch_engine = "archive"
+# default limits of an API key, a rate of 0 requests per second disables the token bucket
+serp_requests_per_second = float(config('SERP_REQUESTS_PER_SECOND', default=0))
+serp_burst = float(config('SERP_BURST', default=10))
+serp_min_concurrency = int(config('SERP_MIN_CONCURRENCY', default=4))
+serp_max_concurrency = int(config('SERP_MAX_CONCURRENCY', default=100))
+serp_latency_target = float(config('SERP_LATENCY_TARGET', default=20))
+# limits overriding the defaults per API key, e.g. {"<api key>": {"requests_per_second": 5, "max_concurrency": 20}}
+serp_api_key_limits = config('SERP_API_KEY_LIMITS', default='{}', cast=json.loads)
+serp_rate_limit_poll_interval = 0.05
+# shares the requests per second of every API key between the jobs of all the workers, kept in this process if unset
+serp_rate_limit_redis_url = config('SERP_RATE_LIMIT_REDIS_URL', default='')
+serp_job_heartbeat_interval = float(config('SERP_JOB_HEARTBEAT_INTERVAL', default=5))
+serp_max_retries = int(config('SERP_MAX_RETRIES', default=3))
+serp_retry_delay = float(config('SERP_RETRY_DELAY', default=1))
+# results younger than the max age of a job are served from the cache, jobs may accept results up to the max ttl.
+# 0 searches every keyword again, jobs opt in to the cache with their own max age
+serp_cache_max_age = float(config('SERP_CACHE_MAX_AGE', default=0))
+serp_cache_max_ttl = float(config('SERP_CACHE_MAX_TTL', default=30 * 86400))
+serp_cache_path = config('SERP_CACHE_PATH', default=os.path.join(project_base_dir, "cache", "serp_cache.sqlite3"))
+serp_cache_max_size = int(config('SERP_CACHE_MAX_SIZE', default=2 * 1024 ** 3))
+serp_cache_eviction_interval = 1000
+# shares the cache between the workers, kept on local disk if unset
+serp_cache_redis_url = config('SERP_CACHE_REDIS_URL', default='')
+# searches of a job are claimed so that running jobs needing the same results wait for them instead of searching
+serp_claim_ttl = float(config('SERP_CLAIM_TTL', default=serp_request_timeout * (serp_max_retries + 2)))
+serp_claim_poll_interval = 0.5
+# raw results of every search of a job are archived so that its outputs can be rebuilt without searching again.
+# Archives are kept until deleted, so archiving is off unless enabled
+serp_archive_enabled = config('SERP_ARCHIVE_ENABLED', default=False, cast=bool)
+archive_processes = int(config('ARCHIVE_PROCESSES', default=os.cpu_count() or 1))
+archive_batch_size = 256
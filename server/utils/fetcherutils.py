@@ -1,16 +1,24 @@
-import re, os
+import re, os, json, time, queue, threading, heapq, shutil, tempfile
 from typing import List
 from serpapi import GoogleSearch
 import csv
 from statistics import median
 
-from utils.commonutils import calculate_rank, get_fib_helper, remove_permalink, get_ctr_values, calc_competitor_score
+import numpy as np
+
+from utils.commonutils import calculate_rank, get_fib_helper, remove_permalink, get_feature_mask, \
+    lookup_ctr_values_batch, calc_competitor_score
 from utils.constants.fetcherconstants import *
+from utils.constants.celeryconstants import snapshot_queue_size, snapshot_merge_fan_in, snapshot_manifest_name, \
+    snapshot_top_view, snapshot_bulk_view, snapshot_views_column
 from utils.models.combinedmodels import Rank
 from utils.models.fetchermodels import Node, Feature, Arguments, Link
 from utils.logutils import *
 from utils.constants.fileconstants import *
 from utils.cloudutils import *
+from utils.ratelimitutils import *
+from utils.serpcacheutils import *
+from utils.archiveutils import *
 
 is_string_specialcharacter_less = re.compile("^[A-Za-z0-9 ]+$")
 
@@ -28,8 +36,7 @@ def write_current_output_file(job_id: str, job_type: str = "fetcher"):
     current_out_file = ""
     current_bulk_file = ""
 
-    snapshots_path, current_out_file, current_bulk_file = write_output_file(job_id, keep_snapshots=True, failure=False,
-                                                                            job_type=job_type)
+    snapshots_path, current_out_file, current_bulk_file = write_output_file(job_id, job_type=job_type)
     if not current_bulk_file or not current_out_file:
         return current_out_file, current_bulk_file
     now = datetime.now()
@@ -53,28 +60,14 @@ def write_current_output_file(job_id: str, job_type: str = "fetcher"):
     return upload_file_path, bulk_upload_file_path
 
 
-def get_keyword_links(query: Node, arguments: Arguments, key_link_dict: List[Node],
-                      bulk_key_link_dict: List[Node], lock, count, snapshot_record_count, job_id: str,
-                      job_type: str, number: int, total_queries: int, target_domain: str = "",
-                      competitor_domains: List[str] = None, increment: int = 8):
+def get_search_params(query: Node, arguments: Arguments) -> dict:
     """
-    Hits SERP API and gets the links for the keyword
-    :param query: keyword to get links
+    Gets the SERP API parameters to search the keyword with
+    :param query: keyword to search
     :param arguments: search arguments
-    :param key_link_dict: list to store fetcher data
-    :param bulk_key_link_dict: list to store fetcher data in bulk
-    :param lock: lock passed with the shared data
-    :param count: The snapshot number
-    :param snapshot_record_count: threshold size for taking a snapshot
-    :param job_id: id of the current job
-    :param job_type: type of the current job
-    :param number: the KW number being processed
-    :param total_queries: total number of queries to be processed
-    :param increment: increment to be added in progress per step
-    :param target_domain: target domain to be ranked
-    :param competitor_domains: list of competitor domains
+    :return: dictionary of the search parameters
     """
-    params = {
+    return {
         "engine": arguments.search_engine,
         "q": query.keyword,
         "location": arguments.region,
@@ -83,12 +76,21 @@ def get_keyword_links(query: Node, arguments: Arguments, key_link_dict: List[Nod
         "api_key": arguments.api_key,
         "num": 100
     }
+
+
+def process_search_results(query: Node, search_results: dict, target_domain: str = "",
+                           competitor_domains: List[str] = None):
+    """
+    Parses the SERP API results of a keyword into its node
+    :param query: keyword the results are for
+    :param search_results: SERP API results
+    :param target_domain: target domain to be ranked
+    :param competitor_domains: list of competitor domains
+    :return: node with all the results, None if the keyword is misspelled
+    """
     links = []
-    bulk_links = []
-    search = GoogleSearch(params)
-    search_results = search.get_dict()
+    answer_box_result = None
     misspelled = False
-    connect_to_socket(node_server_url)
     features = Feature()
     if "search_information" in search_results:
         search_information = search_results["search_information"]
@@ -115,7 +117,7 @@ def get_keyword_links(query: Node, arguments: Arguments, key_link_dict: List[Nod
                 else:
                     cur_link.snippet = ""
                 cur_link.position = 1
-                links.append(cur_link)
+                answer_box_result = cur_link
         key_rank = Rank()
         competitor_ranks = []
         if "organic_results" in search_results:
@@ -126,11 +128,7 @@ def get_keyword_links(query: Node, arguments: Arguments, key_link_dict: List[Nod
                                               competitor_domains=competitor_domains)
             key_rank = competitor_ranks[0]
             competitor_ranks = competitor_ranks[1:]
-            bulk_organic_results = organic_results[:]
-            organic_results = organic_results[:10]
-            features.organic_result_count = len(organic_results)
-
-            for result in bulk_organic_results:
+            for result in organic_results:
                 cur_link = Link()
                 if "link" in result:
                     cur_link.url = remove_permalink(result["link"])
@@ -143,9 +141,11 @@ def get_keyword_links(query: Node, arguments: Arguments, key_link_dict: List[Nod
                     cur_link.snippet = snippet.replace(";", "\";\"")
                 else:
                     cur_link.snippet = ""
-                bulk_links.append(cur_link)
+                links.append(cur_link)
 
-            for result in organic_results:
+            organic_results = organic_results[:10]
+            features.organic_result_count = len(organic_results)
+            for cur_link, result in zip(links, organic_results):
                 if "sitelinks_search_box" in result and result["sitelinks_search_box"]:
                     features.sitelinks_search_box = True
 
@@ -155,21 +155,8 @@ def get_keyword_links(query: Node, arguments: Arguments, key_link_dict: List[Nod
                     if "inline" in result["sitelinks"]:
                         features.sitelinks_inline = True
 
-                cur_link = Link()
                 if "related_results" in result:
                     cur_link.related_results_count = len(result["related_results"])
-                if "link" in result:
-                    cur_link.url = remove_permalink(result["link"])
-                if "position" in result:
-                    cur_link.position = result["position"]
-                if "title" in result:
-                    cur_link.title = result["title"]
-                if "snippet" in result:
-                    snippet: str = result["snippet"]
-                    cur_link.snippet = snippet.replace(";", "\";\"")
-                else:
-                    cur_link.snippet = ""
-                links.append(cur_link)
 
         if "ads" in search_results:
             for ad in search_results["ads"]:
@@ -258,37 +245,32 @@ def get_keyword_links(query: Node, arguments: Arguments, key_link_dict: List[Nod
         if query.cpc == -1.0:
             query.cpc = cpc_median
 
-        ctr_value, potential_ctr_value = get_ctr_values(serp_features=features,
-                                                        ranking_position=key_rank.client_ranking_position)
+        # the target and all the competitors are looked up at once, they share the features of the SERP
+        ctr_values, potential_ctr_values = lookup_ctr_values_batch(
+            feature_masks=get_feature_mask(serp_features=features),
+            ranking_positions=[key_rank.client_ranking_position] +
+                              [comp_rank.client_ranking_position for comp_rank in competitor_ranks])
+        ctr_values = ctr_values.tolist()
+        potential_ctr_value = potential_ctr_values.item()
         potential_traffic = potential_ctr_value * query.volume * query.cps
-        current_traffic = ctr_value * query.volume * query.cps
+        current_traffic = ctr_values[0] * query.volume * query.cps
 
         current_value = current_traffic * query.cpc
         potential_value = potential_traffic * query.cpc
 
-        for comp_rank in competitor_ranks:
-            cv, pv = get_ctr_values(serp_features=features,
-                                    ranking_position=comp_rank.client_ranking_position)
+        for comp_rank, cv in zip(competitor_ranks, ctr_values[1:]):
             comp_rank.current_traffic = cv * query.volume * query.cps
             comp_rank.current_value = comp_rank.current_traffic * query.cpc
 
-        bulk_key_link = Node()
         key_link = Node()
-
         key_link.keyword = query.keyword
-        bulk_key_link.keyword = query.keyword
         key_link.volume = query.volume
-        bulk_key_link.volume = query.volume
         key_link.links = links
-        bulk_key_link.links = bulk_links
+        key_link.answer_box = answer_box_result
         key_link.primary_search_intents = primary_intents
-        bulk_key_link.primary_search_intents = primary_intents
         key_link.secondary_search_intents = secondary_intents
-        bulk_key_link.secondary_search_intents = secondary_intents
         key_link.rank = key_rank
-        key_link.competitor_ranks = competitor_ranks[0:]
-        bulk_key_link.rank = key_rank
-        bulk_key_link.competitor_ranks = competitor_ranks[0:]
+        key_link.competitor_ranks = competitor_ranks
 
         key_link.difficulty = query.difficulty
         key_link.current_traffic = current_traffic
@@ -299,42 +281,207 @@ def get_keyword_links(query: Node, arguments: Arguments, key_link_dict: List[Nod
         key_link.cpc = query.cpc
         key_link.cps = query.cps
 
-        bulk_key_link.difficulty = query.difficulty
-        bulk_key_link.current_traffic = current_traffic
-        bulk_key_link.current_value = current_value
-        bulk_key_link.potential_value = potential_value
-        bulk_key_link.potential_traffic = potential_traffic
-        bulk_key_link.fibonacci_helper = get_fib_helper(rank_position=key_rank.client_ranking_position)
-        bulk_key_link.cpc = query.cpc
-        bulk_key_link.cps = query.cps
-
-        key_link_dict.append(key_link)
-        bulk_key_link_dict.append(bulk_key_link)
-
-        with lock:
-            if len(key_link_dict) >= snapshot_record_count:
-                write_snapshot_file(key_link_dict, bulk_key_link_dict, lock, count, snapshot_record_count, job_id,
-                                    job_type=job_type)
-
-    total_processed = len(key_link_dict)
-    step = (total_queries // 10)
-    if total_processed % step == 0:
-        progress = 5 + (increment * (total_processed / step))
-        progress_logger.info({"jobId": job_id, "progress": progress})
+        return key_link
+    return None
+
+
+class SnapshotWriter:
+    """
+    Takes the snapshots of a job on its own thread. Fetch workers put the node of every keyword in a bounded
+    queue and only wait when the writer falls a full queue behind
+    """
+
+    def __init__(self, count, snapshot_record_count, job_id: str, job_type: str, total_queries: int,
+                 increment: int = 8):
+        self.count = count
+        self.snapshot_record_count = snapshot_record_count
+        self.job_id = job_id
+        self.job_type = job_type
+        self.total_queries = total_queries
+        self.increment = increment
+        self.error = None
+        self.queue = queue.Queue(maxsize=snapshot_queue_size)
+        self.thread = threading.Thread(target=self.write_snapshots, daemon=True)
+        self.thread.start()
+
+    def put(self, key_link):
+        """
+        Hands the node of a fetched keyword over to the writer
+        :param key_link: node with all the results, None if the keyword is misspelled
+        """
+        self.queue.put(key_link)
+
+    def write_snapshots(self):
+        """
+        Collects the fetched keywords into snapshots until the writer is closed
+        """
+        key_link_dict = []
+        total_processed = 0
+        step = self.total_queries // 10
+        while True:
+            key_link = self.queue.get()
+            if key_link is SnapshotWriter:
+                break
+            if self.error is not None:
+                # keeps draining the queue so that the fetch workers are not blocked
+                continue
+            try:
+                if key_link is not None:
+                    key_link_dict.append(key_link)
+                    if len(key_link_dict) >= self.snapshot_record_count:
+                        write_snapshot_file(key_link_dict, self.count, self.job_id, job_type=self.job_type)
+                        key_link_dict = []
+                total_processed = total_processed + 1
+                if step > 0 and total_processed % step == 0:
+                    progress = 5 + (self.increment * (total_processed / step))
+                    progress_logger.info({"jobId": self.job_id, "progress": progress})
+            except Exception as e:
+                self.error = e
+        if self.error is None and key_link_dict:
+            try:
+                write_snapshot_file(key_link_dict, self.count, self.job_id, job_type=self.job_type)
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        """
+        Writes the last snapshot once all the keywords are fetched and waits for the writer to finish
+        """
+        # the class itself marks the end of the keywords
+        self.queue.put(SnapshotWriter)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def log_search_error(params: dict, status_code: int, search_results: dict):
+    """
+    Logs a search SERP API answered with an error which is not worth retrying
+    :param params: search parameters
+    :param status_code: HTTP status code of the response
+    :param search_results: SERP API results
+    """
+    job_logger.error(f"SERP API answered {status_code} for {params['q']}: {search_results.get('error', '')}")
+
+
+def get_search_results(params: dict, rate_limiter: SerpRateLimiter) -> dict:
+    """
+    Hits SERP API within the limits of the API key, retrying the throttled searches. Searches still throttled
+    after the last retry raise, other errors are returned as SERP API answered them and parse to no results
+    :param params: search parameters
+    :param rate_limiter: rate limiter of the API key
+    :return: SERP API results
+    """
+    search = GoogleSearch(dict(params, output="json"))
+    for attempt in range(serp_max_retries + 1):
+        rate_limiter.acquire()
+        start = time.monotonic()
+        throttled = True
+        try:
+            response = search.get_response()
+            throttled = is_throttled(response.status_code)
+        finally:
+            rate_limiter.release(time.monotonic() - start, throttled)
+        if not throttled:
+            break
+        if attempt < serp_max_retries:
+            time.sleep(get_retry_delay(attempt))
+        else:
+            response.raise_for_status()
+    search_results = dict(response.json())
+    if not response.ok:
+        log_search_error(params, response.status_code, search_results)
+    return search_results
+
+
+def get_keyword_search_results(params: dict, arguments: Arguments, job_id: str) -> dict:
+    """
+    Gets the results of a search from the cache, from a running job doing the same search or from SERP API
+    :param params: search parameters
+    :param arguments: search arguments
+    :param job_id: id of the current job
+    :return: SERP API results
+    """
+    search_results = get_cached_results(params, arguments.cache_max_age, job_id)
+    if search_results is not None:
+        return search_results
+    # the results of other jobs are shared through the cache, so jobs skipping it don't wait for them
+    shared = arguments.cache_max_age > 0
+    claimed = shared and claim_search(params)
+    if shared and not claimed:
+        search_results = wait_for_claimed_search(params, arguments.cache_max_age, job_id)
+        if search_results is not None:
+            return search_results
+    try:
+        search_results = get_search_results(params, get_rate_limiter(arguments.api_key, job_id))
+        cache_results(params, search_results)
+    finally:
+        if claimed:
+            release_search(params)
+    return search_results
+
+
+def group_duplicate_queries(queries: List[Node]) -> List[List[Node]]:
+    """
+    Groups the keywords which only differ in case or whitespace, so that every group is searched once
+    :param queries: keywords to search
+    :return: groups of keywords in the order of their first keyword
+    """
+    query_groups = dict()
+    for query in queries:
+        query_groups.setdefault(normalize_keyword(query.keyword), []).append(query)
+    return list(query_groups.values())
+
+
+def get_keyword_links(queries: List[Node], arguments: Arguments, snapshot_writer: SnapshotWriter, job_id: str,
+                      target_domain: str = "", competitor_domains: List[str] = None):
+    """
+    Hits SERP API once for a group of duplicate keywords and gets the links for every keyword of the group
+    :param queries: duplicate keywords to get links
+    :param arguments: search arguments
+    :param snapshot_writer: writer taking the snapshots of the job
+    :param job_id: id of the current job
+    :param target_domain: target domain to be ranked
+    :param competitor_domains: list of competitor domains
+    """
+    search_results = get_keyword_search_results(get_search_params(query=queries[0], arguments=arguments),
+                                                arguments, job_id)
+    if serp_archive_enabled:
+        archive_search_results(job_id, normalize_keyword(queries[0].keyword), search_results)
+    connect_to_socket(node_server_url)
+    for query in queries:
+        snapshot_writer.put(process_search_results(query=query, search_results=search_results,
+                                                   target_domain=target_domain,
+                                                   competitor_domains=competitor_domains))
+
+
+def collect_fetch_results(done, in_flight: dict) -> int:
+    """
+    Removes the finished searches from the searches in flight and logs the ones which failed
+    :param done: futures of the finished searches
+    :param in_flight: dictionary of the futures of the searches in flight to their keywords
+    :return: number of keywords whose search failed
+    """
+    failed_count = 0
+    for future in done:
+        queries = in_flight.pop(future)
+        if future.exception() is not None:
+            failed_count = failed_count + len(queries)
+            job_logger.error(f"Could not get links for {queries[0].keyword}: {future.exception()}")
+    return failed_count
 
 
-def get_out_row(key_link: Node, link: Link):
+def get_out_rows(key_link: Node, snapshot_links) -> list:
     """
-    Generates and returns a row for the output file
+    Generates the rows of a keyword for the snapshot file, computing its keyword columns once for all its links
     :param key_link: Node object containing the keyword and it's respective fields
-    :param link: Link object containing the link and it's respective fields
-    :return: A list containing the row data
+    :param snapshot_links: iterable of the links of the keyword with the outputs of every link
+    :return: A list containing the data of every row
     """
     primary_intents = "/".join(key_link.primary_search_intents)
     secondary_intents = "/".join(key_link.secondary_search_intents)
     comp_score, comp_count = calc_competitor_score(key_link=key_link)
-    out_row = [
-        key_link.keyword, key_link.volume, link.url, link.position, link.title, link.snippet,
+    keyword_columns = [
         primary_intents, secondary_intents, key_link.rank.client_ranking_url,
         key_link.rank.client_ranking_position, key_link.rank.client_url_ranking_count,
         key_link.cpc,
@@ -348,15 +495,16 @@ def get_out_row(key_link: Node, link: Link):
         key_link.potential_value - key_link.current_value,
         key_link.volume - key_link.current_traffic,
         comp_score,
-        comp_count,
-        link.related_results_count
+        comp_count
     ]
+    competitor_columns = []
     for comp_rank in key_link.competitor_ranks:
-        out_row.append(comp_rank.client_ranking_url)
-        out_row.append(comp_rank.client_ranking_position)
-        out_row.append(comp_rank.current_traffic)
-        out_row.append(comp_rank.current_value)
-    return out_row
+        competitor_columns.append(comp_rank.client_ranking_url)
+        competitor_columns.append(comp_rank.client_ranking_position)
+        competitor_columns.append(comp_rank.current_traffic)
+        competitor_columns.append(comp_rank.current_value)
+    return [[key_link.keyword, key_link.volume, link.url, link.position, link.title, link.snippet, *keyword_columns,
+             link.related_results_count, *competitor_columns, views] for link, views in snapshot_links]
 
 
 def get_header_array(competitor_count: int = 0):
@@ -381,14 +529,25 @@ def get_header_array(competitor_count: int = 0):
     return header_array
 
 
-def write_snapshot_file(key_link_dict: List[Node], bulk_key_link_dict: List[Node], lock, count, snapshot_record_count,
-                        job_id: str,
-                        job_type: str = "fetcher"):
+def get_snapshot_links(key_link: Node):
     """
-    Writes the snapshot file of (snapshot_record_count(i.e 100)) fetched records to the snapshot directory
-    :param key_link_dict: A list of Node objects containing the keyword and data for it's top results
-    :param bulk_key_link_dict: A list of Node objects containing the keyword and data for all it's results
-    :lock: lock is passed with shared data
+    Gets the links of a keyword with the outputs they belong to, the answer box and the first 10 organic results
+    are its top results
+    :param key_link: Node object containing the keyword and all it's results
+    :return: generator of the links and the outputs of every link
+    """
+    if key_link.answer_box is not None:
+        yield key_link.answer_box, snapshot_top_view
+    for i, link in enumerate(key_link.links):
+        yield link, (snapshot_top_view | snapshot_bulk_view) if i < 10 else snapshot_bulk_view
+
+
+def write_snapshot_file(key_link_dict: List[Node], count, job_id: str, job_type: str = "fetcher"):
+    """
+    Writes the snapshot file of the given fetched records to the snapshot directory, every row is marked with the
+    outputs it belongs to
+    :param key_link_dict: A list of Node objects containing the keyword and data for all it's results
+    :param count: The snapshot number
     :param job_id: The job id
     :param job_type: The job type
     :return: None
@@ -396,58 +555,101 @@ def write_snapshot_file(key_link_dict: List[Node], bulk_key_link_dict: List[Node
 
     connect_to_socket(node_server_url)
     count[0] += 1
-    snapshot_file_name = f"{project_base_dir}/processed/fetcher/snapshots/" + job_id + "_" + str(count[0]) + ".csv"
-    bulk_snapshot_file_name = f"{project_base_dir}/processed/fetcher/snapshots/bulk_" + job_id + "_" + str(
-        count[0]) + ".csv"
-    fetcher_snapshot_file = open(snapshot_file_name, "w+", newline="", encoding='utf-8-sig')
-    fetcher_bulk_snapshot_file = open(bulk_snapshot_file_name, "w+", newline="", encoding='utf-8-sig')
+    snapshot_dir = get_snapshot_dir(job_id)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    segment = {"segment": count[0], "file": f"segment_{count[0]}.csv"}
+    fetcher_snapshot_file = open(os.path.join(snapshot_dir, segment["file"]), "w+", newline="", encoding='utf-8-sig')
     fetcher_writer = csv.writer(fetcher_snapshot_file)
-    fetcher_bulk_writer = csv.writer(fetcher_bulk_snapshot_file)
     competitor_count = 0
 
     if len(key_link_dict) > 0:
         competitor_count = len(key_link_dict[0].competitor_ranks)
     header_array = get_header_array(competitor_count=competitor_count)
+    header_array.append(snapshot_views_column)
     fetcher_writer.writerow(header_array)
-    fetcher_bulk_writer.writerow(header_array)
 
-    if len(key_link_dict) < snapshot_record_count:
-        data_list = key_link_dict[0:]
-        bulk_data_list = bulk_key_link_dict[0:]
+    # snapshots are sorted by keyword so that the output file is a merge of them
+    key_link_dict = sorted(key_link_dict, key=lambda key_link: str(key_link.keyword))
+    rows = 0
+    bulk_rows = 0
+    for key_link in key_link_dict:
+        fetcher_writer.writerows(get_out_rows(key_link=key_link, snapshot_links=get_snapshot_links(key_link=key_link)))
+        rows += (key_link.answer_box is not None) + min(len(key_link.links), 10)
+        bulk_rows += len(key_link.links)
 
-        # removing used elements from lists
-        key_link_dict.clear()
-        bulk_key_link_dict.clear()
-    else:
-        data_list = key_link_dict[0:snapshot_record_count]
-        bulk_data_list = bulk_key_link_dict[0:snapshot_record_count]
+    fetcher_snapshot_file.close()
+    # the segment is only added to the manifest once its file is complete
+    segment["rows"] = rows
+    segment["bulk_rows"] = bulk_rows
+    segment["keywords"] = [key_link.keyword for key_link in key_link_dict]
+    append_to_manifest(snapshot_dir, segment)
+    return
 
-        # removing used elements from lists
-        for i in range(snapshot_record_count):
-            key_link_dict.remove(key_link_dict[0])
-            bulk_key_link_dict.remove(bulk_key_link_dict[0])
 
-    for key_link in data_list:
-        for link in key_link.links:
-            fetcher_writer.writerow(get_out_row(key_link=key_link, link=link))
+def append_to_manifest(snapshot_dir: str, segment: dict):
+    """
+    Appends a segment to the manifest of the snapshot segments of a job
+    :param snapshot_dir: directory of the snapshot segments
+    :param segment: files, row counts and keywords of the segment
+    """
+    with open(os.path.join(snapshot_dir, snapshot_manifest_name), "a+b") as manifest_file:
+        line = json.dumps(segment, default=str).encode() + b"\n"
+        # a line cut short by a killed job is ended so that it doesn't swallow this one
+        if manifest_file.tell() > 0:
+            manifest_file.seek(-1, os.SEEK_END)
+            if manifest_file.read(1) != b"\n":
+                line = b"\n" + line
+        manifest_file.write(line)
 
-    for bulk_key_link in bulk_data_list:
-        for link in bulk_key_link.links:
-            fetcher_bulk_writer.writerow(get_out_row(key_link=bulk_key_link, link=link))
 
-    fetcher_snapshot_file.close()
-    fetcher_bulk_snapshot_file.close()
-    return
+def get_snapshot_dir(job_id: str) -> str:
+    """
+    Gets the directory of the snapshot segments of a job
+    :param job_id: The job id
+    :return: path of the directory
+    """
+    return f"{project_base_dir}/processed/fetcher/snapshots/{job_id}/"
 
 
-def write_output_file(job_id: str, keep_snapshots: bool, failure: bool, job_type: str = "fetcher"):
+def read_snapshot_manifest(job_id: str) -> list:
+    """
+    Reads the manifest of the snapshot segments of a job
+    :param job_id: The job id
+    :return: list of the segments in the order they were written, each with its files, row counts and keywords
+    """
+    manifest_file_name = os.path.join(get_snapshot_dir(job_id), snapshot_manifest_name)
+    if not os.path.exists(manifest_file_name):
+        return []
+    segments = []
+    with open(manifest_file_name, encoding="utf-8") as manifest_file:
+        for line in manifest_file:
+            try:
+                segments.append(json.loads(line))
+            except ValueError:
+                # the last line is cut short if the job was killed while writing it
+                continue
+    return segments
+
+
+def get_completed_keywords(job_id: str) -> tuple:
+    """
+    Gets the keywords of a job which are in its snapshots already, for resuming it
+    :param job_id: The job id
+    :return: number of the last segment and list of the completed keywords
+    """
+    segments = read_snapshot_manifest(job_id)
+    completed_keywords = dict()
+    for segment in segments:
+        completed_keywords.update(dict.fromkeys(segment["keywords"]))
+    return max([segment["segment"] for segment in segments], default=0), list(completed_keywords)
+
+
+def write_output_file(job_id: str, job_type: str = "fetcher"):
     """ 
-    Writes the output file to the output directory by merging snapshots
+    Writes the output file to the output directory by merging the snapshot segments in the manifest of the job
     :param job_id: The job id
-    :param keep_snapshots: flag to remove the snapshot files which are merged to make an output file
-    :param failure: flag to return the dataframe instead of csv file
     :param job_type: The job type
-    :return: None
+    :return: snapshot directory, output file and bulk output file, None if there are no segments
     """
     connect_to_socket(node_server_url)
     log = "Merging snapshots to output file..."
@@ -455,55 +657,153 @@ def write_output_file(job_id: str, keep_snapshots: bool, failure: bool, job_type
     now = datetime.now()
     time_stamp = now.strftime("%Y%m%d_%H_%M_%S")
 
-    output_file_name = f"{project_base_dir}/processed/fetcher/fetcher_output_" + time_stamp + ".csv"
-    bulk_output_file_name = f"{project_base_dir}/processed/fetcher/bulk_fetcher_output_" + time_stamp + ".csv"
+    output_file_name = f"{project_base_dir}/processed/fetcher/fetcher_output_{job_id}_{time_stamp}.csv"
+    bulk_output_file_name = f"{project_base_dir}/processed/fetcher/bulk_fetcher_output_{job_id}_{time_stamp}.csv"
 
-    # path to snapshot files
-    snapshot_files_path = f"{project_base_dir}/processed/fetcher/snapshots/"
+    snapshot_dir = get_snapshot_dir(job_id)
+    segments = read_snapshot_manifest(job_id)
+    if not segments:
+        return None, None, None
 
-    # creates list with files to merge based on name convention
-    snapshot_files_list = [snapshot_files_path + f for f in os.listdir(snapshot_files_path) if f.startswith(job_id)]
+    merge_snapshot_files([os.path.join(snapshot_dir, segment["file"]) for segment in segments], output_file_name,
+                         bulk_output_file_name)
 
-    bulk_snapshot_files_list = [snapshot_files_path + f for f in os.listdir(snapshot_files_path) if
-                                f.startswith('bulk_' + job_id)]
-    snapshot_csv_list = []
-    bulk_snapshot_csv_list = []
-    count = 0
+    return snapshot_dir, output_file_name, bulk_output_file_name
 
-    # reads each (sorted) file in file_list, converts it to pandas DF and appends it to the csv_list
-    for file in sorted(snapshot_files_list):
-        count = count + 1
-        snapshot_csv_list.append(pd.read_csv(file))
 
-    for file in sorted(bulk_snapshot_files_list):
-        bulk_snapshot_csv_list.append(pd.read_csv(file))
+def read_snapshot_rows(file_name: str):
+    """
+    Reads the rows of a snapshot, which are sorted by keyword
+    :param file_name: path of the snapshot
+    :return: generator of the rows of the snapshot
+    """
+    with open(file_name, newline="", encoding="utf-8-sig") as snapshot_file:
+        reader = csv.reader(snapshot_file)
+        next(reader, None)
+        yield from reader
 
-    if not snapshot_csv_list or not bulk_snapshot_csv_list:
-        return None, None
 
-    # merges single pandas DFs into a single DF, index is refreshed
-    snapshot_csv_merged = pd.concat(snapshot_csv_list, ignore_index=True)
-    bulk_snapshot_csv_merged = pd.concat(bulk_snapshot_csv_list, ignore_index=True)
+def read_snapshot_header(file_name: str) -> list:
+    """
+    Reads the header of a snapshot
+    :param file_name: path of the snapshot
+    :return: header of the snapshot
+    """
+    with open(file_name, newline="", encoding="utf-8-sig") as snapshot_file:
+        return next(csv.reader(snapshot_file), [])
 
-    # to return the number of snapshots already taken and dataframe if this function is called by resume route
-    if failure == True:
-        return count, snapshot_csv_merged
 
-    # sorted the dataframe before making a csv file.
-    snapshot_csv_merged.sort_values(by=snapshot_csv_merged.columns[0], ignore_index=True, inplace=True)
-    bulk_snapshot_csv_merged.sort_values(by=bulk_snapshot_csv_merged.columns[0], ignore_index=True, inplace=True)
+def merge_sorted_files(file_names: List[str], output_file_name: str, header: list):
+    """
+    Merges sorted snapshots into one file sorted by keyword, holding a single row of every snapshot in memory
+    :param file_names: paths of the snapshots
+    :param output_file_name: path of the merged file
+    :param header: header of the merged file
+    """
+    with open(output_file_name, "w", newline="", encoding="utf-8") as output_file:
+        writer = csv.writer(output_file, lineterminator="\n")
+        writer.writerow(header)
+        # rows of a keyword keep the order of their snapshots, as the merge is stable
+        writer.writerows(heapq.merge(*[read_snapshot_rows(file_name) for file_name in file_names],
+                                     key=lambda row: row[0]))
 
-    # Single DF is saved to the path in CSV format, without index column
-    snapshot_csv_merged.to_csv(output_file_name, index=False)
-    bulk_snapshot_csv_merged.to_csv(bulk_output_file_name, index=False)
 
-    return snapshot_files_path, output_file_name, bulk_output_file_name
+def split_sorted_files(file_names: List[str], output_file_name: str, bulk_output_file_name: str, header: list):
+    """
+    Merges sorted snapshots into the top results output and the bulk output in one pass, writing every row to the
+    outputs it is marked with
+    :param file_names: paths of the snapshots
+    :param output_file_name: path of the top results output
+    :param bulk_output_file_name: path of the bulk output
+    :param header: header of the snapshots
+    """
+    header = header[:-1]
+    # the bulk output has never carried the related results counts of the top results
+    related_results_index = header.index("Related Results Count")
+    with open(output_file_name, "w", newline="", encoding="utf-8") as output_file, \
+            open(bulk_output_file_name, "w", newline="", encoding="utf-8") as bulk_output_file:
+        writer = csv.writer(output_file, lineterminator="\n")
+        bulk_writer = csv.writer(bulk_output_file, lineterminator="\n")
+        writer.writerow(header)
+        bulk_writer.writerow(header)
+        for row in heapq.merge(*[read_snapshot_rows(file_name) for file_name in file_names],
+                               key=lambda row: row[0]):
+            views = int(row.pop())
+            if views & snapshot_top_view:
+                writer.writerow(row)
+            if views & snapshot_bulk_view:
+                row[related_results_index] = 0
+                bulk_writer.writerow(row)
+
+
+def merge_snapshot_files(snapshot_files_list: List[str], output_file_name: str, bulk_output_file_name: str):
+    """
+    Merges the snapshots of a job into its output files in passes of at most snapshot_merge_fan_in files, keeping
+    the open files bounded, the last pass splits them into the outputs
+    :param snapshot_files_list: paths of the snapshots
+    :param output_file_name: path of the top results output
+    :param bulk_output_file_name: path of the bulk output
+    """
+    header = read_snapshot_header(snapshot_files_list[0])
+    runs_dir = tempfile.mkdtemp(dir=os.path.dirname(output_file_name))
+    try:
+        runs = snapshot_files_list
+        while len(runs) > snapshot_merge_fan_in:
+            merged_runs = []
+            for i in range(0, len(runs), snapshot_merge_fan_in):
+                run_file_name = os.path.join(runs_dir, f"run_{len(os.listdir(runs_dir))}.csv")
+                merge_sorted_files(runs[i:i + snapshot_merge_fan_in], run_file_name, header)
+                merged_runs.append(run_file_name)
+            runs = merged_runs
+        split_sorted_files(runs, output_file_name, bulk_output_file_name, header)
+    finally:
+        shutil.rmtree(runs_dir, ignore_errors=True)
 
 
 def delete_snapshots(snapshot_files_path: str, job_id: str):
-    for file in os.listdir(snapshot_files_path):
-        if file.startswith(job_id) or file.startswith('bulk_' + job_id):
-            os.remove(os.path.join(snapshot_files_path, file))
+    """
+    Deletes the snapshot segments of a job with their manifest
+    :param snapshot_files_path: directory of the snapshot segments
+    :param job_id: The job id
+    """
+    shutil.rmtree(snapshot_files_path or get_snapshot_dir(job_id), ignore_errors=True)
+
+
+def parse_volumes(volumes: pd.Series) -> list:
+    """
+    Parses the volume column, taking the upper bound of "1000-5000" style ranges
+    :param volumes: The volume column
+    :return: A list of the volumes, None where the volume is missing or could not be parsed
+    """
+    values = volumes.to_numpy()
+    is_text = np.fromiter((isinstance(x, str) for x in values), dtype=bool, count=len(values))
+    is_value = ~pd.isna(values) & ~is_text
+    parsed_volumes = [value if present else None for value, present in zip(values, is_value)]
+    text_positions = np.flatnonzero(is_text)
+    text_volumes = pd.Series(values[is_text], dtype=object)
+    upper_volumes = text_volumes.str.split("-").str[1]
+    is_range = (text_volumes.str.contains("-", regex=False) &
+                upper_volumes.str.isnumeric().fillna(False).astype(bool)).to_numpy()
+    is_number = text_volumes.str.isnumeric().astype(bool).to_numpy()
+    for position, volume in zip(text_positions[is_range].tolist(), upper_volumes[is_range]):
+        parsed_volumes[position] = float(volume)
+    for position, volume in zip(text_positions[is_number].tolist(), text_volumes[is_number]):
+        parsed_volumes[position] = float(volume)
+    return parsed_volumes
+
+
+def numeric_column(input_keywords_df: pd.DataFrame, column: str) -> list:
+    """
+    Coerces a column to numbers
+    :param input_keywords_df: The input DataFrame
+    :param column: The name of the column
+    :return: A list of the numbers, None where the column is missing or the value is not a number
+    """
+    if column not in input_keywords_df:
+        return [None] * len(input_keywords_df)
+    values = pd.to_numeric(input_keywords_df[column], errors='coerce').to_numpy()
+    is_value = ~pd.isna(values)
+    return [value if present else None for value, present in zip(values, is_value)]
 
 
 def get_input_queries(arguments: Arguments, already_searched_keywords_list: List):
@@ -519,46 +819,37 @@ def get_input_queries(arguments: Arguments, already_searched_keywords_list: List
     input_keywords_df = input_keywords_df[input_keywords_df['Keyword'].notnull()]
 
     # returns the dataframe having only those keywords which are not searched before
-    input_keywords_df = input_keywords_df[
-        ~input_keywords_df['Keyword'].isin(already_searched_keywords_list)].reset_index()
-
-    data_frame_size = len(input_keywords_df)
-    i = 0
-    query_count = 1
-    if 'CPC' in input_keywords_df:
-        input_keywords_df['CPC'] = pd.to_numeric(input_keywords_df['CPC'], errors='coerce')
-    if 'CPS' in input_keywords_df:
-        input_keywords_df['CPS'] = pd.to_numeric(input_keywords_df['CPS'], errors='coerce')
-    input_keywords_df['Difficulty'] = pd.to_numeric(input_keywords_df['Difficulty'], errors='coerce')
-    while i < data_frame_size:
-        query = Node()
-        query.keyword = input_keywords_df.iloc[i]["Keyword"]
-        if "Volume" in input_keywords_df.iloc[i] and not pd.isna(input_keywords_df.iloc[i]["Volume"]):
-            if isinstance(input_keywords_df.iloc[i]["Volume"], str):
-                if "-" in input_keywords_df.iloc[i]["Volume"]:
-                    split_volume = input_keywords_df.iloc[i]["Volume"].split("-")
-                    if split_volume[1].isnumeric():
-                        query.volume = float(split_volume[1])
-                if input_keywords_df.iloc[i]["Volume"].isnumeric():
-                    query.volume = float(input_keywords_df.iloc[i]["Volume"])
-            else:
-                query.volume = input_keywords_df.iloc[i]["Volume"]
-        if "CPC" in input_keywords_df.iloc[i] and not pd.isna(input_keywords_df.iloc[i]["CPC"]):
-            query.cpc = input_keywords_df.iloc[i]["CPC"]
-        if "CPS" in input_keywords_df.iloc[i] and not pd.isna(input_keywords_df.iloc[i]["CPS"]):
-            query.cps = input_keywords_df.iloc[i]["CPS"]
-        if "Difficulty" in input_keywords_df.iloc[i] and not pd.isna(input_keywords_df.iloc[i]["Difficulty"]):
-            query.difficulty = input_keywords_df.iloc[i]["Difficulty"]
-        query_queue.append(query)
-        query_count += 1
-        i += 1
+    already_searched_keywords = set(already_searched_keywords_list)
+    if len(already_searched_keywords) > 0:
+        not_searched = [keyword not in already_searched_keywords for keyword in input_keywords_df['Keyword']]
+        input_keywords_df = input_keywords_df[not_searched]
+    input_keywords_df = input_keywords_df.reset_index()
+
+    volumes = [None] * len(input_keywords_df)
+    if 'Volume' in input_keywords_df:
+        volumes = parse_volumes(input_keywords_df['Volume'])
+    cpcs = numeric_column(input_keywords_df, 'CPC')
+    cpss = numeric_column(input_keywords_df, 'CPS')
+    difficulties = numeric_column(input_keywords_df, 'Difficulty')
 
-    cpc_values = [x.cpc for x in query_queue if x.cpc != -1]
-    cps_values = [x.cps for x in query_queue if x.cps != -1]
     global cpc_median
     global cps_median
+    cpc_values = [x for x in cpcs if x is not None and x != -1]
+    cps_values = [x for x in cpss if x is not None and x != -1]
     if len(cpc_values) != 0:
         cpc_median = median(cpc_values)
     if len(cps_values) != 0:
         cps_median = median(cps_values)
+
+    for keyword, volume, cpc, cps, difficulty in zip(input_keywords_df['Keyword'], volumes, cpcs, cpss,
+                                                      difficulties):
+        query = Node()
+        query.keyword = keyword
+        if volume is not None:
+            query.volume = volume
+        query.cpc = cpc if cpc is not None and cpc != -1 else cpc_median
+        query.cps = cps if cps is not None and cps != -1 else cps_median
+        if difficulty is not None:
+            query.difficulty = difficulty
+        query_queue.append(query)
     return query_queue
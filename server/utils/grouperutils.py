@@ -1,10 +1,13 @@
 import csv
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
 from typing import List
-from fuzzywuzzy import fuzz
+from fuzzywuzzy import fuzz, utils as fuzz_utils
 
 import numpy as np
 
-from utils.commonutils import get_fib_helper, calc_competitor_score, extract_slug
+from utils.commonutils import get_fib_helper, calc_competitor_score, extract_slug, get_domain_matcher
 from utils.models.combinedmodels import Rank
 from utils.models.groupermodels import Node, Group, Link
 from utils.constants.grouperconstants import *
@@ -13,6 +16,9 @@ from utils.socketutils import *
 from utils.cloudutils import *
 from utils.constants.fetcherconstants import *
 
+# index arrays shared with the grouping worker processes, by array name
+_grouping_arrays = dict()
+
 
 def usage(file_name: str):
     """
@@ -62,21 +68,6 @@ def get_args(opts, code_file):
     return input_file, output_file, threshold, hard_threshold
 
 
-def intersect_links(lst1: List[Link], lst2: List[Link]) -> List[str]:
-    """
-    :param lst1: list to intersect
-    :param lst2: second list to intersect
-    :return: intersection of the two lists
-    """
-    intersection = []
-    for link1 in lst1:
-        for link2 in lst2:
-            if link1.url == link2.url:
-                intersection.append(link1.url)
-                break
-    return intersection
-
-
 def remove_permalink(link: str) -> str:
     """
     :param link: url to cleanse
@@ -86,101 +77,292 @@ def remove_permalink(link: str) -> str:
     return cleansed_link
 
 
-def create_group_above_threshold(node_1: Node, node_2: Node, group_number: int, threshold: int):
+def intern_urls(key_link_dict: List[Node]) -> int:
+    """
+    Interns the urls of the nodes into integer ids, so that nodes share a single copy of every url
+    :param key_link_dict: list of nodes to intern the urls of
+    :return: number of distinct urls
+    """
+    url_ids = dict()
+    urls = []
+    for key_link in key_link_dict:
+        link_url_ids = []
+        for link in key_link.links:
+            url_id = url_ids.setdefault(link.url, len(urls))
+            if url_id == len(urls):
+                urls.append(link.url)
+            else:
+                link.url = urls[url_id]
+            link_url_ids.append(url_id)
+        key_link.url_ids = np.array(link_url_ids, dtype=np.int32)
+    return len(urls)
+
+
+def build_keyword_index(key_link_dict: List[Node]):
+    """
+    Builds the index of the nodes to the interned urls of their results, interning them first if any node was
+    not read by read_input
+    :param key_link_dict: list of nodes
+    :return: index pointer and url ids arrays, the urls of node i are url_ids[indptr[i]:indptr[i + 1]]
+    """
+    if any(len(x.url_ids) != len(x.links) for x in key_link_dict):
+        intern_urls(key_link_dict=key_link_dict)
+    lengths = np.array([len(x.url_ids) for x in key_link_dict], dtype=np.int64)
+    indptr = np.zeros(len(key_link_dict) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    url_ids = np.concatenate([np.empty(0, dtype=np.int64)] +
+                             [np.asarray(x.url_ids, dtype=np.int64) for x in key_link_dict])
+    return indptr, url_ids
+
+
+def build_url_index(keyword_index):
+    """
+    Builds an inverted index of the interned urls to the nodes having them in their results
+    :param keyword_index: keyword index built by build_keyword_index
+    :return: index pointer and postings arrays, the nodes having url id u are postings[indptr[u]:indptr[u + 1]]
+    """
+    keyword_indptr, url_ids = keyword_index
+    total_keywords = max(len(keyword_indptr) - 1, 1)
+    node_ids = np.repeat(np.arange(len(keyword_indptr) - 1, dtype=np.int64), np.diff(keyword_indptr))
+    url_count = int(url_ids.max()) + 1 if len(url_ids) > 0 else 0
+    # unique (url, node) pairs ordered by url and then node
+    pairs = np.unique(url_ids * total_keywords + node_ids)
+    indptr = np.searchsorted(pairs // total_keywords, np.arange(url_count + 1))
+    postings = pairs % total_keywords
+    return indptr, postings
+
+
+def count_links_in_common(start: int, stop: int, keyword_index, url_index):
+    """
+    Counts the links in common of a range of nodes with every node sharing at least one url with them
+    :param start: index of the first node to count the links in common for
+    :param stop: index after the last node to count the links in common for
+    :param keyword_index: keyword index built by build_keyword_index
+    :param url_index: url index built by build_url_index
+    :return: arrays of node index, other node index and number of links in common, ordered by both indices
+    """
+    keyword_indptr, keyword_url_ids = keyword_index
+    indptr, postings = url_index
+    rows = np.repeat(np.arange(start, stop, dtype=np.int64), np.diff(keyword_indptr[start:stop + 1]))
+    url_ids = keyword_url_ids[keyword_indptr[start]:keyword_indptr[stop]]
+    starts = indptr[url_ids]
+    posting_counts = indptr[url_ids + 1] - starts
+    # gathers the postings of every url of every row, repeated urls are counted once per occurrence
+    offsets = np.repeat(starts - np.cumsum(posting_counts) + posting_counts, posting_counts)
+    nodes = postings[offsets + np.arange(len(offsets))]
+    pairs, links_in_common = np.unique((np.repeat(rows, posting_counts) << 32) | nodes, return_counts=True)
+    return pairs >> 32, pairs & 0xFFFFFFFF, links_in_common
+
+
+def _attach_grouping_arrays(shared_arrays: dict):
+    """
+    Attaches a grouping worker process to the index arrays shared by the parent process
+    :param shared_arrays: dictionary of array name to shared memory name, dtype and length
+    """
+    for name, (shm_name, dtype, length) in shared_arrays.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _grouping_arrays[name] = (shm, np.ndarray((length,), dtype=dtype, buffer=shm.buf))
+
+
+def _count_links_in_common_above_threshold(start: int, stop: int, threshold: int):
+    """
+    Counts the links in common of a range of nodes in a grouping worker process
+    :param start: index of the first node to count the links in common for
+    :param stop: index after the last node to count the links in common for
+    :param threshold: minimum number of links in common to report
+    :return: arrays of node index, other node index and number of links in common above the threshold
+    """
+    keyword_index = (_grouping_arrays["keyword_indptr"][1], _grouping_arrays["keyword_url_ids"][1])
+    url_index = (_grouping_arrays["url_indptr"][1], _grouping_arrays["postings"][1])
+    rows, nodes, links_in_common = count_links_in_common(start=start, stop=stop, keyword_index=keyword_index,
+                                                         url_index=url_index)
+    above_threshold = links_in_common >= threshold
+    return rows[above_threshold], nodes[above_threshold], links_in_common[above_threshold]
+
+
+def count_links_in_common_parallel(keyword_index, url_index, threshold: int, processes: int):
+    """
+    Counts the links in common of every node across a pool of processes sharing the indices
+    :param keyword_index: keyword index built by build_keyword_index
+    :param url_index: url index built by build_url_index
+    :param threshold: minimum number of links in common to report
+    :param processes: number of worker processes
+    :return: arrays of node index, other node index and number of links in common above the threshold,
+             ordered by both indices
+    """
+    total_keywords = len(keyword_index[0]) - 1
+    arrays = {"keyword_indptr": keyword_index[0], "keyword_url_ids": keyword_index[1],
+              "url_indptr": url_index[0], "postings": url_index[1]}
+    blocks = []
+    shared_arrays = dict()
+    try:
+        for name, array in arrays.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(shm)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+            shared_arrays[name] = (shm.name, array.dtype, len(array))
+        chunk_size = max(grouping_batch_size, -(-total_keywords // (processes * 4)))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=_attach_grouping_arrays,
+                                                    initargs=(shared_arrays,)) as executor:
+            futures = [executor.submit(_count_links_in_common_above_threshold, start,
+                                       min(start + chunk_size, total_keywords), threshold)
+                       for start in range(0, total_keywords, chunk_size)]
+            results = [future.result() for future in futures]
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    if not results:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    return tuple(np.concatenate([result[k] for result in results]) for k in range(3))
+
+
+def create_group_above_threshold(node_1: Node, node_2: Node, group_number: int, threshold: int,
+                                 links_in_common: int):
     """
     Creates a group object above the threshold
     :param node_1: first node
     :param node_2: second node
     :param group_number: group number
     :param threshold: similarity threshold
+    :param links_in_common: number of links of node_1 which are in node_2 as well
     :return: group if grouping is possible between node_1 & node_2 else None
     """
-    list_intersect = intersect_links(node_1.links, node_2.links)
-    intersect_len = len(list_intersect)
-    if intersect_len >= threshold and (
-            node_2.group is None or intersect_len > node_2.group.links_in_common):
+    if links_in_common >= threshold and (
+            node_2.group is None or links_in_common > node_2.group.links_in_common):
+        node_2_url_ids = set(node_2.url_ids.tolist())
         var_group = Group()
         var_group.main_keyword = node_1.keyword
         var_group.number = group_number
-        var_group.common_links = list_intersect
-        var_group.links_in_common = intersect_len
+        var_group.common_links = [link.url for link, url_id in zip(node_1.links, node_1.url_ids.tolist())
+                                  if url_id in node_2_url_ids]
+        var_group.links_in_common = links_in_common
         return var_group
     return None
 
 
-def calc_average_difficulty(filtered_list: List[Node]):
-    """
-    Calculates the average difficulty of the filtered list
-    :param filtered_list: filtered list having the same group
-    """
-    total = 0
-    count = len(filtered_list)
-    for key_link in filtered_list:
-        total = total + key_link.difficulty
-    for key_link in filtered_list:
-        key_link.group.average_kw_difficulty = total / count
-
-
-def calc_average_rank(filtered_list: List[Node]):
-    """
-    Calculates the average rank of the filtered list
-    :param filtered_list: filtered list having the same group
-    """
-    total = 0
-    count = len(filtered_list)
-    for key_link in filtered_list:
-        total = total + key_link.rank.client_ranking_position
-    for key_link in filtered_list:
-        key_link.group.average_rank = total / count
-
-
-def calc_sum_values(filtered_list: List[Node]):
-    """
-    Calculates the sum of the values of the filtered list
-    :param filtered_list: filtered list having the same group
-    """
-    total = 0
-    for key_link in filtered_list:
-        total = total + key_link.current_value
-    for key_link in filtered_list:
-        key_link.group.sum_of_current_values = total
-
-
-def calc_sum_value_opportunity(filtered_list: List[Node]):
+def group_sum(values, group_starts, group_index):
     """
-    Calculates the sum of the value opportunities of the filtered list
-    :param filtered_list: filtered list having the same group
+    Sums the values of every group, integer values are summed exactly and float values in the order of the nodes
+    :param values: column of values of the nodes sorted by group number
+    :param group_starts: index of the first node of every group
+    :param group_index: position of the group of every node
+    :return: array with the sum of every group
     """
-    total = 0
-    for key_link in filtered_list:
-        total = total + key_link.value_opportunity
-    for key_link in filtered_list:
-        key_link.group.sum_value_opportunity = total
+    if values.dtype.kind in "iu":
+        return np.add.reduceat(values, group_starts)
+    return np.bincount(group_index, weights=values, minlength=len(group_starts))
 
 
-def calc_sum_volume_opportunity(filtered_list: List[Node]):
+def group_quantile(values, group_starts, group_counts, group_index, quantile: float):
     """
-    Calculates the sum of the volume opportunities of the filtered list
-    :param filtered_list: filtered list having the same group
+    Calculates the linearly interpolated quantile of the values of every group the same way as np.quantile
+    :param values: column of values of the nodes sorted by group number
+    :param group_starts: index of the first node of every group
+    :param group_counts: number of nodes in every group
+    :param group_index: position of the group of every node
+    :param quantile: quantile to calculate
+    :return: array with the quantile of every group
     """
-    total = 0
-    for key_link in filtered_list:
-        total = total + key_link.volume_opportunity
-    for key_link in filtered_list:
-        key_link.group.sum_volume_opportunity = total
+    sorted_values = values[np.lexsort((values, group_index))]
+    virtual_index = quantile * (group_counts - 1)
+    previous_index = np.floor(virtual_index)
+    gamma = virtual_index - previous_index
+    previous_index = previous_index.astype(np.int64)
+    next_index = np.minimum(previous_index + 1, group_counts - 1)
+    below = sorted_values[group_starts + previous_index]
+    above = sorted_values[group_starts + next_index]
+    diff = above - below
+    return np.where(gamma >= 0.5, above - diff * (1 - gamma), below + diff * gamma)
 
 
-def calc_rank_percentage(filtered_list: List[Node]):
+def calc_group_metrics(key_link_dict: List[Node]) -> List[int]:
     """
-    Calculates the rank percentage of the filtered list
-    :param filtered_list: filtered list having the same group
+    Calculates the metrics of all the groups in a single pass over the nodes
+    :param key_link_dict: list of nodes sorted by group number
+    :return: index of the first node of every group followed by the total number of nodes
     """
-    total = 0
-    count = len(filtered_list)
-    for key_link in filtered_list:
-        total = total + key_link.fibonacci_helper
-    for key_link in filtered_list:
-        key_link.group.rank_percentage = (total / (count * 13)) * 100
+    total_keywords = len(key_link_dict)
+    if total_keywords == 0:
+        return [0]
+    group_numbers = np.array([x.group.number for x in key_link_dict])
+    group_starts = np.flatnonzero(np.r_[True, group_numbers[1:] != group_numbers[:-1]])
+    group_counts = np.diff(np.r_[group_starts, total_keywords])
+    group_index = np.repeat(np.arange(len(group_starts)), group_counts)
+
+    search_volume = np.array([x.search_volume for x in key_link_dict])
+    ranking_position = np.array([x.rank.client_ranking_position for x in key_link_dict])
+    url_ranking_count = np.array([x.rank.client_url_ranking_count for x in key_link_dict])
+    difficulty = np.array([x.difficulty for x in key_link_dict])
+    current_value = np.array([x.current_value for x in key_link_dict])
+    value_opportunity = np.array([x.value_opportunity for x in key_link_dict])
+    volume_opportunity = np.array([x.volume_opportunity for x in key_link_dict])
+    fibonacci_helper = np.array([x.fibonacci_helper for x in key_link_dict])
+    competitor_score = np.array([x.competitor_score for x in key_link_dict], dtype=np.float64)
+
+    average_difficulty = group_sum(difficulty, group_starts, group_index) / group_counts
+    average_rank = group_sum(ranking_position, group_starts, group_index) / group_counts
+    sum_of_current_values = group_sum(current_value, group_starts, group_index)
+    sum_value_opportunity = group_sum(value_opportunity, group_starts, group_index)
+    sum_volume_opportunity = group_sum(volume_opportunity, group_starts, group_index)
+    rank_percentage = (group_sum(fibonacci_helper, group_starts, group_index) / (group_counts * 13)) * 100
+    topic_volume = group_sum(search_volume, group_starts, group_index)
+    relevancy = group_sum(competitor_score, group_starts, group_index) / group_counts
+
+    has_topic_volume = topic_volume[group_index] > 0
+    volume_percent = np.array([x.volume_percent for x in key_link_dict], dtype=np.float64)
+    volume_percent[has_topic_volume] = search_volume[has_topic_volume] / topic_volume[group_index][has_topic_volume]
+    quartile_volume = group_quantile(volume_percent, group_starts, group_counts, group_index, 0.75)
+
+    above_quartile = volume_percent >= quartile_volume[group_index]
+    average_rank_quartile = (np.bincount(group_index[above_quartile], weights=ranking_position[above_quartile],
+                                         minlength=len(group_starts)) /
+                             np.bincount(group_index[above_quartile], minlength=len(group_starts)))
+    priority_score = rank_percentage * sum_value_opportunity
+    priority_score = priority_score / average_rank_quartile
+
+    total_content_gap = np.bincount(group_index[url_ranking_count > 0], minlength=len(group_starts)) == 0
+    keyword_gap = np.bincount(group_index[(url_ranking_count == 0) & (search_volume >= quartile_volume[group_index])],
+                              minlength=len(group_starts)) > 0
+    # a group may cannibalise when the same client url ranks in the top 20 for more than one of its keywords
+    top_ranking = np.flatnonzero(ranking_position <= 20)
+    potential_cannibalization = np.zeros(len(group_starts), dtype=bool)
+    if len(top_ranking) > 0:
+        _, url_ids = np.unique(np.array([key_link_dict[k].rank.client_ranking_url for k in top_ranking.tolist()],
+                                        dtype=object), return_inverse=True)
+        group_urls = np.unique(group_index[top_ranking] * (int(url_ids.max()) + 1) + url_ids.ravel(),
+                               return_counts=True)
+        repeated_urls = group_urls[0][group_urls[1] > 1]
+        potential_cannibalization[repeated_urls // (int(url_ids.max()) + 1)] = True
+
+    for key_link, percent, update in zip(key_link_dict, volume_percent, has_topic_volume.tolist()):
+        if update:
+            key_link.volume_percent = percent
+    group_stops = np.r_[group_starts[1:], total_keywords]
+    for g, (start, stop) in enumerate(zip(group_starts.tolist(), group_stops.tolist())):
+        vars_count = stop - start
+        for key_link in key_link_dict[start:stop]:
+            group = key_link.group
+            group.average_kw_difficulty = average_difficulty[g]
+            group.average_rank = average_rank[g]
+            group.sum_of_current_values = sum_of_current_values[g]
+            group.rank_percentage = rank_percentage[g]
+            group.topic_volume = topic_volume[g]
+            group.quartile_volume = quartile_volume[g]
+            group.average_rank_quartile = average_rank_quartile[g]
+            group.sum_value_opportunity = sum_value_opportunity[g]
+            group.sum_volume_opportunity = sum_volume_opportunity[g]
+            key_link.priority_score = priority_score[g]
+            group.variant_count = vars_count
+            group.relevancy = relevancy[g]
+            if not total_content_gap[g]:
+                group.total_content_gap = False
+            if keyword_gap[g]:
+                group.keyword_gap = True
+            if potential_cannibalization[g]:
+                group.potential_cannibalization = True
+    return group_starts.tolist() + [total_keywords]
 
 
 def get_total_related_results_count(key_link: Node):
@@ -195,190 +377,45 @@ def get_total_related_results_count(key_link: Node):
     return total_related_results_count
 
 
-def calc_topic_volume(filtered_list: List[Node]):
+def build_ranking_url_index(key_link_dict: List[Node], group_starts: List[int]):
     """
-    Calculates the topic volume of the filtered list
-    :param filtered_list: filtered list having the same group
-    """
-    total = 0
-    for key_link in filtered_list:
-        total = total + key_link.search_volume
-    for key_link in filtered_list:
-        key_link.group.topic_volume = total
-
-
-def calc_volume_percentage(filtered_list: List[Node]):
-    """
-    Calculates the volume percentage of the filtered list
-    :param filtered_list: filtered list having the same group
-    """
-    for key_link in filtered_list:
-        if key_link.group.topic_volume > 0:
-            key_link.volume_percent = key_link.search_volume / key_link.group.topic_volume
-
-
-def calc_quartile(filtered_list: List[Node]):
-    """
-    Calculates the quartile volume of the filtered list
-    :param filtered_list: filtered list having the same group
+    Indexes the groups in which every client url ranks in the top 10 and finds the most frequent client url of
+    every group in the same pass
+    :param key_link_dict: list of nodes sorted by group number
+    :param group_starts: index of the first node of every group followed by the total number of nodes
+    :return: dictionary of client urls to the set of group numbers they rank in the top 10 for,
+    list with the most frequent url of every group
     """
-    percent_vol_arr = [x.volume_percent for x in filtered_list]
-    qt = np.quantile(percent_vol_arr, 0.75)
-    for key_link in filtered_list:
-        key_link.group.quartile_volume = qt
-
-
-def calc_avg_rank_quartile(filtered_list: List[Node]):
-    """
-    Calculates the average rank quartile of the filtered list
-    :param filtered_list: filtered list having the same group
-    """
-    above_quartile_list = [x for x in filtered_list if x.volume_percent >= x.group.quartile_volume]
-    total = 0
-    count = len(above_quartile_list)
-    for key_link in above_quartile_list:
-        total = total + key_link.rank.client_ranking_position
-    average_rank_quartile = total / count
-    for key_link in filtered_list:
-        key_link.group.average_rank_quartile = average_rank_quartile
-
-
-def calc_priority_score(filtered_list: List[Node]):
-    """
-    Calculates the priority score of the filtered list
-    :param filtered_list: filtered list having the same group
-    """
-    for key_link in filtered_list:
-        ps = key_link.group.rank_percentage * key_link.group.sum_value_opportunity
-        ps = ps / key_link.group.average_rank_quartile
-        key_link.priority_score = ps
-
-
-def calc_variant_count(filtered_list: List[Node], vars_count: int):
-    """
-    Calculates the variant count of the filtered list
-    :param filtered_list: filtered list having the same group
-    :param vars_count: number of variants in the group
-    """
-    for key_link in filtered_list:
-        key_link.group.variant_count = vars_count
-
-
-def calc_average_relevancy(filtered_list: List[Node], vars_count: int):
-    """
-    Calculates the average relevancy of the filtered list
-    :param filtered_list: filtered list having the same group
-    :param vars_count: number of variants in the group
-    """
-    total = 0.0
-    for key_link in filtered_list:
-        total = total + key_link.competitor_score
-    average_relevancy = total / vars_count
-    for key_link in filtered_list:
-        key_link.group.relevancy = average_relevancy
-
-
-def calc_most_frequent_url(filtered_list: List[Node]) -> str:
-    """
-    Calculates the most frequent url of the filtered list
-    :param filtered_list: filtered list having the same group
-    :return: most frequent url
-    """
-    url_count_dict = dict()
-    for key_link in filtered_list:
-        if key_link.rank.client_ranking_url != "":
-            if key_link.rank.client_ranking_url in url_count_dict:
-                url_count_dict[key_link.rank.client_ranking_url] = url_count_dict[key_link.rank.client_ranking_url] + 1
-            else:
-                url_count_dict[key_link.rank.client_ranking_url] = 1
-    most_frequent_url = ""
-    most_frequent_url_count = 0
-    for url in url_count_dict:
-        if url_count_dict[url] > most_frequent_url_count:
-            most_frequent_url = url
-            most_frequent_url_count = url_count_dict[url]
-    return most_frequent_url
+    ranking_url_groups = dict()
+    most_frequent_urls = []
+    for start, stop in zip(group_starts[:-1], group_starts[1:]):
+        url_count_dict = dict()
+        for key_link in key_link_dict[start:stop]:
+            client_url = key_link.rank.client_ranking_url
+            if key_link.rank.client_ranking_position <= 10:
+                ranking_url_groups.setdefault(client_url, set()).add(key_link.group.number)
+            if client_url != "":
+                url_count_dict[client_url] = url_count_dict.get(client_url, 0) + 1
+        # ties go to the url seen first in the group
+        most_frequent_urls.append(max(url_count_dict, key=url_count_dict.get) if url_count_dict else "")
+    return ranking_url_groups, most_frequent_urls
 
 
 def identify_potential_content_gap(filtered_list: List[Node],
-                                   key_link_dict: List[Node],
+                                   ranking_url_groups: dict,
                                    group_number: int,
                                    most_freq_url):
     """
     Identifies the potential content gap of the filtered list
     :param filtered_list: filtered list having the same group
-    :param key_link_dict: list of all nodes
+    :param ranking_url_groups: dictionary of client urls to the set of group numbers they rank in the top 10 for
     :param group_number: group number
     :param most_freq_url: the most frequent url in the group
     """
-    potential_gap_flag = False
-    total_keywords = len(key_link_dict)
-    i = 0
-    while not potential_gap_flag and i < total_keywords:
-        if key_link_dict[i].group.number != group_number and \
-                key_link_dict[i].rank.client_ranking_position <= 10 and \
-                key_link_dict[i].rank.client_ranking_url == most_freq_url:
-            potential_gap_flag = True
-        i = i + 1
-    if potential_gap_flag:
-        for key_link in filtered_list:
-            key_link.group.potential_content_gap = potential_gap_flag
-
-
-def identify_total_content_gap(filtered_list: List[Node]):
-    """
-    Identifies the total content gap of the filtered list
-    :param filtered_list: filtered list having the same group
-    """
-    total_gap_flag = True
-    i = 0
-    total_keywords = len(filtered_list)
-    while total_gap_flag and i < total_keywords:
-        if filtered_list[i].rank.client_url_ranking_count > 0:
-            total_gap_flag = False
-        i += 1
-    if not total_gap_flag:
+    ranking_groups = ranking_url_groups.get(most_freq_url, set())
+    if len(ranking_groups) > 1 or (len(ranking_groups) == 1 and group_number not in ranking_groups):
         for key_link in filtered_list:
-            key_link.group.total_content_gap = total_gap_flag
-
-
-def identify_keyword_gap(filtered_list: List[Node]):
-    """
-    Identifies the keyword gap of the filtered list
-    :param filtered_list: filtered list having the same group
-    """
-    keyword_gap_flag = False
-    i = 0
-    list_len = len(filtered_list)
-    while not keyword_gap_flag and i < list_len:
-        if filtered_list[i].rank.client_url_ranking_count == 0 and \
-                filtered_list[i].search_volume >= filtered_list[i].group.quartile_volume:
-            keyword_gap_flag = True
-        i += 1
-    if keyword_gap_flag:
-        for key_link in filtered_list:
-            key_link.group.keyword_gap = keyword_gap_flag
-
-
-def identify_potential_cannibalisation(filtered_list: List[Node]):
-    """
-    Identifies the potential cannibalisation of the filtered list
-    :param filtered_list: filtered list having the same group
-    """
-    cannibalization_flag = False
-    i = 0
-    url_list = set()
-    list_len = len(filtered_list)
-    while not cannibalization_flag and i < list_len:
-        if filtered_list[i].rank.client_ranking_position <= 20:
-            if filtered_list[i].rank.client_ranking_url in url_list:
-                cannibalization_flag = True
-            else:
-                url_list.add(filtered_list[i].rank.client_ranking_url)
-        i += 1
-    if cannibalization_flag:
-        for key_link in filtered_list:
-            key_link.group.potential_cannibalization = cannibalization_flag
+            key_link.group.potential_content_gap = True
 
 
 def update_main_keyword(filtered_list: List[Node]):
@@ -432,6 +469,80 @@ def calc_auto_mapped_url(filtered_list: List[Node], auto_map_dict: dict):
             key_link.group.auto_mapped_url = auto_map_dict[key_link.group.number]
 
 
+def process_fuzzy_string(string: str) -> str:
+    """
+    Processes a string the same way fuzz.token_sort_ratio does before comparing it
+    :param string: string to process
+    :return: lower case string of the letters and numbers with its tokens sorted
+    """
+    return " ".join(sorted(fuzz_utils.full_process(string, force_ascii=True).split())).strip()
+
+
+def count_chars(strings: List[str]):
+    """
+    Counts the characters of every string
+    :param strings: list of strings
+    :return: sorted array of the characters, array with the count of every character in every string
+    """
+    codes = np.frombuffer("".join(strings).encode("utf-32-le"), dtype=np.uint32)
+    alphabet, char_ids = np.unique(codes, return_inverse=True)
+    string_ids = np.repeat(np.arange(len(strings)), [len(x) for x in strings])
+    char_counts = np.bincount(char_ids.ravel() * len(strings) + string_ids, minlength=len(alphabet) * len(strings))
+    return alphabet, char_counts.reshape(len(alphabet), len(strings)).astype(np.int32)
+
+
+def match_fuzzy_slug(slug: str, processed_keywords: List[str], keyword_indexes, keyword_lengths,
+                     alphabet, char_counts):
+    """
+    Finds the first keyword with the highest token sort ratio above the fuzzy match threshold for the slug
+    :param slug: slug to match
+    :param processed_keywords: processed keywords sorted by length
+    :param keyword_indexes: index of the first node of every processed keyword
+    :param keyword_lengths: length of every processed keyword
+    :param alphabet: sorted array of the characters of the processed keywords
+    :param char_counts: count of every character in every processed keyword
+    :return: index of the matching node, None if no keyword matches
+    """
+    processed_slug = process_fuzzy_string(slug)
+    slug_length = len(processed_slug)
+    # the ratio is at most 200 * shortest length / total length, which limits the keyword lengths to compare
+    start = 0
+    stop = len(processed_keywords)
+    if 0 < fuzzy_match_threshold < 100:
+        start = np.searchsorted(keyword_lengths, slug_length * fuzzy_match_threshold / (200 - fuzzy_match_threshold),
+                                side="left")
+        stop = np.searchsorted(keyword_lengths, slug_length * (200 - fuzzy_match_threshold) / fuzzy_match_threshold,
+                               side="right")
+    if start >= stop:
+        return None
+    # the characters both strings have in common bound their longest common subsequence and thus the ratio
+    chars_in_common = np.zeros(stop - start, dtype=np.int32)
+    slug_chars, slug_char_counts = np.unique(np.frombuffer(processed_slug.encode("utf-32-le"), dtype=np.uint32),
+                                             return_counts=True)
+    for char, count in zip(slug_chars.tolist(), slug_char_counts.tolist()):
+        char_id = np.searchsorted(alphabet, char)
+        if char_id < len(alphabet) and alphabet[char_id] == char:
+            chars_in_common += np.minimum(char_counts[char_id, start:stop], count)
+    total_lengths = keyword_lengths[start:stop] + slug_length
+    max_ratios = np.where(total_lengths > 0, np.ceil(200 * chars_in_common / np.maximum(total_lengths, 1)), 100)
+    candidates = np.flatnonzero(max_ratios > fuzzy_match_threshold)
+    candidates = candidates[np.lexsort((keyword_indexes[start + candidates], -max_ratios[candidates]))]
+    max_score = fuzzy_match_threshold
+    max_score_index = None
+    for candidate in candidates.tolist():
+        max_ratio = max_ratios[candidate]
+        keyword_index = keyword_indexes[start + candidate]
+        if max_ratio < max_score or (max_ratio == max_score and (max_score_index is None or
+                                                                 keyword_index > max_score_index)):
+            break
+        score = fuzz.ratio(processed_slug, processed_keywords[start + candidate])
+        if score > max_score or (score == max_score and max_score_index is not None and
+                                 keyword_index < max_score_index):
+            max_score = score
+            max_score_index = keyword_index
+    return max_score_index
+
+
 def calc_auto_mapped_url_fuzzy(key_link_dict: List[Node], slug_url_dict: dict) -> dict:
     """
     This function calculates the auto mapped url for all keywords
@@ -440,25 +551,35 @@ def calc_auto_mapped_url_fuzzy(key_link_dict: List[Node], slug_url_dict: dict) -
     :return auto_mapped_url_dict: dictionary containing the auto mapped url
     """
     auto_map_dict = dict()
+    if len(key_link_dict) == 0 or len(slug_url_dict) == 0:
+        return auto_map_dict
+    # keywords equal to a slug always match, otherwise the first keyword with the highest score does
+    exact_match_dict = dict()
+    processed_match_dict = dict()
+    for i, key_link in enumerate(key_link_dict):
+        exact_match_dict.setdefault(key_link.keyword, i)
+        processed_match_dict.setdefault(process_fuzzy_string(key_link.keyword), i)
+    processed_keywords = list(processed_match_dict)
+    keyword_lengths = np.array([len(x) for x in processed_keywords])
+    order = np.argsort(keyword_lengths, kind="stable")
+    processed_keywords = [processed_keywords[k] for k in order.tolist()]
+    keyword_indexes = np.array(list(processed_match_dict.values()))[order]
+    keyword_lengths = keyword_lengths[order]
+    alphabet, char_counts = count_chars(processed_keywords)
     for slug, url in slug_url_dict.items():
-        max_score = fuzzy_match_threshold
-        max_score_group = 0
-        for key_link in key_link_dict:
-            if key_link.keyword == slug and max_score < 101:
-                max_score_group = key_link.group.number
-                max_score = 101
-            else:
-                score = fuzz.token_sort_ratio(key_link.keyword, slug)
-                if score > max_score:
-                    max_score = score
-                    max_score_group = key_link.group.number
-        if max_score_group != 0:
-            auto_map_dict[max_score_group] = url
+        if slug in exact_match_dict:
+            max_score_index = exact_match_dict[slug]
+        else:
+            max_score_index = match_fuzzy_slug(slug=slug, processed_keywords=processed_keywords,
+                                               keyword_indexes=keyword_indexes, keyword_lengths=keyword_lengths,
+                                               alphabet=alphabet, char_counts=char_counts)
+        if max_score_index is not None:
+            auto_map_dict[key_link_dict[max_score_index].group.number] = url
     return auto_map_dict
 
 
 def group_nodes(key_link_dict: List[Node], job_id: str, threshold: int = default_grouping_threshold,
-                job_type: str = "grouper", progress=10, calc_sub_group=False) -> List[Node]:
+                job_type: str = "grouper", progress=10, calc_sub_group=False, processes: int = 1) -> List[Node]:
     """
     Groups the nodes based on the url similarities considering the threshold
     :param key_link_dict: list of nodes to group
@@ -467,6 +588,7 @@ def group_nodes(key_link_dict: List[Node], job_id: str, threshold: int = default
     :param job_type: job type
     :param progress: progress of job till now
     :param calc_sub_group: flag if sub group is to be calculated
+    :param processes: number of processes to count the links in common with, 1 counts them in this process
     :return: list of nodes with groups calculated
     """
     total_keywords = len(key_link_dict)
@@ -479,6 +601,18 @@ def group_nodes(key_link_dict: List[Node], job_id: str, threshold: int = default
         increment = increment // 2
     if job_type == "combined":
         increment = increment // 2
+    keyword_index = build_keyword_index(key_link_dict=key_link_dict)
+    url_index = build_url_index(keyword_index=keyword_index)
+    batch_start = batch_end = 0
+    batch_rows = batch_nodes = batch_links_in_common = batch_row_starts = None
+    if processes > 1 and total_keywords > grouping_batch_size:
+        try:
+            batch_rows, batch_nodes, batch_links_in_common = count_links_in_common_parallel(
+                keyword_index=keyword_index, url_index=url_index, threshold=threshold, processes=processes)
+            batch_end = total_keywords
+            batch_row_starts = np.searchsorted(batch_rows, np.arange(total_keywords + 1))
+        except (AssertionError, OSError, BrokenProcessPool) as e:
+            job_logger.error(f"Could not count links in common in parallel, counting serially: {e}")
     for i in range(0, total_keywords):
         if key_link_dict[i].rank.client_ranking_url != "":
             client_url = key_link_dict[i].rank.client_ranking_url
@@ -493,9 +627,25 @@ def group_nodes(key_link_dict: List[Node], job_id: str, threshold: int = default
             group.main_keyword = key_link_dict[i].keyword
             group.links_in_common = len(group.common_links)
             key_link_dict[i].group = group
-            for j in range(0, total_keywords):
+            if i >= batch_end:
+                # links in common are counted for a batch of the upcoming keywords at once
+                batch_start = i
+                batch_end = min(i + grouping_batch_size, total_keywords)
+                batch_rows, batch_nodes, batch_links_in_common = count_links_in_common(
+                    start=batch_start, stop=batch_end, keyword_index=keyword_index, url_index=url_index)
+                batch_row_starts = np.searchsorted(batch_rows, np.arange(batch_start, batch_end + 1))
+            row_start = batch_row_starts[i - batch_start]
+            row_end = batch_row_starts[i - batch_start + 1]
+            nodes = batch_nodes[row_start:row_end]
+            links_in_common = batch_links_in_common[row_start:row_end]
+            candidates = range(0, total_keywords)
+            if threshold > 0:
+                # only nodes sharing enough urls with the main keyword can join its group
+                candidates = nodes[links_in_common >= threshold].tolist()
+            links_in_common = dict(zip(nodes.tolist(), links_in_common.tolist()))
+            for j in candidates:
                 group_common = create_group_above_threshold(key_link_dict[i], key_link_dict[j],
-                                                            group_number, threshold)
+                                                            group_number, threshold, links_in_common.get(j, 0))
                 if group_common is not None:
                     key_link_dict[j].group = group_common
             group_number = group_number + 1
@@ -508,32 +658,17 @@ def group_nodes(key_link_dict: List[Node], job_id: str, threshold: int = default
     log = f"Created {group_number - 1} groups..."
     signal_logger.info({"jobId": job_id, "type": job_type, "log": f"[{get_time_stamp()}] {log}"})
     auto_map_dict = calc_auto_mapped_url_fuzzy(key_link_dict=key_link_dict, slug_url_dict=slug_url_dict)
-    for group_num in range(1, group_number):
-        filtered_list = [x for x in key_link_dict if x.group.number == group_num]
-        vars_count = len(filtered_list)
-        if vars_count > 0:
-            calc_average_difficulty(filtered_list=filtered_list)
-            calc_average_rank(filtered_list=filtered_list)
-            calc_sum_values(filtered_list=filtered_list)
-            calc_rank_percentage(filtered_list=filtered_list)
-            calc_topic_volume(filtered_list=filtered_list)
-            calc_volume_percentage(filtered_list=filtered_list)
-            calc_quartile(filtered_list=filtered_list)
-            calc_avg_rank_quartile(filtered_list=filtered_list)
-            calc_sum_value_opportunity(filtered_list=filtered_list)
-            calc_sum_volume_opportunity(filtered_list=filtered_list)
-            calc_priority_score(filtered_list=filtered_list)
-            calc_variant_count(filtered_list=filtered_list, vars_count=vars_count)
-            calc_average_relevancy(filtered_list=filtered_list, vars_count=vars_count)
-            if filtered_list[0].group.average_rank_quartile >= 10:
-                identify_potential_content_gap(filtered_list=filtered_list,
-                                               key_link_dict=key_link_dict,
-                                               group_number=filtered_list[0].group.number,
-                                               most_freq_url=calc_most_frequent_url(filtered_list=filtered_list))
-            identify_total_content_gap(filtered_list=filtered_list)
-            identify_keyword_gap(filtered_list=filtered_list)
-            identify_potential_cannibalisation(filtered_list=filtered_list)
-            calc_auto_mapped_url(filtered_list=filtered_list, auto_map_dict=auto_map_dict)
+    group_starts = calc_group_metrics(key_link_dict=key_link_dict)
+    ranking_url_groups, most_frequent_urls = build_ranking_url_index(key_link_dict=key_link_dict,
+                                                                     group_starts=group_starts)
+    for start, stop, most_freq_url in zip(group_starts[:-1], group_starts[1:], most_frequent_urls):
+        filtered_list = key_link_dict[start:stop]
+        if filtered_list[0].group.average_rank_quartile >= 10:
+            identify_potential_content_gap(filtered_list=filtered_list,
+                                           ranking_url_groups=ranking_url_groups,
+                                           group_number=filtered_list[0].group.number,
+                                           most_freq_url=most_freq_url)
+        calc_auto_mapped_url(filtered_list=filtered_list, auto_map_dict=auto_map_dict)
     key_link_dict.sort(key=lambda x: (x.group.topic_volume, x.search_volume), reverse=True)
     return key_link_dict
 
@@ -546,11 +681,11 @@ def create_sub_group_above_threshold(node_1: Node, node_2: Node, sub_group_numbe
     :param node_2: second node
     :param sub_group_number: sub group number
     :param threshold: threshold for the links in common
-    :param main_links_above_pth: main links above threshold
-    :param variant_links_above_pth: variant links above threshold
+    :param main_links_above_pth: urls of the main links above threshold
+    :param variant_links_above_pth: set of urls of the variant links above threshold
     :return: sub group
     """
-    list_intersect = intersect_links(main_links_above_pth, variant_links_above_pth)
+    list_intersect = [url for url in main_links_above_pth if url in variant_links_above_pth]
     intersect_len = len(list_intersect)
     if intersect_len >= threshold and (
             node_2.sub_group is None or intersect_len > node_2.sub_group.links_in_common):
@@ -579,26 +714,27 @@ def sub_group_nodes(key_link_dict: List[Node],
     """
     total_keywords = len(key_link_dict)
     sub_group_number = 1
-    connect_to_socket(node_server_url)
+    links_above_pth = [[x.url for x in key_link.links if x.position <= organic_results_count]
+                       for key_link in key_link_dict]
+    link_sets_above_pth = [set(urls) for urls in links_above_pth]
     for i in range(0, total_keywords):
         if key_link_dict[i].sub_group is None:
-            main_links_above_pth = [x for x in key_link_dict[i].links if x.position <= organic_results_count]
+            main_links_above_pth = links_above_pth[i]
             sub_group = Group()
             sub_group.number = sub_group_number
-            sub_group.common_links = [x.url for x in main_links_above_pth]
+            sub_group.common_links = main_links_above_pth[0:]
             sub_group.main_keyword = key_link_dict[i].keyword
             sub_group.links_in_common = len(sub_group.common_links)
             sub_group.highest_volume = key_link_dict[i].search_volume
             sub_group.highest_volume_keyword = key_link_dict[i].keyword
             key_link_dict[i].sub_group = sub_group
             for j in range(0, total_keywords):
-                variant_links_above_pth = [x for x in key_link_dict[j].links if x.position <= organic_results_count]
                 common_sub_group = create_sub_group_above_threshold(node_1=key_link_dict[i],
                                                                     node_2=key_link_dict[j],
                                                                     sub_group_number=sub_group_number,
                                                                     threshold=threshold,
                                                                     main_links_above_pth=main_links_above_pth,
-                                                                    variant_links_above_pth=variant_links_above_pth)
+                                                                    variant_links_above_pth=link_sets_above_pth[j])
                 if common_sub_group is not None:
                     if key_link_dict[j].search_volume > sub_group.highest_volume:
                         sub_group.highest_volume = key_link_dict[j].search_volume
@@ -610,11 +746,89 @@ def sub_group_nodes(key_link_dict: List[Node],
     return key_link_dict
 
 
+def _sub_group_batch(batch: List[List[Node]], job_id: str, threshold: int, job_type: str,
+                     organic_results_count: int) -> List[List[Group]]:
+    """
+    Sub-groups a batch of groups independently of each other
+    :param batch: list of groups, each a list of nodes having the same group
+    :param job_id: id of the job
+    :param threshold: similarity threshold for intersecting links
+    :param job_type: job type
+    :param organic_results_count: max position of result to consider
+    :return: sub groups of the nodes of every group in the batch
+    """
+    sub_groups = []
+    for filtered_list in batch:
+        sub_group_nodes(key_link_dict=filtered_list, threshold=threshold, job_id=job_id,
+                        job_type=job_type, organic_results_count=organic_results_count)
+        calc_sub_group_volume(filtered_list=filtered_list)
+        sub_groups.append([key_link.sub_group for key_link in filtered_list])
+    return sub_groups
+
+
+def _sub_grouping_node(key_link: Node) -> Node:
+    """
+    Copies the fields of a node needed for sub-grouping, to be sent to a sub-grouping worker process
+    :param key_link: node to copy
+    :return: copy of the node
+    """
+    sub_grouping_node = Node()
+    sub_grouping_node.keyword = key_link.keyword
+    sub_grouping_node.search_volume = key_link.search_volume
+    sub_grouping_node.links = key_link.links
+    return sub_grouping_node
+
+
+def sub_group_groups(groups: List[List[Node]], job_id: str, threshold: int, job_type: str,
+                     organic_results_count: int, processes: int = 1):
+    """
+    Sub-groups every group, across a pool of processes if more than one process is given
+    :param groups: list of groups, each a list of nodes having the same group
+    :param job_id: id of the job
+    :param threshold: similarity threshold for intersecting links
+    :param job_type: job type
+    :param organic_results_count: max position of result to consider
+    :param processes: number of worker processes, 1 sub-groups in this process
+    :return: generator of the sub groups of the nodes of every group, in the order of the groups
+    """
+    if processes > 1 and len(groups) > 1:
+        batches = [[]]
+        batch_keywords = 0
+        for filtered_list in groups:
+            if batch_keywords >= sub_grouping_batch_size:
+                batches.append([])
+                batch_keywords = 0
+            batches[-1].append([_sub_grouping_node(key_link) for key_link in filtered_list])
+            batch_keywords = batch_keywords + len(filtered_list)
+        done_batches = 0
+        executor = None
+        try:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+            futures = [executor.submit(_sub_group_batch, batch, job_id, threshold, job_type, organic_results_count)
+                       for batch in batches]
+            for future in futures:
+                sub_groups = future.result()
+                done_batches = done_batches + 1
+                yield from sub_groups
+        except (AssertionError, OSError, BrokenProcessPool) as e:
+            job_logger.error(f"Could not create sub-groups in parallel, creating them serially: {e}")
+        else:
+            return
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+        groups = [filtered_list for batch in batches[done_batches:] for filtered_list in batch]
+    for filtered_list in groups:
+        yield from _sub_group_batch(batch=[filtered_list], job_id=job_id, threshold=threshold, job_type=job_type,
+                                    organic_results_count=organic_results_count)
+
+
 def calc_sub_groups(key_link_dict: List[Node],
                     job_id: str,
                     threshold: int = 6,
                     job_type: str = "grouper",
-                    organic_results_count: int = 10) -> List[Node]:
+                    organic_results_count: int = 10,
+                    processes: int = 1) -> List[Node]:
     """
     Calculates the sub groups for the nodes
     :param key_link_dict: list of nodes to group
@@ -622,6 +836,7 @@ def calc_sub_groups(key_link_dict: List[Node],
     :param job_id: id of the job
     :param job_type: job type
     :param organic_results_count: max position of result to consider
+    :param processes: number of processes to create the sub groups with, 1 creates them in this process
     :return: list of nodes with groups calculated
     """
     connect_to_socket(node_server_url)
@@ -641,14 +856,16 @@ def calc_sub_groups(key_link_dict: List[Node],
     if job_type == "combined":
         increment = increment // 2
     i = 0
-    for group in groups:
+    sub_grouping_results = sub_group_groups(groups=list(groups.values()), job_id=job_id, threshold=threshold,
+                                            job_type=job_type, organic_results_count=organic_results_count,
+                                            processes=processes)
+    for sub_groups, group in zip(sub_grouping_results, groups):
         if ((int(group) - 1) % 1000) == 0:
             log = f"Creating sub-groups for group # {int(group)}-{int(group) + 999}"
             signal_logger.info({"jobId": job_id, "type": job_type, "log": f"[{get_time_stamp()}] {log}"})
-        sub_grouping_result = sub_group_nodes(key_link_dict=groups[group], threshold=threshold, job_id=job_id,
-                                              job_type=job_type, organic_results_count=organic_results_count)
-        calc_sub_group_volume(filtered_list=sub_grouping_result)
-        result = result + sub_grouping_result
+        for key_link, sub_group in zip(groups[group], sub_groups):
+            key_link.sub_group = sub_group
+        result.extend(groups[group])
         i = i + 1
         if i == progress_step:
             progress = progress + increment
@@ -666,25 +883,61 @@ def calculate_rank(key_link: Node, competitor_domains: List[str], target_domain:
     :param target_domain: target domain
     :return: rank of target and competitor domains
     """
-    input_domains = competitor_domains[0:]
-    input_domains.insert(0, target_domain)
-    key_ranks = []
-    for domain in input_domains:
-        key_rank = Rank()
-        for result in key_link.links:
-            if f".{domain}" in result.url or f"//{domain}" in result.url:
-                if key_rank.client_url_ranking_count == 0:
-                    key_rank.client_ranking_position = result.position
-                    key_rank.client_ranking_url = result.url
-                key_rank.client_url_ranking_count = key_rank.client_url_ranking_count + 1
-                if 1 <= key_rank.client_ranking_position <= 20:
-                    key_rank.current_traffic = CTR_LOOKUP[
-                                                   key_rank.client_ranking_position - 1] * key_link.search_volume * key_link.cps
-                else:
-                    key_rank.current_traffic = CTR_LOOKUP[19] * key_link.search_volume * key_link.cps
-                key_rank.current_value = key_rank.current_traffic * key_link.cpc
-        key_ranks.append(key_rank)
-    return key_ranks[0:]
+    domain_matcher = get_domain_matcher((target_domain, *competitor_domains))
+    key_ranks = [Rank() for _ in range(len(competitor_domains) + 1)]
+    for result in key_link.links:
+        for i in domain_matcher.match(result.url):
+            key_rank = key_ranks[i]
+            if key_rank.client_url_ranking_count == 0:
+                key_rank.client_ranking_position = result.position
+                key_rank.client_ranking_url = result.url
+            key_rank.client_url_ranking_count = key_rank.client_url_ranking_count + 1
+    for key_rank in key_ranks:
+        if key_rank.client_url_ranking_count > 0:
+            if 1 <= key_rank.client_ranking_position <= 20:
+                key_rank.current_traffic = CTR_LOOKUP[
+                                               key_rank.client_ranking_position - 1] * key_link.search_volume * key_link.cps
+            else:
+                key_rank.current_traffic = CTR_LOOKUP[19] * key_link.search_volume * key_link.cps
+            key_rank.current_value = key_rank.current_traffic * key_link.cpc
+    return key_ranks
+
+
+def check_column_types(values, valid_types, error: str, skip_na: bool = False):
+    """
+    Checks the types of all the values of a column at once and logs a single error for the invalid ones
+    :param values: numpy array of the column values
+    :param valid_types: type or tuple of types the values should have
+    :param error: error to log if any of the values has an invalid type
+    :param skip_na: flag to skip the missing values
+    :return: boolean array, true for the values which are present and of a valid type
+    """
+    if values.dtype == object:
+        valid = np.fromiter((isinstance(x, valid_types) for x in values), dtype=bool, count=len(values))
+    else:
+        valid = np.full(len(values), issubclass(values.dtype.type, valid_types))
+    if skip_na:
+        present = ~pd.isna(values)
+        invalid_count = np.count_nonzero(present & ~valid)
+        valid = present & valid
+    else:
+        invalid_count = np.count_nonzero(~valid)
+    if invalid_count > 0:
+        job_logger.error(f"{error} ({invalid_count} rows)")
+    return valid
+
+
+def column_values(values, use, default):
+    """
+    Gets the values of a column, with the default in place of the values not to use
+    :param values: numpy array of the column values
+    :param use: boolean array, true for the values to use
+    :param default: value to use in place of the others
+    :return: list of the values
+    """
+    if use.all():
+        return list(values)
+    return [value if use_value else default for value, use_value in zip(values, use)]
 
 
 def read_input(input_file_path: str,
@@ -704,148 +957,105 @@ def read_input(input_file_path: str,
     """
     key_link_dict = []
     if job_type == "grouper":
-        df = read_csv_from_google_cloud(input_file_path)
+        df = read_csv_from_google_cloud(input_file_path, dtype=input_column_dtypes)
     else:
-        df = pd.read_csv(filepath_or_buffer=input_file_path, encoding='utf-8-sig')
+        df = pd.read_csv(filepath_or_buffer=input_file_path, encoding='utf-8-sig', dtype=input_column_dtypes)
     df = df[df["Keyword"].notnull() & df["Link"].notnull() & df["Volume"].notnull()]
     df.sort_values(by=["Volume", "Keyword"], inplace=True, ascending=False)
     data_frame_size = len(df)
-    i = 0
     comp_rank_headers = list(
         filter(lambda item: 'Competitor' in item and 'Score' not in item and 'count' not in item, df.columns.to_list()))
-    while i < data_frame_size:
-        if not isinstance(df.iloc[i]["Keyword"], str):
-            job_logger.error("invalid type exist for keyword")
-        if not isinstance(df.iloc[i]["Volume"], np.int64) and not isinstance(df.iloc[i]["Volume"], np.float64):
-            job_logger.error("invalid type exist for volume")
-        keyword = df.iloc[i]["Keyword"]
+    if not isinstance(calc_rank, bool):
+        job_logger.error("invalid type calc_rank")
+
+    # consecutive rows of the same keyword are the links of one node, the node values are read from the first
+    keywords = df["Keyword"].to_numpy()
+    node_rows = np.flatnonzero(np.r_[True, keywords[1:] != keywords[:-1]]) if data_frame_size > 0 else []
+    node_row_ends = np.r_[node_rows[1:], data_frame_size].astype(np.int64).tolist()
+    node_row_starts = np.asarray(node_rows, dtype=np.int64).tolist()
+    node_df = df.iloc[node_rows]
+    node_count = len(node_df)
+    keywords = node_df["Keyword"].to_numpy()
+    volumes = node_df["Volume"].to_numpy()
+    check_column_types(keywords, str, "invalid type exist for keyword")
+    check_column_types(volumes, (np.int64, np.float64), "invalid type exist for volume")
+    for keyword, volume in zip(keywords, volumes):
         key_link = Node()
-        rank = Rank()
         key_link.keyword = keyword
-        key_link.search_volume = df.iloc[i]["Volume"]
-        if CLIENT_RANKING_URL in df.iloc[i] and not pd.isna(df.iloc[i][CLIENT_RANKING_URL]):
-            rank.client_ranking_url = df.iloc[i][CLIENT_RANKING_URL]
-        if CLIENT_RANKING_POSITION in df.iloc[i] and not pd.isna(df.iloc[i][CLIENT_RANKING_POSITION]):
-            rank.client_ranking_position = df.iloc[i][CLIENT_RANKING_POSITION]
-        if CLIENT_URL_RANKING_COUNT in df.iloc[i] and not pd.isna(df.iloc[i][CLIENT_URL_RANKING_COUNT]):
-            rank.client_url_ranking_count = df.iloc[i][CLIENT_URL_RANKING_COUNT]
-        key_link.rank = rank
-
-        if "Difficulty" in df.iloc[i] and not pd.isna(df.iloc[i]["Difficulty"]):
-            if isinstance(df.iloc[i]["Difficulty"], np.float64) or isinstance(
-                    df.iloc[i]["Difficulty"], np.int64):
-                key_link.difficulty = df.iloc[i]["Difficulty"]
-            else:
-                job_logger.error("invalid type difficulty")
-        if "Current Traffic" in df.iloc[i] and not pd.isna(df.iloc[i]["Current Traffic"]):
-            if isinstance(df.iloc[i]["Current Traffic"], np.float64) or isinstance(
-                    df.iloc[i]["Current Traffic"], np.int64):
-                key_link.current_traffic = df.iloc[i]["Current Traffic"]
-            else:
-                job_logger.error("invalid type current traffic")
-        if "Potential Traffic" in df.iloc[i] and not pd.isna(df.iloc[i]["Potential Traffic"]):
-            if isinstance(df.iloc[i]["Potential Traffic"], np.float64) or isinstance(
-                    df.iloc[i]["Potential Traffic"], np.int64):
-                key_link.potential_traffic = df.iloc[i]["Potential Traffic"]
-            else:
-                job_logger.error("invalid type potential traffic")
-        if "Current Value" in df.iloc[i] and not pd.isna(df.iloc[i]["Current Value"]):
-            if isinstance(df.iloc[i]["Current Value"], np.float64) or isinstance(
-                    df.iloc[i]["Current Value"], np.int64):
-                key_link.current_value = df.iloc[i]["Current Value"]
-            else:
-                job_logger.error("invalid type current value")
-        if "Potential Value" in df.iloc[i] and not pd.isna(df.iloc[i]["Potential Value"]):
-            if isinstance(df.iloc[i]["Potential Value"], np.float64) or isinstance(
-                    df.iloc[i]["Potential Value"], np.int64):
-                key_link.potential_value = df.iloc[i]["Potential Value"]
-            else:
-                job_logger.error("invalid type potential value")
-        if "Fibonacci Helper" in df.iloc[i] and not pd.isna(df.iloc[i]["Fibonacci Helper"]):
-            if isinstance(df.iloc[i]["Fibonacci Helper"], np.float64) or isinstance(
-                    df.iloc[i]["Fibonacci Helper"], np.int64):
-                key_link.fibonacci_helper = df.iloc[i]["Fibonacci Helper"]
-            else:
-                job_logger.error("invalid type fibonacci helper")
-        if "Value Opportunity" in df.iloc[i] and not pd.isna(df.iloc[i]["Value Opportunity"]):
-            if isinstance(df.iloc[i]["Value Opportunity"], np.float64) or isinstance(
-                    df.iloc[i]["Value Opportunity"], np.int64):
-                key_link.value_opportunity = df.iloc[i]["Value Opportunity"]
-            else:
-                job_logger.error("invalid type value opportunity")
-        if "Volume Opportunity" in df.iloc[i] and not pd.isna(df.iloc[i]["Volume Opportunity"]):
-            if isinstance(df.iloc[i]["Volume Opportunity"], np.float64) or isinstance(
-                    df.iloc[i]["Volume Opportunity"], np.int64):
-                key_link.volume_opportunity = df.iloc[i]["Volume Opportunity"]
-            else:
-                job_logger.error("invalid type volume opportunity")
-        if "CPC" in df.iloc[i] and not pd.isna(df.iloc[i]["CPC"]):
-            if isinstance(df.iloc[i]["CPC"], np.float64) or isinstance(
-                    df.iloc[i]["CPC"], np.int64):
-                key_link.cpc = df.iloc[i]["CPC"]
-            else:
-                job_logger.error("invalid type CPC")
-        if "CPS" in df.iloc[i] and not pd.isna(df.iloc[i]["CPS"]):
-            if isinstance(df.iloc[i]["CPS"], np.float64) or isinstance(
-                    df.iloc[i]["CPS"], np.int64):
-                key_link.cps = df.iloc[i]["CPS"]
-            else:
-                job_logger.error("invalid type CPS")
+        key_link.search_volume = volume
+        key_link.rank = Rank()
+        key_link_dict.append(key_link)
 
-        if "Primary Intents" in df.iloc[i] and not pd.isna(df.iloc[i]["Primary Intents"]):
-            if isinstance(df.iloc[i]["Primary Intents"], str):
-                key_link.primary_search_intents = df.iloc[i]["Primary Intents"]
-            else:
-                job_logger.error("invalid type primary intents")
-        if "Secondary Intents" in df.iloc[i] and not pd.isna(df.iloc[i]["Secondary Intents"]):
-            if isinstance(df.iloc[i]["Secondary Intents"], str):
-                key_link.secondary_search_intents = df.iloc[i]["Secondary Intents"]
-            else:
-                job_logger.error("invalid type secondary intents")
-        if not isinstance(calc_rank, bool):
-            job_logger.error("invalid type calc_rank")
-
-        links = []
-        j = i
-        while j < data_frame_size and df.iloc[j]["Keyword"] == keyword:
-            link = Link()
-            if isinstance(df.iloc[j]["Link"], str):
-                link.url = remove_permalink(df.iloc[j]["Link"])
-            else:
-                job_logger.error("invalid type of link exist")
-            if isinstance(df.iloc[j]["Position"], np.int64):
-                link.position = df.iloc[j]["Position"]
-            else:
-                job_logger.error("invalid type of position exist")
-            if "Related Results Count" in df.iloc[j]:
-                if isinstance(df.iloc[j]["Related Results Count"], np.int64):
-                    link.related_results_count = df.iloc[j]["Related Results Count"]
-                else:
-                    job_logger.error("invalid type of related result count exist")
-            links.append(link)
-            j = j + 1
-        key_link.links = links
+    for column, attribute in [(CLIENT_RANKING_URL, "client_ranking_url"),
+                              (CLIENT_RANKING_POSITION, "client_ranking_position"),
+                              (CLIENT_URL_RANKING_COUNT, "client_url_ranking_count")]:
+        if column in node_df:
+            values = node_df[column].to_numpy()
+            for k in np.flatnonzero(~pd.isna(values)).tolist():
+                setattr(key_link_dict[k].rank, attribute, values[k])
+    for column, attribute, error in input_node_columns:
+        if column in node_df:
+            values = node_df[column].to_numpy()
+            valid = check_column_types(values, (np.float64, np.int64), error, skip_na=True)
+            for k in np.flatnonzero(valid).tolist():
+                setattr(key_link_dict[k], attribute, values[k])
+    for column, attribute, error in [("Primary Intents", "primary_search_intents", "invalid type primary intents"),
+                                     ("Secondary Intents", "secondary_search_intents",
+                                      "invalid type secondary intents")]:
+        if column in node_df:
+            values = node_df[column].to_numpy()
+            valid = check_column_types(values, str, error, skip_na=True)
+            for k in np.flatnonzero(valid).tolist():
+                setattr(key_link_dict[k], attribute, values[k])
+
+    link_values = df["Link"].to_numpy()
+    valid_links = check_column_types(link_values, str, "invalid type of link exist")
+    urls = column_values(link_values, valid_links, None)
+    positions = df["Position"].to_numpy()
+    positions = column_values(positions, check_column_types(positions, np.int64, "invalid type of position exist"),
+                              None)
+    related_results_counts = [None] * data_frame_size
+    if "Related Results Count" in df:
+        related_results_counts = df["Related Results Count"].to_numpy()
+        related_results_counts = column_values(
+            related_results_counts,
+            check_column_types(related_results_counts, np.int64, "invalid type of related result count exist"), None)
+    all_links = []
+    for url, position, related_results_count in zip(urls, positions, related_results_counts):
+        link = Link()
+        if url is not None:
+            link.url = remove_permalink(url)
+        if position is not None:
+            link.position = position
+        if related_results_count is not None:
+            link.related_results_count = related_results_count
+        all_links.append(link)
+
+    comp_rank_values = [column_values(node_df[header].to_numpy(), ~node_df[header].isna().to_numpy(), None)
+                        for header in comp_rank_headers]
+    total_competitors = len(comp_rank_headers)
+    competitor_scores = node_df['Competitor Score'].to_numpy() if 'Competitor Score' in node_df else None
+    competitor_ranking_counts = node_df['Competitor ranking count'].to_numpy() \
+        if 'Competitor ranking count' in node_df else None
+    for k, (key_link, start, stop) in enumerate(zip(key_link_dict, node_row_starts, node_row_ends)):
+        key_link.links = all_links[start:stop]
         comp_ranks = []
-        total_competitors = len(comp_rank_headers)
-        for k in range(0, total_competitors, 4):
+        for c in range(0, total_competitors, 4):
             comp_rank = Rank()
-            if comp_rank_headers[k] in df.iloc[i] and not pd.isna(df.iloc[i][comp_rank_headers[k]]):
-                comp_rank.client_ranking_url = df.iloc[i][comp_rank_headers[k]]
-            if k + 1 < total_competitors and comp_rank_headers[k + 1] in df.iloc[i] and not pd.isna(
-                    df.iloc[i][comp_rank_headers[k + 1]]):
-                comp_rank.client_ranking_position = df.iloc[i][comp_rank_headers[k + 1]]
-            if k + 2 < total_competitors and comp_rank_headers[k + 2] in df.iloc[i] and not pd.isna(
-                    df.iloc[i][comp_rank_headers[k + 2]]):
-                comp_rank.current_traffic = df.iloc[i][comp_rank_headers[k + 2]]
-            if k + 3 < total_competitors and comp_rank_headers[k + 3] in df.iloc[i] and not pd.isna(
-                    df.iloc[i][comp_rank_headers[k + 3]]):
-                comp_rank.current_value = df.iloc[i][comp_rank_headers[k + 3]]
+            if comp_rank_values[c][k] is not None:
+                comp_rank.client_ranking_url = comp_rank_values[c][k]
+            if c + 1 < total_competitors and comp_rank_values[c + 1][k] is not None:
+                comp_rank.client_ranking_position = comp_rank_values[c + 1][k]
+            if c + 2 < total_competitors and comp_rank_values[c + 2][k] is not None:
+                comp_rank.current_traffic = comp_rank_values[c + 2][k]
+            if c + 3 < total_competitors and comp_rank_values[c + 3][k] is not None:
+                comp_rank.current_value = comp_rank_values[c + 3][k]
             comp_ranks.append(comp_rank)
         key_link.competitor_ranks = comp_ranks
-        if 'Competitor Score' in df.iloc[i]:
-            key_link.competitor_score = df.iloc[i]['Competitor Score']
-        if 'Competitor ranking count' in df.iloc[i]:
-            key_link.competitor_ranking_count = df.iloc[i]['Competitor ranking count']
+        if competitor_scores is not None:
+            key_link.competitor_score = competitor_scores[k]
+        if competitor_ranking_counts is not None:
+            key_link.competitor_ranking_count = competitor_ranking_counts[k]
         if calc_rank:
             competitor_ranks = calculate_rank(key_link=key_link,
                                               competitor_domains=competitor_domains,
@@ -876,9 +1086,7 @@ def read_input(input_file_path: str,
 
         # Consider organic results within Position Threshold only
         key_link.links = [x for x in key_link.links if x.position <= organic_results_count]
-
-        key_link_dict.append(key_link)
-        i = j
+    intern_urls(key_link_dict=key_link_dict)
     return key_link_dict
 
 
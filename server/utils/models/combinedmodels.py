@@ -1,6 +1,10 @@
 class Rank:
-    client_ranking_url: str = ""
-    client_ranking_position: int = 101
-    client_url_ranking_count: int = 0
-    current_traffic: float = 0.0
-    current_value: float = 0.0
+    __slots__ = ("client_ranking_url", "client_ranking_position", "client_url_ranking_count", "current_traffic",
+                 "current_value")
+
+    def __init__(self):
+        self.client_ranking_url: str = ""
+        self.client_ranking_position: int = 101
+        self.client_url_ranking_count: int = 0
+        self.current_traffic: float = 0.0
+        self.current_value: float = 0.0
@@ -1,58 +1,76 @@
-from typing import List
+from typing import List, Optional
 from utils.constants.fetcherconstants import *
+from utils.constants.serpconstants import serp_cache_max_age
 from utils.models.combinedmodels import Rank
 
 
 class Feature:
-    answer_box: bool = False
-    organic_result_count: int = 0
-    ad_result_top_count: int = 0
-    ad_result_bottom_count: int = 0
-    ad_result_right_count: int = 0
-    featured_snippet: bool = False
-    sitelinks_search_box: bool = False
-    sitelinks_expanded: bool = False
-    sitelinks_inline: bool = False
-    events_results: bool = False
-    inline_images: bool = False
-    inline_people_also_search_for: bool = False
-    shopping_results: bool = False
-    inline_videos: bool = False
-    inline_video_carousels: bool = False
-    knowledge_graph: bool = False
-    local_results: bool = False
-    news_results: bool = False
-    top_stories: bool = False
-    inline_products: bool = False
-    recipes_results: bool = False
-    related_questions: bool = False
-    twitter_results: bool = False
+    __slots__ = ("answer_box", "organic_result_count", "ad_result_top_count", "ad_result_bottom_count",
+                 "ad_result_right_count", "featured_snippet", "sitelinks_search_box", "sitelinks_expanded",
+                 "sitelinks_inline", "events_results", "inline_images", "inline_people_also_search_for",
+                 "shopping_results", "inline_videos", "inline_video_carousels", "knowledge_graph", "local_results",
+                 "news_results", "top_stories", "inline_products", "recipes_results", "related_questions",
+                 "twitter_results")
+
+    def __init__(self):
+        self.answer_box: bool = False
+        self.organic_result_count: int = 0
+        self.ad_result_top_count: int = 0
+        self.ad_result_bottom_count: int = 0
+        self.ad_result_right_count: int = 0
+        self.featured_snippet: bool = False
+        self.sitelinks_search_box: bool = False
+        self.sitelinks_expanded: bool = False
+        self.sitelinks_inline: bool = False
+        self.events_results: bool = False
+        self.inline_images: bool = False
+        self.inline_people_also_search_for: bool = False
+        self.shopping_results: bool = False
+        self.inline_videos: bool = False
+        self.inline_video_carousels: bool = False
+        self.knowledge_graph: bool = False
+        self.local_results: bool = False
+        self.news_results: bool = False
+        self.top_stories: bool = False
+        self.inline_products: bool = False
+        self.recipes_results: bool = False
+        self.related_questions: bool = False
+        self.twitter_results: bool = False
 
 
 class Link:
-    url: str = ""
-    position: int = 0
-    title: str = ""
-    snippet: str = ""
-    related_results_count: int = 0
+    __slots__ = ("url", "position", "title", "snippet", "related_results_count")
+
+    def __init__(self):
+        self.url: str = ""
+        self.position: int = 0
+        self.title: str = ""
+        self.snippet: str = ""
+        self.related_results_count: int = 0
 
 
 class Node:
-    keyword: str = ""
-    volume: int = 5
-    links: List[Link] = []
-    primary_search_intents: List[str] = []
-    secondary_search_intents: List[str] = []
-    rank: Rank = Rank()
-    competitor_ranks: List[Rank] = []
-    difficulty: float = 0.0
-    cpc: float = -1.0
-    cps: float = -1.0
-    current_traffic: float = 0.0
-    potential_traffic: float = 0.0
-    current_value: float = 0.0
-    potential_value: float = 0.0
-    fibonacci_helper: int = 0
+    __slots__ = ("keyword", "volume", "links", "primary_search_intents", "secondary_search_intents", "rank",
+                 "competitor_ranks", "difficulty", "cpc", "cps", "current_traffic", "potential_traffic",
+                 "current_value", "potential_value", "fibonacci_helper", "answer_box")
+
+    def __init__(self):
+        self.keyword: str = ""
+        self.volume: int = 5
+        self.links: List[Link] = []
+        self.primary_search_intents: List[str] = []
+        self.secondary_search_intents: List[str] = []
+        self.rank: Rank = Rank()
+        self.competitor_ranks: List[Rank] = []
+        self.difficulty: float = 0.0
+        self.cpc: float = -1.0
+        self.cps: float = -1.0
+        self.current_traffic: float = 0.0
+        self.potential_traffic: float = 0.0
+        self.current_value: float = 0.0
+        self.potential_value: float = 0.0
+        self.fibonacci_helper: int = 0
+        self.answer_box: Optional[Link] = None
 
 
 class Arguments:
@@ -61,3 +79,4 @@ class Arguments:
     search_engine: str = SEARCH_ENGINE
     region: str = REGION
     gl: str = GL
+    cache_max_age: float = serp_cache_max_age
@@ -1,61 +1,81 @@
 from typing import List, Optional
 
+import numpy as np
+
 from utils.models.combinedmodels import Rank
 
 
 class Group:
-    number: int = 0
-    common_links: List[str] = []
-    links_in_common: int = 0
-    main_keyword: str = ""
-    highest_volume: int = 0
-    highest_volume_keyword: str = ""
-    average_kw_difficulty: float = 0.0
-    average_rank: float = 101
-    sum_of_current_values: float = 0.0
-    rank_percentage: float = 0
-    topic_volume: int = 0
-    quartile_volume: float = 0.0
-    average_rank_quartile: float = 0.0
-    sum_value_opportunity: float = 0.0
-    sum_volume_opportunity: float = 0.0
-    variant_count: int = 0
-    relevancy: float = 1.0
-    cluster: int = 0
-    potential_content_gap: bool = False
-    total_content_gap: bool = True
-    keyword_gap: bool = False
-    potential_cannibalization: bool = False
-    auto_mapped_url: str = ""
+    __slots__ = ("number", "common_links", "links_in_common", "main_keyword", "highest_volume",
+                 "highest_volume_keyword", "average_kw_difficulty", "average_rank", "sum_of_current_values",
+                 "rank_percentage", "topic_volume", "quartile_volume", "average_rank_quartile", "sum_value_opportunity",
+                 "sum_volume_opportunity", "variant_count", "relevancy", "cluster", "potential_content_gap",
+                 "total_content_gap", "keyword_gap", "potential_cannibalization", "auto_mapped_url")
+
+    def __init__(self):
+        self.number: int = 0
+        self.common_links: List[str] = []
+        self.links_in_common: int = 0
+        self.main_keyword: str = ""
+        self.highest_volume: int = 0
+        self.highest_volume_keyword: str = ""
+        self.average_kw_difficulty: float = 0.0
+        self.average_rank: float = 101
+        self.sum_of_current_values: float = 0.0
+        self.rank_percentage: float = 0
+        self.topic_volume: int = 0
+        self.quartile_volume: float = 0.0
+        self.average_rank_quartile: float = 0.0
+        self.sum_value_opportunity: float = 0.0
+        self.sum_volume_opportunity: float = 0.0
+        self.variant_count: int = 0
+        self.relevancy: float = 1.0
+        self.cluster: int = 0
+        self.potential_content_gap: bool = False
+        self.total_content_gap: bool = True
+        self.keyword_gap: bool = False
+        self.potential_cannibalization: bool = False
+        self.auto_mapped_url: str = ""
 
 
 class Link:
-    url: str = ""
-    position: int = 0
-    related_results_count: int = 0
+    __slots__ = ("url", "position", "related_results_count")
+
+    def __init__(self):
+        self.url: str = ""
+        self.position: int = 0
+        self.related_results_count: int = 0
 
 
 class Node:
-    keyword: str = ""
-    links: List[Link] = []
-    search_volume: int = 0
-    group: Optional[Group] = None
-    sub_group: Optional[Group] = None
-    primary_search_intents: str = ""
-    secondary_search_intents: str = ""
-    rank: Rank = Rank()
-    cpc: float = 0.0
-    cps: float = 0.0
-    difficulty: float = 0.0
-    current_traffic: float = 0.0
-    potential_traffic: float = 0.0
-    current_value: float = 0.0
-    potential_value: float = 0.0
-    fibonacci_helper: int = 0
-    volume_percent: float = 0.0
-    priority_score: float = 0.0
-    value_opportunity: float = 0.0
-    volume_opportunity: float = 0.0
-    competitor_ranks: List[Rank] = []
-    competitor_score: int = 1
-    competitor_ranking_count: int = 0
+    __slots__ = ("keyword", "links", "url_ids", "search_volume", "group", "sub_group", "primary_search_intents",
+                 "secondary_search_intents", "rank", "cpc", "cps", "difficulty", "current_traffic",
+                 "potential_traffic", "current_value", "potential_value", "fibonacci_helper", "volume_percent",
+                 "priority_score", "value_opportunity", "volume_opportunity", "competitor_ranks", "competitor_score",
+                 "competitor_ranking_count")
+
+    def __init__(self):
+        self.keyword: str = ""
+        self.links: List[Link] = []
+        self.url_ids: np.ndarray = np.empty(0, dtype=np.int32)
+        self.search_volume: int = 0
+        self.group: Optional[Group] = None
+        self.sub_group: Optional[Group] = None
+        self.primary_search_intents: str = ""
+        self.secondary_search_intents: str = ""
+        self.rank: Rank = Rank()
+        self.cpc: float = 0.0
+        self.cps: float = 0.0
+        self.difficulty: float = 0.0
+        self.current_traffic: float = 0.0
+        self.potential_traffic: float = 0.0
+        self.current_value: float = 0.0
+        self.potential_value: float = 0.0
+        self.fibonacci_helper: int = 0
+        self.volume_percent: float = 0.0
+        self.priority_score: float = 0.0
+        self.value_opportunity: float = 0.0
+        self.volume_opportunity: float = 0.0
+        self.competitor_ranks: List[Rank] = []
+        self.competitor_score: int = 1
+        self.competitor_ranking_count: int = 0
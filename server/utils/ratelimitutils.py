@@ -0,0 +1,368 @@
+import asyncio
+import hashlib
+import threading
+import time
+
+from utils.constants.serpconstants import *
+
+
+class TokenBucket:
+    """
+    Allows a number of requests per second with bursts of up to the capacity of the bucket
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Takes a token from the bucket if there is one
+        :return: 0 if a token was taken, otherwise seconds to wait for the next token
+        """
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens = self.tokens - 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdaptiveConcurrency:
+    """
+    Limits the number of requests in flight, adding one to the limit per round of fast requests and halving it
+    when the requests get slow or throttled
+    """
+
+    def __init__(self, min_concurrency: int, max_concurrency: int, latency_target: float):
+        self.min_concurrency = max(min_concurrency, 1)
+        self.max_concurrency = max(max_concurrency, self.min_concurrency)
+        self.latency_target = latency_target
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.decreased_at = 0.0
+
+    def take(self) -> bool:
+        """
+        Takes a slot for a request if the limit allows it
+        :return: True if a slot was taken
+        """
+        if self.in_flight >= int(self.limit):
+            return False
+        self.in_flight = self.in_flight + 1
+        return True
+
+    def release(self, latency: float, throttled: bool):
+        """
+        Gives the slot of a finished request back and adjusts the limit with its outcome
+        :param latency: seconds the request took
+        :param throttled: whether the request was throttled or failed on the server
+        """
+        self.in_flight = self.in_flight - 1
+        now = time.monotonic()
+        if throttled or latency > self.latency_target:
+            # requests sent before the previous decrease don't reflect it, so decrease at most once per target
+            if now - self.decreased_at > self.latency_target:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                self.decreased_at = now
+        else:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+
+class InProcessRateLimitStore:
+    """
+    Keeps the shared rate limiting state in this process, for a single worker or tests
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.buckets = {}
+
+    def register_job(self, jobs_key: str, job_id: str, ttl: float) -> int:
+        """
+        Marks a job as searching with an API key and drops the jobs which stopped doing so
+        :param jobs_key: key of the jobs of the API key
+        :param job_id: id of the job
+        :param ttl: seconds after which a job is dropped unless registered again
+        :return: number of jobs searching with the API key
+        """
+        now = time.time()
+        with self.lock:
+            jobs = self.jobs.setdefault(jobs_key, {})
+            jobs[job_id] = now
+            for expired_job_id in [job for job, registered_at in jobs.items() if registered_at < now - ttl]:
+                del jobs[expired_job_id]
+            return len(jobs)
+
+    def unregister_job(self, jobs_key: str, job_id: str):
+        """
+        Marks a job as done searching with an API key
+        :param jobs_key: key of the jobs of the API key
+        :param job_id: id of the job
+        """
+        with self.lock:
+            self.jobs.get(jobs_key, {}).pop(job_id, None)
+
+    def take_token(self, bucket_key: str, rate: float, capacity: float) -> float:
+        """
+        Takes a token from a bucket if there is one
+        :param bucket_key: key of the bucket
+        :param rate: tokens added to the bucket per second
+        :param capacity: maximum number of tokens in the bucket
+        :return: 0 if a token was taken, otherwise seconds to wait for the next token
+        """
+        with self.lock:
+            if bucket_key not in self.buckets:
+                self.buckets[bucket_key] = TokenBucket(rate, capacity)
+            bucket = self.buckets[bucket_key]
+            bucket.rate = rate
+            bucket.capacity = max(capacity, 1)
+            return bucket.take()
+
+    def delete(self, key: str):
+        """
+        Deletes the state kept under a key
+        :param key: key of the state
+        """
+        with self.lock:
+            self.buckets.pop(key, None)
+
+
+class RedisRateLimitStore:
+    """
+    Keeps the shared rate limiting state in Redis, so that all the workers draw from the same budget
+    """
+
+    # refills and takes from the bucket atomically on the clock of the Redis server, scripts calling TIME before
+    # writing need effects replication, which is only the default from Redis 7 on
+    take_token_script = """
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.take_token_command = self.client.register_script(self.take_token_script)
+
+    def register_job(self, jobs_key: str, job_id: str, ttl: float) -> int:
+        """
+        Marks a job as searching with an API key and drops the jobs which stopped doing so
+        :param jobs_key: key of the jobs of the API key
+        :param job_id: id of the job
+        :param ttl: seconds after which a job is dropped unless registered again
+        :return: number of jobs searching with the API key
+        """
+        now = time.time()
+        pipeline = self.client.pipeline()
+        pipeline.zadd(jobs_key, {job_id: now})
+        pipeline.zremrangebyscore(jobs_key, "-inf", now - ttl)
+        pipeline.zcard(jobs_key)
+        pipeline.expire(jobs_key, int(ttl) + 1)
+        return pipeline.execute()[2]
+
+    def unregister_job(self, jobs_key: str, job_id: str):
+        """
+        Marks a job as done searching with an API key
+        :param jobs_key: key of the jobs of the API key
+        :param job_id: id of the job
+        """
+        self.client.zrem(jobs_key, job_id)
+
+    def take_token(self, bucket_key: str, rate: float, capacity: float) -> float:
+        """
+        Takes a token from a bucket if there is one
+        :param bucket_key: key of the bucket
+        :param rate: tokens added to the bucket per second
+        :param capacity: maximum number of tokens in the bucket
+        :return: 0 if a token was taken, otherwise seconds to wait for the next token
+        """
+        return float(self.take_token_command(keys=[bucket_key], args=[rate, max(capacity, 1)]))
+
+    def delete(self, key: str):
+        """
+        Deletes the state kept under a key
+        :param key: key of the state
+        """
+        self.client.delete(key)
+
+
+rate_limit_store = None
+rate_limit_store_lock = threading.Lock()
+
+
+def get_rate_limit_store():
+    """
+    Gets the store shared by the rate limiters, Redis if SERP_RATE_LIMIT_REDIS_URL is set and this process otherwise
+    :return: rate limit store
+    """
+    global rate_limit_store
+    with rate_limit_store_lock:
+        if rate_limit_store is None:
+            if serp_rate_limit_redis_url:
+                rate_limit_store = RedisRateLimitStore(serp_rate_limit_redis_url)
+            else:
+                rate_limit_store = InProcessRateLimitStore()
+        return rate_limit_store
+
+
+class SerpRateLimiter:
+    """
+    Keeps the searches of a job within its share of the requests per second of the API key, which is split evenly
+    between the jobs searching with it across all the workers, and within an adaptive concurrency limit
+    """
+
+    def __init__(self, api_key: str, job_id: str, store, requests_per_second: float = serp_requests_per_second,
+                 burst: float = serp_burst, min_concurrency: int = serp_min_concurrency,
+                 max_concurrency: int = serp_max_concurrency, latency_target: float = serp_latency_target):
+        # the API key itself is kept out of the store
+        key_id = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+        self.jobs_key = f"serp:{key_id}:jobs"
+        self.bucket_key = f"serp:{key_id}:bucket:{job_id}"
+        self.job_id = job_id
+        self.store = store
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.job_count = 1
+        self.registered_at = 0.0
+        self.concurrency = AdaptiveConcurrency(min_concurrency, max_concurrency, latency_target)
+        self.condition = threading.Condition()
+
+    def take_token(self) -> float:
+        """
+        Takes a token from the bucket of the job, registering the job again once in a while to keep its share
+        :return: 0 if a token was taken, otherwise seconds to wait for the next token
+        """
+        if self.requests_per_second <= 0:
+            return 0
+        now = time.monotonic()
+        if now - self.registered_at > serp_job_heartbeat_interval:
+            self.registered_at = now
+            self.job_count = max(self.store.register_job(self.jobs_key, self.job_id, 3 * serp_job_heartbeat_interval),
+                                 1)
+        return self.store.take_token(self.bucket_key, self.requests_per_second / self.job_count,
+                                     self.burst / self.job_count)
+
+    def try_acquire(self) -> float:
+        """
+        Takes a slot and a token for a search if both are available
+        :return: 0 if the search can be sent, otherwise seconds to wait before trying again
+        """
+        with self.condition:
+            if not self.concurrency.take():
+                return serp_rate_limit_poll_interval
+        wait = self.take_token()
+        if wait:
+            with self.condition:
+                self.concurrency.in_flight = self.concurrency.in_flight - 1
+                self.condition.notify()
+        return wait
+
+    def acquire(self):
+        """
+        Blocks the calling thread until a search can be sent
+        """
+        wait = self.try_acquire()
+        while wait:
+            with self.condition:
+                self.condition.wait(wait)
+            wait = self.try_acquire()
+
+    async def acquire_async(self):
+        """
+        Suspends the calling coroutine until a search can be sent
+        """
+        wait = self.try_acquire()
+        while wait:
+            await asyncio.sleep(wait)
+            wait = self.try_acquire()
+
+    def release(self, latency: float, throttled: bool):
+        """
+        Marks a search as finished
+        :param latency: seconds the search took
+        :param throttled: whether the search was throttled or failed on the server
+        """
+        with self.condition:
+            self.concurrency.release(latency, throttled)
+            self.condition.notify()
+
+    def close(self):
+        """
+        Gives the share of the job back to the other jobs of the API key
+        """
+        if self.requests_per_second > 0:
+            self.store.unregister_job(self.jobs_key, self.job_id)
+            self.store.delete(self.bucket_key)
+
+
+rate_limiters = {}
+rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_key: str, job_id: str) -> SerpRateLimiter:
+    """
+    Gets the rate limiter shared by all the searches of a job
+    :param api_key: SERP API key
+    :param job_id: id of the job
+    :return: rate limiter of the job
+    """
+    with rate_limiters_lock:
+        if (api_key, job_id) not in rate_limiters:
+            rate_limiters[(api_key, job_id)] = SerpRateLimiter(api_key, job_id, get_rate_limit_store(),
+                                                               **serp_api_key_limits.get(api_key, {}))
+        return rate_limiters[(api_key, job_id)]
+
+
+def release_rate_limiter(api_key: str, job_id: str):
+    """
+    Drops the rate limiter of a job once it is done searching
+    :param api_key: SERP API key
+    :param job_id: id of the job
+    """
+    with rate_limiters_lock:
+        rate_limiter = rate_limiters.pop((api_key, job_id), None)
+    if rate_limiter is not None:
+        rate_limiter.close()
+
+
+def is_throttled(status_code: int) -> bool:
+    """
+    Checks whether a SERP API response asks to slow down
+    :param status_code: HTTP status code of the response
+    :return: True if the search was throttled or failed on the server
+    """
+    return status_code == 429 or status_code >= 500
+
+
+def get_retry_delay(attempt: int) -> float:
+    """
+    Gets the seconds to wait before retrying a throttled search
+    :param attempt: number of the failed attempt, starting at 0
+    :return: seconds to wait
+    """
+    return serp_retry_delay * 2 ** attempt
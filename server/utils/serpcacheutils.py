@@ -0,0 +1,326 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional
+
+from utils.constants.serpconstants import *
+
+
+class SqliteSerpCache:
+    """
+    Keeps the SERP API results on local disk, evicting the least recently used results beyond the size limit
+    """
+
+    def __init__(self, path: str, max_size: int):
+        self.path = path
+        self.max_size = max_size
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.puts = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.get_connection().execute("CREATE TABLE IF NOT EXISTS serp_results (key TEXT PRIMARY KEY, "
+                                      "fetched_at REAL, used_at REAL, size INTEGER, results BLOB)")
+        self.get_connection().execute("CREATE INDEX IF NOT EXISTS serp_results_used_at ON serp_results (used_at)")
+        self.get_connection().execute("CREATE TABLE IF NOT EXISTS serp_claims (key TEXT PRIMARY KEY, expires_at REAL)")
+
+    def get_connection(self) -> sqlite3.Connection:
+        """
+        Gets the connection of the calling thread to the cache file
+        :return: connection to the cache file
+        """
+        if not hasattr(self.local, "connection"):
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return self.local.connection
+
+    def get(self, key: str, max_age: float) -> Optional[bytes]:
+        """
+        Gets the cached results of a search if they are recent enough
+        :param key: key of the search
+        :param max_age: maximum age of the results in seconds
+        :return: compressed results, None if not cached
+        """
+        now = time.time()
+        connection = self.get_connection()
+        row = connection.execute("SELECT results FROM serp_results WHERE key = ? AND fetched_at >= ?",
+                                 (key, now - max_age)).fetchone()
+        if row is None:
+            return None
+        connection.execute("UPDATE serp_results SET used_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key: str, results: bytes):
+        """
+        Caches the results of a search
+        :param key: key of the search
+        :param results: compressed results
+        """
+        now = time.time()
+        connection = self.get_connection()
+        connection.execute("INSERT OR REPLACE INTO serp_results VALUES (?, ?, ?, ?, ?)",
+                           (key, now, now, len(results), results))
+        with self.lock:
+            self.puts = self.puts + 1
+            evict = self.puts % serp_cache_eviction_interval == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used results until the cache is back to 90% of its size limit
+        """
+        connection = self.get_connection()
+        size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM serp_results").fetchone()[0]
+        if size <= self.max_size:
+            return
+        excess = size - int(self.max_size * 0.9)
+        freed = 0
+        keys = []
+        for key, result_size in connection.execute("SELECT key, size FROM serp_results ORDER BY used_at"):
+            keys.append((key,))
+            freed = freed + result_size
+            if freed >= excess:
+                break
+        connection.executemany("DELETE FROM serp_results WHERE key = ?", keys)
+
+    def claim(self, key: str, ttl: float) -> bool:
+        """
+        Claims a search for the calling job unless a running job already claimed it
+        :param key: key of the search
+        :param ttl: seconds after which the claim expires
+        :return: True if the search was claimed
+        """
+        now = time.time()
+        connection = self.get_connection()
+        connection.execute("DELETE FROM serp_claims WHERE key = ? AND expires_at < ?", (key, now))
+        return connection.execute("INSERT OR IGNORE INTO serp_claims VALUES (?, ?)", (key, now + ttl)).rowcount == 1
+
+    def is_claimed(self, key: str) -> bool:
+        """
+        Checks whether a running job is searching
+        :param key: key of the search
+        :return: True if the search is claimed
+        """
+        return self.get_connection().execute("SELECT 1 FROM serp_claims WHERE key = ? AND expires_at >= ?",
+                                             (key, time.time())).fetchone() is not None
+
+    def release(self, key: str):
+        """
+        Releases the claim on a search
+        :param key: key of the search
+        """
+        self.get_connection().execute("DELETE FROM serp_claims WHERE key = ?", (key,))
+
+
+class RedisSerpCache:
+    """
+    Keeps the SERP API results in Redis, shared by all the workers. Size is bounded by the maxmemory policy of
+    the server, the results expire after the longest age a job may accept
+    """
+
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str, max_age: float) -> Optional[bytes]:
+        """
+        Gets the cached results of a search if they are recent enough
+        :param key: key of the search
+        :param max_age: maximum age of the results in seconds
+        :return: compressed results, None if not cached
+        """
+        fetched_at, results = self.client.hmget(f"serp:cache:{key}", "fetched_at", "results")
+        if results is None or float(fetched_at) < time.time() - max_age:
+            return None
+        return results
+
+    def put(self, key: str, results: bytes):
+        """
+        Caches the results of a search
+        :param key: key of the search
+        :param results: compressed results
+        """
+        pipeline = self.client.pipeline()
+        pipeline.hset(f"serp:cache:{key}", mapping={"fetched_at": time.time(), "results": results})
+        pipeline.expire(f"serp:cache:{key}", int(serp_cache_max_ttl))
+        pipeline.execute()
+
+    def claim(self, key: str, ttl: float) -> bool:
+        """
+        Claims a search for the calling job unless a running job already claimed it
+        :param key: key of the search
+        :param ttl: seconds after which the claim expires
+        :return: True if the search was claimed
+        """
+        return bool(self.client.set(f"serp:claim:{key}", 1, nx=True, ex=int(ttl)))
+
+    def is_claimed(self, key: str) -> bool:
+        """
+        Checks whether a running job is searching
+        :param key: key of the search
+        :return: True if the search is claimed
+        """
+        return bool(self.client.exists(f"serp:claim:{key}"))
+
+    def release(self, key: str):
+        """
+        Releases the claim on a search
+        :param key: key of the search
+        """
+        self.client.delete(f"serp:claim:{key}")
+
+
+serp_cache = None
+serp_cache_lock = threading.Lock()
+cache_stats = {}
+
+
+def get_serp_cache():
+    """
+    Gets the SERP cache, Redis if SERP_CACHE_REDIS_URL is set and the local disk otherwise
+    :return: SERP cache
+    """
+    global serp_cache
+    with serp_cache_lock:
+        if serp_cache is None:
+            if serp_cache_redis_url:
+                serp_cache = RedisSerpCache(serp_cache_redis_url)
+            else:
+                serp_cache = SqliteSerpCache(serp_cache_path, serp_cache_max_size)
+        return serp_cache
+
+
+def normalize_keyword(keyword: str) -> str:
+    """
+    Normalizes the case and whitespace of a keyword, which don't change its search results
+    :param keyword: keyword to normalize
+    :return: normalized keyword
+    """
+    return " ".join(keyword.split()).casefold()
+
+
+def get_cache_key(params: dict) -> str:
+    """
+    Gets the key of a search from the parameters which change its results
+    :param params: search parameters
+    :return: key of the search
+    """
+    search = [str(params.get(name, "")) for name in ("engine", "location", "gl", "num")]
+    search.append(normalize_keyword(str(params.get("q", ""))))
+    return hashlib.sha256(json.dumps(search).encode()).hexdigest()
+
+
+def get_cached_results(params: dict, max_age: float, job_id: str) -> Optional[dict]:
+    """
+    Gets the cached results of a search and counts the hit or miss for the job
+    :param params: search parameters
+    :param max_age: maximum age of the results in seconds, 0 to always search
+    :param job_id: id of the current job
+    :return: SERP API results, None if not cached
+    """
+    if max_age <= 0:
+        return None
+    results = get_serp_cache().get(get_cache_key(params), max_age)
+    with serp_cache_lock:
+        stats = cache_stats.setdefault(job_id, [0, 0, 0])
+        stats[results is None] += 1
+    if results is None:
+        return None
+    return json.loads(zlib.decompress(results))
+
+
+def cache_results(params: dict, results: dict):
+    """
+    Caches the results of a search unless SERP API answered with an error
+    :param params: search parameters
+    :param results: SERP API results
+    """
+    if "error" not in results:
+        get_serp_cache().put(get_cache_key(params), zlib.compress(json.dumps(results).encode()))
+
+
+def claim_search(params: dict) -> bool:
+    """
+    Claims a search so that the running jobs needing the same results wait for them instead of searching
+    :param params: search parameters
+    :return: True if the search was claimed, False if a running job is already searching
+    """
+    return get_serp_cache().claim(get_cache_key(params), serp_claim_ttl)
+
+
+def release_search(params: dict):
+    """
+    Releases the claim on a search once its results are cached or it failed
+    :param params: search parameters
+    """
+    get_serp_cache().release(get_cache_key(params))
+
+
+def check_claimed_search(params: dict, max_age: float, job_id: str):
+    """
+    Checks whether the job searching a claimed search is done
+    :param params: search parameters
+    :param max_age: maximum age of the results in seconds
+    :param job_id: id of the current job
+    :return: whether the search is done and its results, None if the search failed
+    """
+    key = get_cache_key(params)
+    cache = get_serp_cache()
+    # the claim is checked first as the results are cached before it is released
+    claimed = cache.is_claimed(key)
+    results = cache.get(key, max_age)
+    if results is None:
+        return not claimed, None
+    with serp_cache_lock:
+        cache_stats.setdefault(job_id, [0, 0, 0])[2] += 1
+    return True, json.loads(zlib.decompress(results))
+
+
+def wait_for_claimed_search(params: dict, max_age: float, job_id: str) -> Optional[dict]:
+    """
+    Blocks the calling thread until the job searching a claimed search is done
+    :param params: search parameters
+    :param max_age: maximum age of the results in seconds
+    :param job_id: id of the current job
+    :return: SERP API results, None if the search failed
+    """
+    done, results = check_claimed_search(params, max_age, job_id)
+    while not done:
+        time.sleep(serp_claim_poll_interval)
+        done, results = check_claimed_search(params, max_age, job_id)
+    return results
+
+
+async def wait_for_claimed_search_async(params: dict, max_age: float, job_id: str) -> Optional[dict]:
+    """
+    Suspends the calling coroutine until the job searching a claimed search is done, checking the claim on the
+    threads of the default executor
+    :param params: search parameters
+    :param max_age: maximum age of the results in seconds
+    :param job_id: id of the current job
+    :return: SERP API results, None if the search failed
+    """
+    loop = asyncio.get_running_loop()
+    done, results = await loop.run_in_executor(None, check_claimed_search, params, max_age, job_id)
+    while not done:
+        await asyncio.sleep(serp_claim_poll_interval)
+        done, results = await loop.run_in_executor(None, check_claimed_search, params, max_age, job_id)
+    return results
+
+
+def pop_cache_stats(job_id: str) -> tuple:
+    """
+    Gets the cache hits, misses and results shared by running jobs of a job and stops counting them
+    :param job_id: id of the job
+    :return: number of hits, number of misses and number of results shared by running jobs
+    """
+    with serp_cache_lock:
+        hits, misses, shared = cache_stats.pop(job_id, [0, 0, 0])
+    return hits, misses, shared
@@ -0,0 +1,276 @@
+import asyncio
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import time
+from typing import Callable, Iterable, List
+
+import aiohttp
+
+from utils.fetcherutils import *
+from utils.constants.serpconstants import *
+
+
+async def search_serp(session: aiohttp.ClientSession, params: dict, rate_limiter: SerpRateLimiter) -> dict:
+    """
+    Hits SERP API with the given parameters over the shared session within the limits of the API key, retrying
+    the throttled searches. Searches still throttled after the last retry raise, other errors are returned as SERP
+    API answered them and parse to no results
+    :param session: session keeping the connections to SERP API alive
+    :param params: search parameters
+    :param rate_limiter: rate limiter of the API key
+    :return: SERP API results
+    """
+    request_params = {key: str(value) for key, value in params.items()}
+    request_params["output"] = "json"
+    request_params["source"] = "python"
+    for attempt in range(serp_max_retries + 1):
+        await rate_limiter.acquire_async()
+        start = time.monotonic()
+        throttled = True
+        try:
+            async with session.get(serp_api_url, params=request_params) as response:
+                throttled = is_throttled(response.status)
+                if not throttled or attempt == serp_max_retries:
+                    if throttled:
+                        response.raise_for_status()
+                    search_results = dict(await response.json(content_type=None))
+                    if not response.ok:
+                        log_search_error(params, response.status, search_results)
+                    return search_results
+        finally:
+            rate_limiter.release(time.monotonic() - start, throttled)
+        await asyncio.sleep(get_retry_delay(attempt))
+
+
+async def get_keyword_search_results_async(session: aiohttp.ClientSession, params: dict, arguments: Arguments,
+                                           rate_limiter: SerpRateLimiter, job_id: str) -> dict:
+    """
+    Gets the results of a search from the cache, from a running job doing the same search or from SERP API
+    :param session: session keeping the connections to SERP API alive
+    :param params: search parameters
+    :param arguments: search arguments
+    :param rate_limiter: rate limiter of the job
+    :param job_id: id of the current job
+    :return: SERP API results
+    """
+    # the cache is read and written on the threads of the default executor, so that it doesn't block the event loop
+    loop = asyncio.get_running_loop()
+    shared = arguments.cache_max_age > 0
+    claimed = False
+    if shared:
+        search_results = await loop.run_in_executor(None, get_cached_results, params, arguments.cache_max_age,
+                                                    job_id)
+        if search_results is not None:
+            return search_results
+        claimed = await loop.run_in_executor(None, claim_search, params)
+        if not claimed:
+            search_results = await wait_for_claimed_search_async(params, arguments.cache_max_age, job_id)
+            if search_results is not None:
+                return search_results
+    try:
+        search_results = await search_serp(session, params, rate_limiter)
+        await loop.run_in_executor(None, cache_results, params, search_results)
+    finally:
+        if claimed:
+            await loop.run_in_executor(None, release_search, params)
+    return search_results
+
+
+async def fetch_keywords(queries: Iterable[Node], arguments: Arguments, store: Callable, concurrency: int,
+                         job_id: str, target_domain: str = "", competitor_domains: List[str] = None):
+    """
+    Gets the links of all the keywords with a fixed number of searches in flight, searching duplicate keywords
+    once and handing the node of every keyword over to the store as soon as its results are parsed
+    :param queries: keywords to get links
+    :param arguments: search arguments
+    :param store: function called with the node of every fetched keyword, None if the keyword is misspelled
+    :param concurrency: maximum number of searches in flight
+    :param job_id: id of the current job
+    :param target_domain: target domain to be ranked
+    :param competitor_domains: list of competitor domains
+    :return: number of keywords whose links could not be fetched
+    """
+    query_groups = iter(group_duplicate_queries(queries))
+    rate_limiter = get_rate_limiter(arguments.api_key, job_id)
+    failed_count = 0
+    loop = asyncio.get_running_loop()
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=serp_request_timeout)
+
+    def store_key_links(key_links: list):
+        for key_link in key_links:
+            store(key_link)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def search_queries():
+            nonlocal failed_count
+            # every searcher takes the next group of duplicate keywords as soon as its previous search is done
+            for query_group in query_groups:
+                try:
+                    search_results = await get_keyword_search_results_async(
+                        session, get_search_params(query=query_group[0], arguments=arguments), arguments,
+                        rate_limiter, job_id)
+                    if serp_archive_enabled:
+                        # the archive is written on the threads of the default executor, as the cache is
+                        await loop.run_in_executor(None, archive_search_results, job_id,
+                                                   normalize_keyword(query_group[0].keyword), search_results)
+                    key_links = [process_search_results(query=query, search_results=search_results,
+                                                        target_domain=target_domain,
+                                                        competitor_domains=competitor_domains)
+                                 for query in query_group]
+                    # the store may block while the snapshot writer catches up, so it is left to the executor
+                    await loop.run_in_executor(None, store_key_links, key_links)
+                except Exception as e:
+                    failed_count = failed_count + len(query_group)
+                    job_logger.error(f"Could not get links for {query_group[0].keyword}: {e}")
+
+        await asyncio.gather(*[search_queries() for _ in range(concurrency)])
+    return failed_count
+
+
+def fetch_keywords_async(queries: Iterable[Node], arguments: Arguments, store: Callable,
+                         concurrency: int = serp_concurrency, job_id: str = "", target_domain: str = "",
+                         competitor_domains: List[str] = None):
+    """
+    Gets the links of all the keywords from SERP API on an event loop instead of a thread per search
+    :param queries: keywords to get links
+    :param arguments: search arguments
+    :param store: function called with the node of every fetched keyword, None if the keyword is misspelled
+    :param concurrency: maximum number of searches in flight
+    :param job_id: id of the current job
+    :param target_domain: target domain to be ranked
+    :param competitor_domains: list of competitor domains
+    :return: number of keywords whose links could not be fetched
+    """
+    return asyncio.run(fetch_keywords(queries=queries, arguments=arguments, store=store,
+                                      concurrency=max(concurrency, 1), job_id=job_id, target_domain=target_domain,
+                                      competitor_domains=competitor_domains))
+
+
+def fetch_keywords_in_threads(queries: List[Node], arguments: Arguments, snapshot_writer: SnapshotWriter,
+                              job_id: str, target_domain: str = "", competitor_domains: List[str] = None,
+                              workers: int = 100, window: int = serp_submission_window) -> int:
+    """
+    Gets the links of all the keywords on a pool of threads, submitting keywords as earlier ones complete so that
+    only a window of them is held by the executor
+    :param queries: keywords to get links
+    :param arguments: search arguments
+    :param snapshot_writer: writer taking the snapshots of the job
+    :param job_id: id of the current job
+    :param target_domain: target domain to be ranked
+    :param competitor_domains: list of competitor domains
+    :param workers: number of threads searching
+    :param window: maximum number of keyword groups submitted and not yet done
+    :return: number of keywords whose links could not be fetched
+    """
+    failed_count = 0
+    in_flight = dict()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as exe:
+        for query_group in group_duplicate_queries(queries):
+            if len(in_flight) >= window:
+                done, not_done = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                failed_count += collect_fetch_results(done, in_flight)
+            in_flight[exe.submit(get_keyword_links, query_group, arguments, snapshot_writer, job_id,
+                                 target_domain, competitor_domains)] = query_group
+
+        done, not_done = concurrent.futures.wait(in_flight, return_when=concurrent.futures.ALL_COMPLETED)
+        failed_count += collect_fetch_results(done, in_flight)
+    return failed_count
+
+
+def rerank_archived_batch(archive_job_id: str, batch: list, target_domain: str = "",
+                          competitor_domains: List[str] = None) -> list:
+    """
+    Parses the archived results of a batch of duplicate keyword groups again
+    :param archive_job_id: id of the job whose archive is read
+    :param batch: list of the offsets and lengths of the frames of the groups with their keywords
+    :param target_domain: target domain to be ranked
+    :param competitor_domains: list of competitor domains
+    :return: list of the node of every keyword, None for the misspelled keywords
+    """
+    archive_path, index_path = get_archive_paths(archive_job_id)
+    key_link_dict = []
+    with open(archive_path, "rb") as archive_file:
+        for offset, length, query_group in batch:
+            search_results = read_archived_results(archive_file, offset, length)
+            for query in query_group:
+                key_link_dict.append(process_search_results(query=query, search_results=search_results,
+                                                            target_domain=target_domain,
+                                                            competitor_domains=competitor_domains))
+    return key_link_dict
+
+
+def fetch_keywords_from_archive(queries: List[Node], archive_job_id: str, store: Callable,
+                                processes: int = archive_processes, target_domain: str = "",
+                                competitor_domains: List[str] = None) -> int:
+    """
+    Gets the links of all the keywords from the raw SERP archive of a job instead of SERP API, parsing the
+    archived results in parallel
+    :param queries: keywords to get links
+    :param archive_job_id: id of the job whose archive is read
+    :param store: function called with the node of every keyword, None if the keyword is misspelled
+    :param processes: number of worker processes, 1 parses the results in this process
+    :param target_domain: target domain to be ranked
+    :param competitor_domains: list of competitor domains
+    :return: number of keywords missing from the archive
+    """
+    archive_index = read_archive_index(archive_job_id)
+    if not archive_index:
+        job_logger.error(f"Could not find the archive of {archive_job_id}")
+        return len(queries)
+    archived_groups = []
+    failed_count = 0
+    for query_group in group_duplicate_queries(queries):
+        key = normalize_keyword(query_group[0].keyword)
+        if key in archive_index:
+            archived_groups.append((*archive_index[key], query_group))
+        else:
+            failed_count = failed_count + len(query_group)
+            job_logger.error(f"Could not find {query_group[0].keyword} in the archive of {archive_job_id}")
+    # frames are read in the order they were written
+    archived_groups.sort(key=lambda archived_group: archived_group[0])
+    batches = [archived_groups[i:i + archive_batch_size] for i in range(0, len(archived_groups), archive_batch_size)]
+    if processes > 1 and len(batches) > 1:
+        done_batches = 0
+        executor = None
+        try:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+            futures = [executor.submit(rerank_archived_batch, archive_job_id, batch, target_domain,
+                                       competitor_domains) for batch in batches]
+            for future in futures:
+                key_link_dict = future.result()
+                done_batches = done_batches + 1
+                for key_link in key_link_dict:
+                    store(key_link)
+        except (AssertionError, OSError, BrokenProcessPool) as e:
+            job_logger.error(f"Could not parse the archive in parallel, parsing it serially: {e}")
+        else:
+            return failed_count
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+        # the keywords of the batches already parsed are stored, only the remaining ones are parsed again
+        batches = batches[done_batches:]
+    for batch in batches:
+        for key_link in rerank_archived_batch(archive_job_id, batch, target_domain, competitor_domains):
+            store(key_link)
+    return failed_count
+
+
+def get_fetch_options(request_data: dict) -> dict:
+    """
+    Gets the fetch engine options of a job from its request data
+    :param request_data: data of the job request
+    :return: dictionary with the fetch engine, the concurrency, the cache max age and the archive of the job
+    """
+    fetch_options = {"fetch_engine": thread_fetch_engine, "fetch_concurrency": serp_concurrency,
+                     "cache_max_age": serp_cache_max_age}
+    if "fetch_engine" in request_data:
+        fetch_options["fetch_engine"] = request_data["fetch_engine"]
+    if "fetch_concurrency" in request_data:
+        fetch_options["fetch_concurrency"] = int(request_data["fetch_concurrency"])
+    if "archive_job_id" in request_data:
+        fetch_options["archive_job_id"] = request_data["archive_job_id"]
+    if "cache_max_age" in request_data:
+        fetch_options["cache_max_age"] = min(float(request_data["cache_max_age"]), serp_cache_max_ttl)
+    return fetch_options